@@ -0,0 +1,201 @@
+"""CLI sin interfaz para escanear listas grandes de objetivos.
+
+Lee objetivos (IPs, CIDRs, rangos "10.0.0.1-20" u hostnames) de los argumentos,
+de ficheros o de stdin (`-f -`), los deduplica, los parte en bloques y los
+escanea en paralelo. Cada host se emite en cuanto termina su bloque como una
+línea NDJSON en stdout: {"ip", "puertos_abiertos", "alertas"}. Los errores van
+a stderr y el código de salida es 1 si algún bloque falla.
+
+Modos:
+  - local (por defecto): llama a escanear_red / escanear_red_tcp en este proceso;
+    con --guardar inserta los resultados en la BD (DATABASE_URL) en lotes;
+  - --api URL: envía cada bloque a GET /scan del backend, que ya los guarda.
+
+Uso (desde backend/app):
+    python cli.py 192.168.1.0/24 10.0.0.1-50
+    python cli.py -f objetivos.txt --paralelismo 8 --guardar > resultados.ndjson
+    cat objetivos.txt | python cli.py -f - --motor tcp --api http://127.0.0.1:8000
+
+Solo importa lo necesario para el modo elegido (nada de Streamlit ni pandas).
+"""
+import argparse
+import ipaddress
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+MOTORES = ("nmap", "tcp")
+
+
+def leer_objetivos(args_objetivos, ficheros):
+    """Objetivos de los argumentos y de cada fichero ('-' = stdin); ignora líneas vacías y comentarios '#'."""
+    yield from args_objetivos
+    for ruta in ficheros:
+        f = sys.stdin if ruta == "-" else open(ruta, encoding="utf-8")
+        try:
+            for linea in f:
+                linea = linea.split("#", 1)[0]
+                yield from linea.replace(",", " ").split()
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def normalizar(objetivos):
+    """Deduplica: fusiona IPs, redes y rangos solapados o contiguos, y quita hostnames repetidos.
+
+    Devuelve (redes IPv4/IPv6 colapsadas, hostnames y demás en su orden de llegada).
+    """
+    from services.scan_engine import _parse_rango
+
+    redes = {4: [], 6: []}
+    otros = {}
+    for objetivo in objetivos:
+        try:
+            partes = _parse_rango(objetivo) or [ipaddress.ip_network(objetivo, strict=False)]
+        except ValueError:
+            otros.setdefault(objetivo, None)
+            continue
+        for red in partes:
+            redes[red.version].append(red)
+    colapsadas = [r for version in (4, 6) for r in ipaddress.collapse_addresses(redes[version])]
+    return colapsadas, list(otros)
+
+
+def bloques(redes, otros, prefijo):
+    """Bloques de escaneo de como mucho /prefijo (las IPs sueltas se agrupan en el mismo bloque)."""
+    from services.scan_engine import dividir_objetivo
+
+    # mismo reparto que dividir_objetivo, pero sobre redes ya colapsadas de varias líneas
+    grupo, tam, version = [], 0, None
+    for red in redes:
+        if red.prefixlen < prefijo:
+            yield from (str(s) for s in red.subnets(new_prefix=prefijo))
+            continue
+        capacidad = 2 ** (red.max_prefixlen - prefijo)
+        # nmap no mezcla IPv4 e IPv6 en un mismo escaneo
+        if grupo and (tam + red.num_addresses > capacidad or red.version != version):
+            yield " ".join(grupo)
+            grupo, tam = [], 0
+        grupo.append(str(red.network_address) if red.num_addresses == 1 else str(red))
+        tam += red.num_addresses
+        version = red.version
+    if grupo:
+        yield " ".join(grupo)
+    for objetivo in otros:
+        yield from dividir_objetivo(objetivo, prefijo)
+
+
+class EscanerLocal:
+    def __init__(self, motor, argumentos=None, guardar=False):
+        from services.rule_engine import get_motor
+
+        if motor == "tcp":
+            from services.async_scanner import escanear_red_tcp
+            self._escanear = escanear_red_tcp
+        else:
+            from services.scan_service import escanear_red, ARGUMENTOS_NMAP
+            argumentos = argumentos or ARGUMENTOS_NMAP
+            self._escanear = lambda bloque: escanear_red(bloque, argumentos)
+        self.reglas = get_motor()
+        self._guardar = None
+        if guardar:
+            from models import init_db
+            from services.persistence import guardar_resultados
+            init_db()
+            self._guardar = guardar_resultados
+            self._lock = threading.Lock()
+
+    def __call__(self, bloque):
+        resultados = self._escanear(bloque)
+        if isinstance(resultados, dict):
+            raise RuntimeError(resultados.get("error"))
+        alertas = self.reglas.evaluar_lote(resultados)
+        if self._guardar and resultados:
+            # SQLite admite un solo escritor: un bloque en cada transacción
+            with self._lock:
+                self._guardar(resultados, alertas)
+        return [{**h, "alertas": a_host} for h, a_host in zip(resultados, alertas)]
+
+
+class EscanerAPI:
+    def __init__(self, base, motor, timeout):
+        self.base = base.rstrip("/")
+        self.motor = motor
+        self.timeout = timeout
+
+    def __call__(self, bloque):
+        url = f"{self.base}/scan?" + urlencode({"ip": bloque, "motor": self.motor, "usar_cache": "false"})
+        try:
+            with urlopen(url, timeout=self.timeout) as r:
+                payload = json.load(r)
+        except URLError as e:
+            raise RuntimeError(f"{self.base}: {e}")
+        resultados = payload.get("resultados")
+        if isinstance(resultados, dict):
+            raise RuntimeError(resultados.get("error"))
+        por_ip = {}
+        for a in payload.get("alertas_detalle", []):
+            por_ip.setdefault(a.get("ip"), []).append(a)
+        return [{**h, "alertas": por_ip.get(h["ip"], [])} for h in resultados]
+
+
+def ejecutar(escanear, lista_bloques, paralelismo, salida=sys.stdout, errores=sys.stderr):
+    """Escanea los bloques en paralelo y escribe cada host como NDJSON; devuelve (hosts, bloques fallidos)."""
+    hosts = fallidos = 0
+    with ThreadPoolExecutor(max_workers=paralelismo) as pool:
+        futuros = {pool.submit(escanear, b): b for b in lista_bloques}
+        for futuro in as_completed(futuros):
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                fallidos += 1
+                errores.write(json.dumps({"objetivo": futuros[futuro], "error": str(e)}, ensure_ascii=False) + "\n")
+                continue
+            salida.write("".join(json.dumps(h, ensure_ascii=False) + "\n" for h in resultado))
+            salida.flush()
+            hosts += len(resultado)
+    return hosts, fallidos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("objetivos", nargs="*", help="IPs, CIDRs, rangos u hostnames")
+    parser.add_argument("-f", "--fichero", action="append", default=[], help="fichero de objetivos ('-' = stdin); repetible")
+    parser.add_argument("--motor", choices=MOTORES, default="nmap")
+    parser.add_argument("--argumentos", help="argumentos de nmap (por defecto los de escanear_red)")
+    parser.add_argument("--paralelismo", type=int, default=4, help="bloques escaneados a la vez")
+    parser.add_argument("--prefijo", type=int, default=24, help="tamaño máximo de cada bloque (/N)")
+    parser.add_argument("--guardar", action="store_true", help="modo local: inserta los resultados en la BD")
+    parser.add_argument("--api", help="URL del backend; si se indica, los bloques se envían a GET /scan")
+    parser.add_argument("--timeout", type=float, default=600, help="segundos por bloque en modo --api")
+    parser.add_argument("--solo-bloques", action="store_true", help="muestra los bloques sin escanear")
+    args = parser.parse_args(argv)
+
+    if not args.objetivos and not args.fichero:
+        parser.error("indica objetivos o --fichero")
+    if args.api and (args.guardar or args.argumentos):
+        parser.error("--guardar y --argumentos solo aplican al modo local (la API ya guarda)")
+
+    redes, otros = normalizar(leer_objetivos(args.objetivos, args.fichero))
+    lista_bloques = list(bloques(redes, otros, args.prefijo))
+    if args.solo_bloques:
+        sys.stdout.write("".join(b + "\n" for b in lista_bloques))
+        return 0
+    print(f"{len(lista_bloques)} bloque(s) de hasta /{args.prefijo}, paralelismo {args.paralelismo}", file=sys.stderr)
+
+    if args.api:
+        escanear = EscanerAPI(args.api, args.motor, args.timeout)
+    else:
+        escanear = EscanerLocal(args.motor, args.argumentos, args.guardar)
+    hosts, fallidos = ejecutar(escanear, lista_bloques, max(1, args.paralelismo))
+    print(f"{hosts} host(s), {fallidos} bloque(s) con error", file=sys.stderr)
+    return 1 if fallidos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,57 @@
 # backend/app/main.py
-from fastapi import FastAPI, Query, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
-from services.scan_service import escanear_red
-from services.ids_rules import evaluar_riesgos
-from models import ScanResult, SessionLocal, init_db
-from sqlalchemy import desc, asc
+from fastapi import FastAPI, Query, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from services.scan_engine import escanear_red_paralelo, escanear_red_paralelo_iter
+from services.scan_service import ARGUMENTOS_NMAP
+from services.async_scanner import escanear_red_tcp, expandir_hosts
+from services.ids_rules import evaluar_riesgos_detallado
+from services.rule_engine import get_motor, ReglaInvalida, SEVERIDADES, RANGO_SEVERIDAD
+from services.job_queue import crear_job_manager
+from services.scan_cache import cache as scan_cache
+from services.query_cache import cache as query_cache
+from services.diff_engine import TIPOS as TIPOS_CAMBIO
+from services.persistence import guardar_resultados
+from services.scheduler import crear_scheduler, MOTORES
+from services import retention
+from services.exporters import FORMATOS, exportar_csv, exportar_json, exportar_ndjson, comprimir_gzip
+from services import columnar_export, metrics
+from services.profiler import perfilador
+from models import ScanResult, ScanPort, ScanAlert, ScanChange, HostState, HostPort, DataVersion, ScanSchedule, ScanScheduleRun, SessionLocal, AsyncSessionLocal, async_engine, init_db
+from sqlalchemy import desc, asc, func, and_, or_, select
+from dataclasses import asdict
 from datetime import datetime
-import io, csv, json
+import asyncio, json, base64, ipaddress, os, time
 
 app = FastAPI()
 init_db()
 
+@app.middleware("http")
+async def _medir_peticion(request: Request, call_next):
+    """Latencia y estado por endpoint; perfila por muestreo las peticiones lentas si está activo."""
+    muestreo = perfilador.muestrear() if perfilador.activo else None
+    metrics.http_en_curso.inc()
+    t0 = time.perf_counter()
+    estado = 500
+    if muestreo:
+        muestreo.iniciar()
+    try:
+        response = await call_next(request)
+        estado = response.status_code
+        return response
+    finally:
+        if muestreo:
+            # join del hilo de muestreo: fuera del event loop para no parar las demás peticiones
+            await asyncio.to_thread(muestreo.detener)
+        segundos = time.perf_counter() - t0
+        metrics.http_en_curso.dec()
+        # plantilla de la ruta ("/scan/jobs/{job_id}"), no la URL: etiquetas acotadas
+        route = request.scope.get("route")
+        ruta = getattr(route, "path", "sin_ruta")
+        metrics.http_duracion.observar(segundos, metodo=request.method, ruta=ruta)
+        metrics.http_peticiones.inc(metodo=request.method, ruta=ruta, estado=estado)
+        if muestreo:
+            perfilador.registrar(muestreo, request.method, ruta, segundos)
+
 # --- helpers ---
 
 def _parse_dt(value: str | None):
@@ -22,29 +63,118 @@ def _parse_dt(value: str | None):
     except ValueError:
         raise HTTPException(status_code=400, detail=f"Fecha inválida: {value}. Usa ISO 8601, ej: 2025-08-08T10:30:00")
 
-def _apply_filters(
-    db,
+def _codificar_cursor(order_by: str, order_dir: str, row) -> str:
+    valor = getattr(row, order_by)
+    if isinstance(valor, datetime):
+        valor = valor.isoformat()
+    raw = json.dumps([order_by, order_dir, valor, row.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decodificar_cursor(cursor: str, order_by: str, order_dir: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        c_order_by, c_order_dir, valor, last_id = json.loads(raw)
+        if order_by == "fecha":
+            valor = datetime.fromisoformat(valor)
+        elif order_by == "ip" and not isinstance(valor, str):
+            raise ValueError(valor)
+        last_id = int(last_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="cursor inválido")
+    if (c_order_by, c_order_dir) != (order_by, order_dir):
+        raise HTTPException(status_code=400, detail="El cursor no corresponde a order_by/order_dir")
+    return valor, last_id
+
+def _siguiente_cursor(rows, order_by: str, order_dir: str, limit: int) -> str | None:
+    # página incompleta: no hay más resultados
+    if not rows or len(rows) < limit:
+        return None
+    return _codificar_cursor(order_by.lower(), order_dir.lower(), rows[-1])
+
+def _parse_ipv4(value: str, campo: str) -> int:
+    try:
+        direccion = ipaddress.ip_address(value.strip())
+    except ValueError:
+        direccion = None
+    if direccion is None or direccion.version != 4:
+        raise HTTPException(status_code=400, detail=f"{campo} inválido: {value}. Usa una IPv4, ej: 10.0.0.1")
+    return int(direccion)
+
+def _red_ipv4(value: str):
+    """CIDR ("10.0.0.0/8") o prefijo de octetos ("192.168.1.") como red IPv4; None si no lo es."""
+    value = value.strip()
+    if value.endswith(".") and "/" not in value:
+        octetos = value.rstrip(".").split(".")
+        if not 1 <= len(octetos) <= 3:
+            return None
+        value = ".".join(octetos + ["0"] * (4 - len(octetos))) + f"/{8 * len(octetos)}"
+    elif "/" not in value:
+        return None
+    try:
+        red = ipaddress.ip_network(value, strict=False)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"CIDR inválido: {value}. Ej: 10.0.0.0/8")
+    if red.version != 4:
+        raise HTTPException(status_code=400, detail="Los filtros por CIDR solo admiten IPv4")
+    return red
+
+def _filtros_ip(ip: str | None, ip_from: str | None, ip_to: str | None, modelo=ScanResult):
+    """Condiciones sobre `modelo` (ScanResult o HostState) para ip / ip_from / ip_to, resueltas con índice siempre que se pueda."""
+    condiciones = []
+    if ip:
+        red = _red_ipv4(ip)
+        if red is not None:
+            # rango sobre ip_num (índice B-tree)
+            condiciones.append(modelo.ip_num.between(int(red.network_address), int(red.broadcast_address)))
+        else:
+            try:
+                condiciones.append(modelo.ip == str(ipaddress.ip_address(ip.strip())))
+            except ValueError:
+                # hostnames u otros valores: coincidencia parcial (sin índice)
+                condiciones.append(modelo.ip.contains(ip))
+    if ip_from:
+        condiciones.append(modelo.ip_num >= _parse_ipv4(ip_from, "ip_from"))
+    if ip_to:
+        condiciones.append(modelo.ip_num <= _parse_ipv4(ip_to, "ip_to"))
+    return condiciones
+
+def _build_query(
     ip: str | None,
     start: str | None,
     end: str | None,
     order_by: str,
     order_dir: str,
-    limit: int,
-    offset: int,
+    puerto: int | None = None,
+    severidad: str | None = None,
+    cursor: str | None = None,
+    ip_from: str | None = None,
+    ip_to: str | None = None,
+    desde_id: int | None = None,
 ):
-    q = db.query(ScanResult)
+    """SELECT filtrado y ordenado, sin paginar (lo usan /history y las exportaciones en streaming)."""
+    q = select(ScanResult)
 
-    if ip:
-        # búsqueda parcial: "192.168.1." o exacta
-        q = q.filter(ScanResult.ip.contains(ip))
+    # IP exacta, CIDR ("10.0.0.0/8"), prefijo ("192.168.1.") o rango ip_from..ip_to
+    for condicion in _filtros_ip(ip, ip_from, ip_to):
+        q = q.where(condicion)
+
+    # solo registros posteriores a uno ya visto (refresco incremental del frontend)
+    if desde_id:
+        q = q.where(ScanResult.id > desde_id)
 
     dt_start = _parse_dt(start)
     dt_end = _parse_dt(end)
 
     if dt_start:
-        q = q.filter(ScanResult.fecha >= dt_start)
+        q = q.where(ScanResult.fecha >= dt_start)
     if dt_end:
-        q = q.filter(ScanResult.fecha <= dt_end)
+        q = q.where(ScanResult.fecha <= dt_end)
+
+    # filtros sobre las tablas normalizadas (usan sus índices, sin json.loads)
+    if puerto is not None:
+        q = q.where(ScanResult.puertos.any(ScanPort.puerto == puerto))
+    if severidad:
+        q = q.where(ScanResult.alertas_detalle.any(ScanAlert.severidad == severidad.lower()))
 
     order_map = {
         "fecha": ScanResult.fecha,
@@ -55,105 +185,787 @@ def _apply_filters(
     if not col:
         raise HTTPException(status_code=400, detail=f"order_by inválido: {order_by}. Usa: fecha, ip, id")
 
-    direction = desc if order_dir.lower() == "desc" else asc
-    q = q.order_by(direction(col))
+    descendente = order_dir.lower() == "desc"
+    direction = desc if descendente else asc
+    # id como desempate: orden estable y clave única para el cursor
+    q = q.order_by(direction(col), direction(ScanResult.id))
+
+    if cursor:
+        # keyset: continúa tras la última fila vista, sin OFFSET (coste constante en páginas profundas)
+        valor, last_id = _decodificar_cursor(cursor, order_by.lower(), order_dir.lower())
+        if col is ScanResult.id:
+            q = q.where(ScanResult.id < last_id if descendente else ScanResult.id > last_id)
+        elif descendente:
+            q = q.where(or_(col < valor, and_(col == valor, ScanResult.id < last_id)))
+        else:
+            q = q.where(or_(col > valor, and_(col == valor, ScanResult.id > last_id)))
+    return q
+
+async def _apply_filters(
+    db,
+    ip: str | None,
+    start: str | None,
+    end: str | None,
+    order_by: str,
+    order_dir: str,
+    limit: int,
+    offset: int,
+    puerto: int | None = None,
+    severidad: str | None = None,
+    cursor: str | None = None,
+    ip_from: str | None = None,
+    ip_to: str | None = None,
+    columnas=None,
+    desde_id: int | None = None,
+):
+    """Página de resultados con la sesión asíncrona.
+
+    Con `columnas` devuelve filas con solo esas columnas en lugar de objetos ScanResult.
+    """
+    q = _build_query(ip, start, end, order_by, order_dir, puerto, severidad, cursor, ip_from, ip_to, desde_id)
 
     # seguridad en paginación
     limit = max(1, min(limit, 1000))
-    offset = max(0, offset)
-    return q.offset(offset).limit(limit).all()
+    if not cursor:
+        q = q.offset(max(0, offset))
+    if columnas:
+        return (await db.execute(q.with_only_columns(*columnas).limit(limit))).all()
+    return (await db.execute(q.limit(limit))).scalars().all()
+
+_COLUMNAS_HISTORY = (
+    ScanResult.id, ScanResult.ip, ScanResult.puertos_abiertos, ScanResult.alertas,
+    ScanResult.fecha, ScanResult.ultima_vez,
+)
+
+def _history_json(rows) -> str:
+    """Array JSON de /history escrito a mano.
+
+    puertos_abiertos y alertas ya están guardados como JSON: se insertan tal
+    cual, sin json.loads ni volver a codificarlos con jsonable_encoder.
+    """
+    dumps = json.dumps
+    partes = []
+    for r in rows:
+        fecha = r.fecha.isoformat()
+        partes.append(
+            f'{{"id":{r.id},"ip":{dumps(r.ip, ensure_ascii=False)},'
+            f'"puertos_abiertos":{r.puertos_abiertos or "[]"},"alertas":{r.alertas or "[]"},'
+            f'"fecha":"{fecha}","ultima_vez":"{r.ultima_vez.isoformat() if r.ultima_vez else fecha}"}}'
+        )
+    return "[" + ",".join(partes) + "]"
+
+async def _version_datos():
+    """(número, modificado) de data_version: la comparten todos los procesos que escriben en la BD."""
+    async with async_engine.connect() as conn:
+        fila = (await conn.execute(
+            select(DataVersion.version, DataVersion.modificado).where(DataVersion.id == 1)
+        )).first()
+    return tuple(fila) if fila else (0, 0)
+
+async def _consulta_condicional(request: Request):
+    """(clave, versión, respuesta) para una consulta cacheable: 304 si el cliente ya tiene la versión
+    vigente, la respuesta guardada si está en caché, o None si hay que consultar la BD."""
+    ruta = request.url.path
+    clave = query_cache.clave(ruta, request.query_params.multi_items())
+    version = await _version_datos()
+    query_cache.sincronizar(version)
+    if query_cache.vigente(clave, version, request.headers.get("if-none-match"), request.headers.get("if-modified-since")):
+        metrics.query_cache_consultas.inc(ruta=ruta, resultado="304")
+        return clave, version, Response(status_code=304, headers=query_cache.cabeceras(clave, version))
+    guardada = query_cache.get(clave, version)
+    if guardada is not None:
+        metrics.query_cache_consultas.inc(ruta=ruta, resultado="acierto")
+        cuerpo, headers = guardada
+        return clave, version, Response(cuerpo, media_type="application/json", headers=headers)
+    metrics.query_cache_consultas.inc(ruta=ruta, resultado="fallo")
+    return clave, version, None
+
+def _respuesta_cacheable(clave, version: tuple, cuerpo: str, headers: dict | None = None) -> Response:
+    headers = {**(headers or {}), **query_cache.cabeceras(clave, version)}
+    cuerpo = cuerpo.encode("utf-8")
+    query_cache.put(clave, (cuerpo, headers), version)
+    return Response(cuerpo, media_type="application/json", headers=headers)
+
+def _guardar_resultados(resultados):
+    """Persiste un lote de hosts y devuelve sus alertas en el formato de texto histórico."""
+    return [a["mensaje"] for a in guardar_resultados(resultados)]
+
+def _guardar_lote_job(resultados):
+    """Persiste un lote de un job; devuelve (alertas, ids de scan_results)."""
+    scan_ids = []
+    return guardar_resultados(resultados, scan_ids=scan_ids), scan_ids
+
+jobs = crear_job_manager(al_completar_lote=_guardar_lote_job)
+scheduler = crear_scheduler(al_completar=_guardar_resultados)
+
+def _requiere_pyarrow():
+    if not columnar_export.disponible():
+        raise HTTPException(status_code=501, detail="Exportación columnar no disponible: instala pyarrow")
+
+def _schedule_dict(s: ScanSchedule) -> dict:
+    return {
+        "id": s.id,
+        "nombre": s.nombre,
+        "objetivo": s.objetivo,
+        "intervalo": s.intervalo,
+        "prioridad": s.prioridad,
+        "motor": s.motor,
+        "activo": s.activo,
+        "en_curso": scheduler.en_curso(s.id),
+        "proxima_ejecucion": s.proxima_ejecucion.isoformat(),
+        "ultima_ejecucion": s.ultima_ejecucion.isoformat() if s.ultima_ejecucion else None,
+        "creado": s.creado.isoformat() if s.creado else None,
+    }
+
+def _get_schedule(db, nombre: str) -> ScanSchedule:
+    s = db.execute(select(ScanSchedule).where(ScanSchedule.nombre == nombre)).scalar_one_or_none()
+    if s is None:
+        raise HTTPException(status_code=404, detail=f"Schedule no encontrado: {nombre}")
+    return s
+
+def _get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job no encontrado: {job_id}")
+    return job
 
 # --- endpoints ---
 
 @app.get("/scan")
-def escaneo(ip: str = Query(...)):
-    resultados = escanear_red(ip)
+def escaneo(
+    ip: str = Query(...),
+    usar_cache: bool = Query(True, description="Servir un escaneo idéntico reciente desde la caché"),
+    motor: str = Query("nmap", regex="^(nmap|tcp)$", description="nmap -T4 -F, o sondeo TCP connect en asyncio (top 100 puertos)"),
+    servicios_nmap: bool = Query(False, description="motor=tcp: nombres de servicio con nmap -sV solo sobre los puertos abiertos"),
+):
+    if motor == "tcp":
+        try:
+            expandir_hosts(ip)  # solo comprueba el tamaño; los hosts se generan al sondear
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    # la caché distingue motores: no devuelven exactamente lo mismo
+    argumentos = ARGUMENTOS_NMAP if motor == "nmap" else f"tcp-connect servicios_nmap={servicios_nmap}"
+    resultados = scan_cache.get(ip, argumentos) if usar_cache else None
+    desde_cache = resultados is not None
+    if not desde_cache:
+        with metrics.escaneos_en_curso.en_curso(origen="scan"):
+            if motor == "nmap":
+                resultados = escanear_red_paralelo(ip)
+            else:
+                resultados = escanear_red_tcp(ip, servicios_nmap=servicios_nmap)
+        scan_cache.put(ip, resultados, argumentos)
+        # las reglas se evalúan una sola vez por host, al persistir
+        alertas_detalle = guardar_resultados(resultados)
+    else:
+        alertas_detalle = evaluar_riesgos_detallado(resultados)
 
-    # alertas por host (no globales)
-    db = SessionLocal()
+    # opcional: alertas agregadas (todas juntas) por comodidad de cliente
+    alertas_agregadas = [a["mensaje"] for a in alertas_detalle]
+
+    return {"resultados": resultados, "alertas": alertas_agregadas, "alertas_detalle": alertas_detalle, "cache": desde_cache}
+
+@app.get("/scan/cache")
+def estado_cache():
+    return scan_cache.resumen()
+
+@app.delete("/scan/cache")
+def vaciar_cache():
+    scan_cache.invalidar()
+    return scan_cache.resumen()
+
+@app.get("/history/cache")
+async def estado_query_cache():
+    query_cache.sincronizar(await _version_datos())
+    return query_cache.resumen()
+
+@app.get("/rules")
+def reglas():
+    return get_motor().resumen()
+
+@app.post("/rules/reload")
+def recargar_reglas():
+    try:
+        total = get_motor().cargar()
+    except (OSError, ReglaInvalida) as e:
+        raise HTTPException(status_code=400, detail=f"No se pudieron cargar las reglas: {e}")
+    return {"total": total}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metricas():
+    """Métricas en formato de texto de Prometheus."""
+    return PlainTextResponse(metrics.registro.exponer(), media_type=metrics.CONTENT_TYPE)
+
+@app.post("/metrics/profiler")
+def configurar_profiler(
+    umbral_ms: float = Query(..., ge=0, description="Perfila las peticiones que tarden más; 0 lo desactiva"),
+    intervalo: float | None = Query(None, gt=0, le=1, description="Segundos entre muestras"),
+):
+    return perfilador.configurar(umbral_ms, intervalo)
+
+@app.get("/metrics/profiles")
+def perfiles_lentos():
+    return {**perfilador.estado(), "peticiones": perfilador.perfiles()}
+
+@app.delete("/metrics/profiles")
+def vaciar_perfiles():
+    perfilador.vaciar()
+    return perfilador.estado()
+
+@app.get("/scan/stream")
+def escaneo_stream(
+    ip: str = Query(...),
+    formato: str = Query("ndjson", regex="^(ndjson|sse)$"),
+    lote: int = Query(20, ge=1, le=1000, description="Hosts por escritura en BD"),
+):
+    """Emite cada host (con sus alertas) en cuanto nmap lo termina.
+
+    El objetivo se reparte en shards como en /scan (SCAN_SHARD_PREFIX,
+    SCAN_PARALELISMO). Los hosts se persisten en lotes de `lote`; si el escaneo
+    se corta o falla algún shard, lo ya recibido queda guardado y el stream
+    termina con un evento "error".
+    """
+    def _linea(evento: str, data: dict) -> str:
+        payload = json.dumps(data, ensure_ascii=False)
+        if formato == "sse":
+            return f"event: {evento}\ndata: {payload}\n\n"
+        return payload + "\n"
+
+    def _generar():
+        pendientes, alertas_pendientes = [], []
+        total = 0
+        metrics.escaneos_en_curso.inc(origen="stream")
+        try:
+            for host in escanear_red_paralelo_iter(ip):
+                total += 1
+                alertas_host = evaluar_riesgos_detallado([host])
+                pendientes.append(host)
+                alertas_pendientes.append(alertas_host)
+                yield _linea("host", {**host, "alertas": [a["mensaje"] for a in alertas_host]})
+                if len(pendientes) >= lote:
+                    guardar_resultados(pendientes, alertas_pendientes)
+                    pendientes, alertas_pendientes = [], []
+            yield _linea("fin", {"fin": True, "hosts": total})
+        except Exception as e:
+            yield _linea("error", {"error": str(e), "hosts": total})
+        finally:
+            metrics.escaneos_en_curso.dec(origen="stream")
+            if pendientes:
+                guardar_resultados(pendientes, alertas_pendientes)
+
+    media_type = "text/event-stream" if formato == "sse" else "application/x-ndjson"
+    return StreamingResponse(_generar(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+@app.post("/scan/jobs", status_code=202)
+def crear_job(ip: str = Query(..., description="IP, rango o CIDR a escanear")):
+    try:
+        job = jobs.submit(ip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.to_dict()
+
+@app.get("/scan/jobs")
+def listar_jobs():
+    return [j.to_dict() for j in jobs.listar()]
+
+@app.get("/scan/jobs/{job_id}")
+def estado_job(job_id: str):
+    """Estado del job y sus resultados, leídos de scan_results (el job solo guarda los ids)."""
+    job = _get_job(job_id)
+    scan_ids = list(job.scan_ids)
+    filas = {}
+    with SessionLocal() as db:
+        for i in range(0, len(scan_ids), 500):
+            for r in db.execute(
+                select(ScanResult.id, ScanResult.ip, ScanResult.puertos_abiertos, ScanResult.alertas)
+                .where(ScanResult.id.in_(scan_ids[i:i + 500]))
+            ):
+                filas[r.id] = r
+    # en el orden en que se escanearon; los borrados por la retención ya no aparecen
+    ordenadas = [filas[i] for i in dict.fromkeys(scan_ids) if i in filas]
+    return {
+        **job.to_dict(),
+        "resultados": [{"ip": r.ip, "puertos_abiertos": json.loads(r.puertos_abiertos or "[]")} for r in ordenadas],
+        "alertas": [a for r in ordenadas for a in json.loads(r.alertas or "[]")],
+    }
+
+@app.get("/scan/jobs/{job_id}/progress")
+def progreso_job(job_id: str):
+    job = _get_job(job_id)
+    return {"job_id": job.id, "estado": job.estado, **job.progreso}
+
+@app.delete("/scan/jobs/{job_id}")
+def cancelar_job(job_id: str):
+    _get_job(job_id)
+    return jobs.cancel(job_id).to_dict()
+
+@app.on_event("startup")
+def _iniciar_scheduler():
+    if os.getenv("SCHEDULER_ACTIVO", "1") != "0":
+        scheduler.iniciar()
+    retention.periodico.iniciar()
+
+@app.on_event("shutdown")
+def _parar_jobs():
+    jobs.shutdown()
+    scheduler.parar()
+    retention.periodico.parar()
+
+@app.get("/maintenance/retention")
+def estado_retencion():
+    return {
+        "politica": asdict(retention.politica_desde_entorno()),
+        "intervalo": retention.periodico.intervalo,
+        "ultimo": retention.periodico.ultimo,
+    }
+
+@app.post("/maintenance/retention")
+def ejecutar_retencion(
+    dias_detalle: int | None = Query(None, ge=0, description="Días con detalle completo (0: no compacta)"),
+    compactar: str | None = Query(None, regex="^(" + "|".join(retention.COMPACTACIONES) + ")$"),
+    dias_total: int | None = Query(None, ge=0, description="Borra lo no visto en estos días (0: nunca)"),
+    vacuum: str | None = Query(None, regex="^(" + "|".join(retention.VACUUMS) + ")$"),
+):
+    """Compacta, archiva y purga scan_results ahora, con la política del entorno salvo lo indicado."""
+    politica = retention.politica_desde_entorno()
+    for campo, valor in (("dias_detalle", dias_detalle), ("compactar", compactar), ("dias_total", dias_total), ("vacuum", vacuum)):
+        if valor is not None:
+            setattr(politica, campo, valor)
     try:
-        for host in resultados:
-            alertas_host = evaluar_riesgos([host])
-            db.add(ScanResult(
-                ip=host["ip"],
-                puertos_abiertos=json.dumps(host["puertos_abiertos"]),
-                alertas=json.dumps(alertas_host)
-            ))
+        return retention.ejecutar_mantenimiento(politica)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+_MOTOR_REGEX = "^(" + "|".join(MOTORES) + ")$"
+
+@app.post("/schedules", status_code=201)
+def crear_schedule(
+    nombre: str = Query(..., min_length=1, max_length=100),
+    objetivo: str = Query(..., description="IP, rango o CIDR a escanear"),
+    intervalo: int = Query(..., ge=60, description="Segundos entre barridos"),
+    prioridad: int = Query(0, description="Si coinciden varios, antes los de mayor prioridad"),
+    motor: str = Query("nmap", regex=_MOTOR_REGEX),
+    activo: bool = Query(True),
+):
+    with SessionLocal() as db:
+        if db.execute(select(ScanSchedule.id).where(ScanSchedule.nombre == nombre)).first():
+            raise HTTPException(status_code=409, detail=f"Ya existe un schedule con nombre {nombre}")
+        s = ScanSchedule(
+            nombre=nombre, objetivo=objetivo, intervalo=intervalo, prioridad=prioridad, motor=motor,
+            activo=activo, proxima_ejecucion=scheduler.primera_ejecucion(intervalo), creado=datetime.utcnow(),
+        )
+        db.add(s)
         db.commit()
-    finally:
-        db.close()
+        return _schedule_dict(s)
 
-    # opcional: alertas agregadas (todas juntas) por comodidad de cliente
-    alertas_agregadas = []
-    for h in resultados:
-        alertas_agregadas.extend(evaluar_riesgos([h]))
+@app.get("/schedules")
+def listar_schedules():
+    with SessionLocal() as db:
+        rows = db.execute(select(ScanSchedule).order_by(desc(ScanSchedule.prioridad), ScanSchedule.nombre)).scalars().all()
+        return [_schedule_dict(s) for s in rows]
 
-    return {"resultados": resultados, "alertas": alertas_agregadas}
+@app.get("/schedules/{nombre}")
+def estado_schedule(nombre: str):
+    with SessionLocal() as db:
+        return _schedule_dict(_get_schedule(db, nombre))
+
+@app.patch("/schedules/{nombre}")
+def modificar_schedule(
+    nombre: str,
+    objetivo: str | None = Query(None),
+    intervalo: int | None = Query(None, ge=60),
+    prioridad: int | None = Query(None),
+    motor: str | None = Query(None, regex=_MOTOR_REGEX),
+    activo: bool | None = Query(None),
+):
+    with SessionLocal() as db:
+        s = _get_schedule(db, nombre)
+        for campo, valor in (("objetivo", objetivo), ("prioridad", prioridad), ("motor", motor), ("activo", activo)):
+            if valor is not None:
+                setattr(s, campo, valor)
+        if intervalo is not None and intervalo != s.intervalo:
+            s.intervalo = intervalo
+            s.proxima_ejecucion = scheduler.siguiente_ejecucion(intervalo, s.ultima_ejecucion or datetime.utcnow())
+        db.commit()
+        return _schedule_dict(s)
+
+@app.delete("/schedules/{nombre}")
+def borrar_schedule(nombre: str):
+    with SessionLocal() as db:
+        s = _get_schedule(db, nombre)
+        db.execute(ScanScheduleRun.__table__.delete().where(ScanScheduleRun.schedule_id == s.id))
+        db.delete(s)
+        db.commit()
+    return {"borrado": nombre}
+
+@app.post("/schedules/{nombre}/run", status_code=202)
+def ejecutar_schedule(nombre: str):
+    """Adelanta el siguiente barrido a ahora (respeta el límite de concurrencia y el salto si sigue en curso)."""
+    with SessionLocal() as db:
+        s = _get_schedule(db, nombre)
+        s.proxima_ejecucion = datetime.utcnow()
+        db.commit()
+        resultado = _schedule_dict(s)
+    scheduler.despertar()
+    return resultado
+
+@app.get("/schedules/{nombre}/runs")
+def ejecuciones_schedule(nombre: str, limit: int = Query(50, ge=1, le=1000)):
+    with SessionLocal() as db:
+        s = _get_schedule(db, nombre)
+        rows = db.execute(
+            select(ScanScheduleRun).where(ScanScheduleRun.schedule_id == s.id)
+            .order_by(desc(ScanScheduleRun.id)).limit(limit)
+        ).scalars().all()
+        return [
+            {
+                "id": r.id,
+                "estado": r.estado,
+                "programada": r.programada.isoformat(),
+                "inicio": r.inicio.isoformat() if r.inicio else None,
+                "fin": r.fin.isoformat() if r.fin else None,
+                "hosts": r.hosts,
+                "alertas": r.alertas,
+                "error": r.error,
+            } for r in rows
+        ]
+
+@app.on_event("shutdown")
+async def _cerrar_bd():
+    await async_engine.dispose()
 
 @app.get("/history")
-def history(
-    ip: str | None = Query(None, description="Coincidencia parcial o exacta"),
+async def history(
+    request: Request,
+    ip: str | None = Query(None, description="IP exacta, CIDR (10.0.0.0/8) o prefijo (192.168.1.)"),
+    ip_from: str | None = Query(None, description="Inicio del rango IPv4 (incluido)"),
+    ip_to: str | None = Query(None, description="Fin del rango IPv4 (incluido)"),
     start: str | None = Query(None, description="ISO 8601: 2025-08-08T00:00:00"),
     end: str | None = Query(None, description="ISO 8601: 2025-08-08T23:59:59"),
     order_by: str = Query("fecha", regex="^(fecha|ip|id)$"),
     order_dir: str = Query("desc", regex="^(asc|desc)$"),
     limit: int = Query(100, ge=1, le=1000),
     offset: int = Query(0, ge=0),
+    puerto: int | None = Query(None, ge=0, le=65535, description="Solo registros con este puerto abierto"),
+    severidad: str | None = Query(None, regex="^(bajo|medio|alto|critico)$", description="Solo registros con alertas de esta severidad"),
+    cursor: str | None = Query(None, description="Valor de X-Next-Cursor de la página anterior (ignora offset)"),
+    desde_id: int | None = Query(None, ge=0, description="Solo registros con id mayor (refresco incremental)"),
 ):
-    db = SessionLocal()
-    try:
-        rows = _apply_filters(db, ip, start, end, order_by, order_dir, limit, offset)
-        return [
-            {
-                "id": r.id,
-                "ip": r.ip,
-                "puertos_abiertos": json.loads(r.puertos_abiertos),
-                "alertas": json.loads(r.alertas),
-                "fecha": r.fecha.isoformat(),
-            } for r in rows
-        ]
-    finally:
-        db.close()
+    clave, version, cacheada = await _consulta_condicional(request)
+    if cacheada is not None:
+        return cacheada
+    async with AsyncSessionLocal() as db:
+        rows = await _apply_filters(
+            db, ip, start, end, order_by, order_dir, limit, offset, puerto, severidad, cursor, ip_from, ip_to,
+            columnas=_COLUMNAS_HISTORY, desde_id=desde_id,
+        )
+    headers = {}
+    next_cursor = _siguiente_cursor(rows, order_by, order_dir, limit)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    metrics.filas_devueltas.inc(len(rows), ruta="/history")
+    with metrics.seccion_duracion.cronometrar(seccion="history_json"):
+        cuerpo = _history_json(rows)
+    return _respuesta_cacheable(clave, version, cuerpo, headers)
+
+@app.get("/stats")
+async def stats(
+    request: Request,
+    start: str | None = Query(None, description="ISO 8601: 2025-08-08T00:00:00"),
+    end: str | None = Query(None, description="ISO 8601: 2025-08-08T23:59:59"),
+    top: int = Query(5, ge=1, le=100),
+):
+    """Métricas del dashboard calculadas con agregados SQL (coste independiente del tamaño del histórico)."""
+    clave, version, cacheada = await _consulta_condicional(request)
+    if cacheada is not None:
+        return cacheada
+    dt_start = _parse_dt(start)
+    dt_end = _parse_dt(end)
+
+    def _ventana(q, col):
+        if dt_start:
+            q = q.where(col >= dt_start)
+        if dt_end:
+            q = q.where(col <= dt_end)
+        return q
+
+    frecuencia = func.count().label("frecuencia")
+    async with AsyncSessionLocal() as db:
+        total, hosts, ultimo = (await db.execute(_ventana(
+            select(func.count(ScanResult.id), func.count(func.distinct(ScanResult.ip)), func.max(ScanResult.fecha)),
+            ScanResult.fecha,
+        ))).one()
+
+        top_puertos = (await db.execute(
+            _ventana(select(ScanPort.puerto, frecuencia), ScanPort.fecha)
+            .group_by(ScanPort.puerto).order_by(desc(frecuencia), asc(ScanPort.puerto)).limit(top)
+        )).all()
+        top_servicios = (await db.execute(
+            _ventana(select(ScanPort.servicio, frecuencia), ScanPort.fecha)
+            .group_by(ScanPort.servicio).order_by(desc(frecuencia), asc(ScanPort.servicio)).limit(top)
+        )).all()
+
+        por_severidad = dict((await db.execute(
+            _ventana(select(ScanAlert.severidad, func.count()), ScanAlert.fecha).group_by(ScanAlert.severidad)
+        )).all())
+
+    return _respuesta_cacheable(clave, version, json.dumps({
+        "registros": total,
+        "hosts_unicos": hosts,
+        "ultimo_escaneo": ultimo.isoformat() if ultimo else None,
+        "top_puertos": [{"puerto": p, "frecuencia": n} for p, n in top_puertos],
+        "top_servicios": [{"servicio": sv, "frecuencia": n} for sv, n in top_servicios],
+        "alertas_por_severidad": {sev: por_severidad.get(sev, 0) for sev in SEVERIDADES},
+    }, ensure_ascii=False))
+
+def _host_dict(h, detalle=False):
+    estado = json.loads(h.estado)
+    d = {
+        "ip": h.ip,
+        "puertos_abiertos": estado["puertos"],
+        "servicios": sorted({p["servicio"] for p in estado["puertos"] if p.get("servicio")}),
+        "severidad_max": h.severidad_max,
+        "primera_vez": h.primera_vez.isoformat() if h.primera_vez else None,
+        "ultima_vez": (h.ultima_vez or h.fecha).isoformat(),
+        "ultimo_cambio": h.fecha.isoformat(),
+        "scan_id": h.scan_id,
+    }
+    if detalle:
+        d["alertas"] = estado["alertas"]
+    return d
+
+@app.get("/hosts")
+async def hosts(
+    request: Request,
+    ip: str | None = Query(None, description="IP exacta, CIDR (10.0.0.0/8) o prefijo (192.168.1.)"),
+    ip_from: str | None = Query(None, description="Inicio del rango IPv4 (incluido)"),
+    ip_to: str | None = Query(None, description="Fin del rango IPv4 (incluido)"),
+    puerto: int | None = Query(None, ge=0, le=65535, description="Solo hosts con este puerto abierto ahora"),
+    servicio: str | None = Query(None, description="Solo hosts con este servicio nmap abierto ahora"),
+    severidad: str | None = Query(None, regex="^(bajo|medio|alto|critico)$", description="Severidad máxima igual o superior"),
+    visto_desde: str | None = Query(None, description="ISO 8601: solo hosts vistos desde esta fecha"),
+    order_by: str = Query("ultima_vez", regex="^(ultima_vez|primera_vez|ip|severidad)$"),
+    order_dir: str = Query("desc", regex="^(asc|desc)$"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """Inventario: estado actual de cada host, leído de host_state (no recorre el histórico)."""
+    clave, version, cacheada = await _consulta_condicional(request)
+    if cacheada is not None:
+        return cacheada
+
+    q = select(HostState)
+    for condicion in _filtros_ip(ip, ip_from, ip_to, modelo=HostState):
+        q = q.where(condicion)
+    if puerto is not None:
+        q = q.where(HostState.ip.in_(select(HostPort.ip).where(HostPort.puerto == puerto)))
+    if servicio:
+        q = q.where(HostState.ip.in_(select(HostPort.ip).where(HostPort.servicio == servicio)))
+    if severidad:
+        q = q.where(HostState.severidad_rango >= RANGO_SEVERIDAD[severidad])
+    dt_visto = _parse_dt(visto_desde)
+    if dt_visto:
+        q = q.where(HostState.ultima_vez >= dt_visto)
+
+    col = {
+        "ultima_vez": HostState.ultima_vez,
+        "primera_vez": HostState.primera_vez,
+        "ip": HostState.ip_num,
+        "severidad": HostState.severidad_rango,
+    }[order_by]
+    direction = desc if order_dir == "desc" else asc
+    q = q.order_by(direction(col), direction(HostState.ip)).offset(offset).limit(limit)
+
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(q)).scalars().all()
+    metrics.filas_devueltas.inc(len(rows), ruta="/hosts")
+    return _respuesta_cacheable(clave, version, json.dumps([_host_dict(h) for h in rows], ensure_ascii=False))
+
+@app.get("/hosts/resumen")
+async def hosts_resumen():
+    """Hosts conocidos por severidad máxima y puertos más expuestos ahora mismo."""
+    frecuencia = func.count().label("frecuencia")
+    async with AsyncSessionLocal() as db:
+        total = (await db.execute(select(func.count()).select_from(HostState))).scalar_one()
+        por_severidad = dict((await db.execute(
+            select(HostState.severidad_max, func.count()).group_by(HostState.severidad_max)
+        )).all())
+        top_puertos = (await db.execute(
+            select(HostPort.puerto, frecuencia).group_by(HostPort.puerto).order_by(desc(frecuencia), asc(HostPort.puerto)).limit(10)
+        )).all()
+    return {
+        "hosts": total,
+        "por_severidad": {**{sev: por_severidad.get(sev, 0) for sev in SEVERIDADES}, "sin_alertas": por_severidad.get(None, 0)},
+        "top_puertos": [{"puerto": p, "hosts": n} for p, n in top_puertos],
+    }
+
+@app.get("/hosts/{ip}")
+async def host(ip: str):
+    async with AsyncSessionLocal() as db:
+        h = await db.get(HostState, ip)
+    if h is None:
+        raise HTTPException(status_code=404, detail=f"Host no encontrado: {ip}")
+    return _host_dict(h, detalle=True)
+
+@app.get("/changes")
+async def changes(
+    response: Response,
+    ip: str | None = Query(None, description="IP exacta"),
+    start: str | None = Query(None, description="ISO 8601: 2025-08-08T00:00:00"),
+    end: str | None = Query(None, description="ISO 8601: 2025-08-08T23:59:59"),
+    tipo: str | None = Query(None, regex="^(" + "|".join(TIPOS_CAMBIO) + ")$"),
+    desde_id: int = Query(0, ge=0, description="Solo cambios con id mayor (para sondear el feed)"),
+    limit: int = Query(500, ge=1, le=5000),
+):
+    """Feed de cambios (puertos abiertos/cerrados, alertas nuevas/resueltas) en orden de llegada."""
+    dt_start = _parse_dt(start)
+    dt_end = _parse_dt(end)
+    q = select(ScanChange).where(ScanChange.id > desde_id)
+    if ip:
+        q = q.where(ScanChange.ip == ip)
+    if tipo:
+        q = q.where(ScanChange.tipo == tipo)
+    if dt_start:
+        q = q.where(ScanChange.fecha >= dt_start)
+    if dt_end:
+        q = q.where(ScanChange.fecha <= dt_end)
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(q.order_by(ScanChange.id).limit(limit))).scalars().all()
+
+    if rows:
+        response.headers["X-Last-Id"] = str(rows[-1].id)
+    metrics.filas_devueltas.inc(len(rows), ruta="/changes")
+    return [
+        {
+            "id": c.id,
+            "scan_id": c.scan_id,
+            "ip": c.ip,
+            "tipo": c.tipo,
+            "puerto": c.puerto,
+            "servicio": c.servicio,
+            "regla": c.regla,
+            "severidad": c.severidad,
+            "fecha": c.fecha.isoformat(),
+        } for c in rows
+    ]
 
 @app.get("/history/export")
 def history_export(
     ip: str | None = None,
+    ip_from: str | None = None,
+    ip_to: str | None = None,
     start: str | None = None,
     end: str | None = None,
     order_by: str = "fecha",
     order_dir: str = "desc",
-    limit: int = 1000,
+    limit: int | None = Query(None, ge=1, description="Sin límite por defecto: exporta todo el histórico filtrado"),
     offset: int = 0,
-    format: str = Query("csv", regex="^(csv|json)$"),
+    format: str = Query("csv", regex="^(csv|json|ndjson|parquet|arrow)$"),
+    puerto: int | None = None,
+    severidad: str | None = None,
+    cursor: str | None = None,
+    gzip: bool = Query(False, description="Comprime la salida al vuelo (.gz); no aplica a parquet/arrow"),
 ):
-    db = SessionLocal()
-    try:
-        rows = _apply_filters(db, ip, start, end, order_by, order_dir, limit, offset)
-        data = [
-            {
-                "id": r.id,
-                "ip": r.ip,
-                "fecha": r.fecha.isoformat(),
-                "puertos_abiertos": r.puertos_abiertos,  # JSON en texto
-                "alertas": r.alertas,                    # JSON en texto
-            } for r in rows
-        ]
-    finally:
-        db.close()
+    """Exportación en streaming: lee con yield_per y escribe por trozos, con memoria constante.
+
+    parquet/arrow usan el esquema plano de services/columnar_export (una fila por host-puerto).
+    """
+    campos = ["id", "ip", "fecha", "ultima_vez", "puertos_abiertos", "alertas"]
+    columnar = format in ("parquet", "arrow")
+    if columnar:
+        _requiere_pyarrow()
+        campos = ["id", "ip", "fecha"]
+    q = _build_query(ip, start, end, order_by, order_dir, puerto, severidad, cursor, ip_from, ip_to)
+    inicio = 0 if cursor else max(0, offset)
+    headers = {}
+    if limit:
+        # cursor de la página siguiente: basta con leer la última fila de la página, si existe
+        db = SessionLocal()
+        try:
+            ultima = db.execute(
+                q.with_only_columns(ScanResult.id, ScanResult.ip, ScanResult.fecha).offset(inicio + limit - 1).limit(1)
+            ).first()
+        finally:
+            db.close()
+        if ultima:
+            headers["X-Next-Cursor"] = _codificar_cursor(order_by.lower(), order_dir.lower(), ultima)
+        q = q.offset(inicio).limit(limit)
+    elif inicio:
+        q = q.offset(inicio)
+    q = q.with_only_columns(*(getattr(ScanResult, c) for c in campos)).execution_options(yield_per=1000)
 
-    if format == "json":
-        return JSONResponse(content=data)
+    # la sesión del volcado se abre dentro de los generadores: si la respuesta no llega
+    # a recorrerse (cliente que se va antes de empezar), no queda ninguna abierta
+    def _filas():
+        n = 0
+        db = SessionLocal()
+        try:
+            for r in db.execute(q):
+                n += 1
+                yield {
+                    "id": r.id,
+                    "ip": r.ip,
+                    "fecha": r.fecha.isoformat(),
+                    "ultima_vez": (r.ultima_vez or r.fecha).isoformat(),
+                    "puertos_abiertos": r.puertos_abiertos,  # JSON en texto
+                    "alertas": r.alertas,                    # JSON en texto
+                }
+        finally:
+            metrics.filas_exportadas.inc(n, formato=format)
+            db.close()
 
-    # CSV
-    buf = io.StringIO()
-    writer = csv.DictWriter(buf, fieldnames=["id", "ip", "fecha", "puertos_abiertos", "alertas"])
-    writer.writeheader()
-    writer.writerows(data)
-    buf.seek(0)
+    media_type, ext = FORMATOS[format]
+    if columnar:
+        def _batches():
+            db = SessionLocal()
+            try:
+                for batch in columnar_export.lotes(db, db.execute(q)):
+                    metrics.filas_exportadas.inc(batch.num_rows, formato=format)
+                    yield batch
+            finally:
+                db.close()
+        cuerpo = columnar_export.parquet_stream(_batches()) if format == "parquet" \
+            else columnar_export.arrow_stream(_batches())
+        gzip = False
+    elif format == "csv":
+        cuerpo = exportar_csv(_filas(), campos)
+    elif format == "json":
+        cuerpo = exportar_json(_filas())
+    else:
+        cuerpo = exportar_ndjson(_filas())
+
+    filename = f"history.{ext}"
+    if gzip:
+        cuerpo = comprimir_gzip(cuerpo)
+        media_type = "application/gzip"
+        filename += ".gz"
 
-    filename = "history.csv"
     return StreamingResponse(
-        iter([buf.read()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        cuerpo,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', **headers}
     )
+
+@app.post("/history/snapshot")
+def history_snapshot(
+    ip: str | None = None,
+    ip_from: str | None = None,
+    ip_to: str | None = None,
+    start: str | None = Query(None, description="ISO 8601: 2025-08-08T00:00:00"),
+    end: str | None = Query(None, description="ISO 8601: 2025-08-08T23:59:59"),
+):
+    """Vuelca el histórico filtrado a Parquet particionado por día en SNAPSHOT_DIR."""
+    _requiere_pyarrow()
+    directorio = os.getenv("SNAPSHOT_DIR", "./snapshots")
+    prefijo = "snapshot-" + datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    db = SessionLocal()
+    try:
+        q = _build_query(ip, start, end, "fecha", "asc", ip_from=ip_from, ip_to=ip_to) \
+            .with_only_columns(ScanResult.id, ScanResult.ip, ScanResult.fecha).execution_options(yield_per=1000)
+        ficheros = columnar_export.escribir_snapshot(
+            directorio, columnar_export.lotes(db, db.execute(q)), prefijo=prefijo
+        )
+    finally:
+        db.close()
+    return {"directorio": os.path.abspath(directorio), "ficheros": ficheros}
@@ -1,26 +1,605 @@
 # backend/app/models.py
-from sqlalchemy import Column, Integer, String, DateTime, create_engine
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, ForeignKey, Index, create_engine, select, insert, update, inspect, text, bindparam, func, event, case
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from contextlib import contextmanager
 from datetime import datetime
+from services.diff_engine import estado_host, estado_a_json
+from services import metrics
+from services.rule_engine import RANGO_SEVERIDAD, get_motor
+import hashlib
 import json
+import os
+import re
+import socket
+import time
 
 Base = declarative_base()
 
 class ScanResult(Base):
     __tablename__ = "scan_results"
+    __table_args__ = (
+        # paginación por cursor (keyset) sobre (fecha, id) e (ip, id)
+        Index("ix_scan_results_fecha_id", "fecha", "id"),
+        Index("ix_scan_results_ip_id", "ip", "id"),
+        # búsquedas por CIDR / rango como rangos sobre un B-tree
+        Index("ix_scan_results_ip_num_id", "ip_num", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     ip = Column(String, index=True)
+    ip_num = Column(BigInteger)  # IPv4 como entero (None para IPv6 / hostnames)
     puertos_abiertos = Column(String)  # Guardaremos como JSON serializado
     alertas = Column(String)  # Guardaremos como JSON serializado
     fecha = Column(DateTime, default=datetime.utcnow)
+    # deduplicación: si un host no cambia, solo se actualiza ultima_vez en su última fila
+    hash_contenido = Column(String(64))
+    ultima_vez = Column(DateTime, default=datetime.utcnow)
+
+    puertos = relationship("ScanPort", back_populates="scan", cascade="all, delete-orphan")
+    alertas_detalle = relationship("ScanAlert", back_populates="scan", cascade="all, delete-orphan")
+
+class ScanPort(Base):
+    """Un puerto abierto de un ScanResult (una fila por host-puerto)."""
+    __tablename__ = "scan_ports"
+    __table_args__ = (
+        Index("ix_scan_ports_puerto_fecha", "puerto", "fecha"),
+        Index("ix_scan_ports_servicio", "servicio"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    scan_id = Column(Integer, ForeignKey("scan_results.id", ondelete="CASCADE"), index=True, nullable=False)
+    ip = Column(String, nullable=False)
+    puerto = Column(Integer, nullable=False)
+    servicio = Column(String)
+    fecha = Column(DateTime, nullable=False)
+
+    scan = relationship("ScanResult", back_populates="puertos")
+
+class ScanAlert(Base):
+    """Una alerta IDS de un ScanResult."""
+    __tablename__ = "scan_alerts"
+    __table_args__ = (
+        Index("ix_scan_alerts_severidad_fecha", "severidad", "fecha"),
+        Index("ix_scan_alerts_regla", "regla"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    scan_id = Column(Integer, ForeignKey("scan_results.id", ondelete="CASCADE"), index=True, nullable=False)
+    ip = Column(String, nullable=False)
+    regla = Column(String, nullable=False)
+    puerto = Column(Integer)
+    severidad = Column(String, nullable=False)
+    mensaje = Column(String)
+    fecha = Column(DateTime, nullable=False)
+
+    scan = relationship("ScanResult", back_populates="alertas_detalle")
+
+class HostState(Base):
+    """Último estado conocido de cada IP: base del diff entre escaneos y del inventario de /hosts.
+
+    Se actualiza en la misma transacción que inserta el escaneo, así que consultar
+    el inventario no depende del tamaño del histórico.
+    """
+    __tablename__ = "host_state"
+    __table_args__ = (
+        Index("ix_host_state_severidad_ultima_vez", "severidad_rango", "ultima_vez"),
+        Index("ix_host_state_ultima_vez", "ultima_vez"),
+        Index("ix_host_state_ip_num", "ip_num"),
+    )
+
+    ip = Column(String, primary_key=True)
+    ip_num = Column(BigInteger)
+    scan_id = Column(Integer, ForeignKey("scan_results.id", ondelete="SET NULL"))
+    estado = Column(String, nullable=False)  # JSON: {"puertos": [...], "alertas": [...]}
+    hash_contenido = Column(String(64))
+    fecha = Column(DateTime, nullable=False)  # último cambio de estado
+    n_puertos = Column(Integer)
+    severidad_max = Column(String)            # None si no tiene alertas
+    severidad_rango = Column(Integer)         # posición de severidad_max en SEVERIDADES (-1 sin alertas)
+    primera_vez = Column(DateTime)
+    ultima_vez = Column(DateTime)             # último escaneo en que se vio, cambiara o no
+
+class HostPort(Base):
+    """Puertos abiertos actualmente en cada host (inventario; se reescribe al cambiar el host)."""
+    __tablename__ = "host_ports"
+    __table_args__ = (
+        Index("ix_host_ports_puerto", "puerto"),
+        Index("ix_host_ports_servicio", "servicio"),
+    )
+
+    ip = Column(String, ForeignKey("host_state.ip", ondelete="CASCADE"), primary_key=True)
+    puerto = Column(Integer, primary_key=True)
+    servicio = Column(String)
+
+class ScanChange(Base):
+    """Un cambio detectado en un host respecto a su estado anterior."""
+    __tablename__ = "scan_changes"
+    __table_args__ = (
+        Index("ix_scan_changes_fecha_id", "fecha", "id"),
+        Index("ix_scan_changes_ip_fecha", "ip", "fecha"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    scan_id = Column(Integer, ForeignKey("scan_results.id", ondelete="CASCADE"), index=True)
+    ip = Column(String, nullable=False)
+    tipo = Column(String, nullable=False)  # puerto_abierto | puerto_cerrado | alerta_nueva | alerta_resuelta
+    puerto = Column(Integer)
+    servicio = Column(String)
+    regla = Column(String)
+    severidad = Column(String)
+    fecha = Column(DateTime, nullable=False)
+
+class ScanSchedule(Base):
+    """Objetivo con nombre que el scheduler escanea cada `intervalo` segundos."""
+    __tablename__ = "scan_schedules"
+    __table_args__ = (
+        Index("ix_scan_schedules_activo_proxima", "activo", "proxima_ejecucion"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    nombre = Column(String, unique=True, nullable=False)
+    objetivo = Column(String, nullable=False)
+    intervalo = Column(Integer, nullable=False)   # segundos
+    prioridad = Column(Integer, nullable=False, default=0)  # mayor = antes, si coinciden
+    motor = Column(String, nullable=False, default="nmap")  # nmap | tcp
+    activo = Column(Boolean, nullable=False, default=True)
+    proxima_ejecucion = Column(DateTime, nullable=False)
+    ultima_ejecucion = Column(DateTime)
+    creado = Column(DateTime, default=datetime.utcnow)
+
+class ScanScheduleRun(Base):
+    """Una ejecución (o un salto) de un ScanSchedule."""
+    __tablename__ = "scan_schedule_runs"
+    __table_args__ = (
+        Index("ix_scan_schedule_runs_schedule_id", "schedule_id", "id"),
+        Index("ix_scan_schedule_runs_estado", "estado"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    schedule_id = Column(Integer, ForeignKey("scan_schedules.id", ondelete="CASCADE"), nullable=False)
+    estado = Column(String, nullable=False)  # en_curso | completado | error | omitido | interrumpido
+    programada = Column(DateTime, nullable=False)
+    inicio = Column(DateTime)
+    fin = Column(DateTime)
+    hosts = Column(Integer)
+    alertas = Column(Integer)
+    error = Column(String)
+    propietario = Column(String)  # "host:pid" del proceso que la ejecuta
+    latido = Column(DateTime)     # última renovación mientras está en_curso
+
+class DataVersion(Base):
+    """Versión de los datos que sirven /history, /stats y /hosts (una sola fila, id=1).
+
+    Cada transacción que los modifica la incrementa (`marcar_datos_modificados`),
+    así que la caché de consultas, los ETags y Last-Modified de todos los procesos
+    (workers, CLI con --guardar, retención) ven el mismo cambio al hacer commit.
+    """
+    __tablename__ = "data_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+    modificado = Column(BigInteger, nullable=False)  # epoch en segundos (resolución de Last-Modified)
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    nombre = Column(String, primary_key=True)
+    fecha = Column(DateTime, default=datetime.utcnow)
 
 # Configuración de la BD
-DATABASE_URL = "sqlite:///./scan_results.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./scan_results.db")
+
+# drivers asíncronos equivalentes al driver síncrono de DATABASE_URL
+_DRIVERS_ASYNC = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgresql+psycopg": "postgresql+asyncpg",
+}
+
+def _url_async(url):
+    esquema, resto = url.split("://", 1)
+    return f"{_DRIVERS_ASYNC.get(esquema, esquema)}://{resto}"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _url_async(DATABASE_URL))
+
+def _opciones_engine(url):
+    if url.startswith("sqlite"):
+        # SQLite: un solo escritor; el pool por defecto basta y WAL permite lecturas concurrentes
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": True,
+    }
+
+def _opciones_engine_sync(url):
+    opciones = _opciones_engine(url)
+    if url.split("://", 1)[0] in ("postgresql", "postgresql+psycopg2"):
+        # executemany del driver en páginas (execute_batch) en vez de un viaje por fila
+        opciones["executemany_mode"] = "values_plus_batch"
+    return opciones
+
+engine = create_engine(DATABASE_URL, **_opciones_engine_sync(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Ruta asíncrona para los endpoints de lectura (aiosqlite / asyncpg)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **(
+    {} if ASYNC_DATABASE_URL.startswith("sqlite") else _opciones_engine(ASYNC_DATABASE_URL)
+))
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+# WAL: lecturas concurrentes mientras se escribe; synchronous=NORMAL es seguro con WAL y mucho más rápido
+SQLITE_PRAGMAS = (
+    # solo surte efecto en BDs nuevas (o tras un VACUUM): permite liberar espacio por partes
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA busy_timeout=5000",
+)
+
+def _configurar_sqlite(dbapi_conn, _):
+    cur = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cur.execute(pragma)
+    cur.close()
+
+def _inicio_sentencia(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_t_sentencias", []).append(time.perf_counter())
+
+_OPERACIONES_SQL = {"select", "insert", "update", "delete", "with"}
+
+def _fin_sentencia(conn, cursor, statement, parameters, context, executemany):
+    pila = conn.info.get("_t_sentencias")
+    if not pila:
+        return
+    palabras = statement.lstrip().split(None, 1)
+    operacion = palabras[0].lower() if palabras else ""
+    if operacion not in _OPERACIONES_SQL:
+        operacion = "otra"  # PRAGMA, ALTER, CREATE...: etiquetas acotadas
+    metrics.db_consultas.observar(time.perf_counter() - pila.pop(), operacion=operacion)
+
+def _error_sentencia(contexto):
+    # after_cursor_execute no se llama si la sentencia falla
+    if contexto.connection is not None:
+        pila = contexto.connection.info.get("_t_sentencias")
+        if pila:
+            pila.pop()
+
+for _engine in (engine, async_engine.sync_engine):
+    if _engine.dialect.name == "sqlite":
+        event.listen(_engine, "connect", _configurar_sqlite)
+    # tiempos por sentencia SQL (SELECT, INSERT...) para /metrics
+    event.listen(_engine, "before_cursor_execute", _inicio_sentencia)
+    event.listen(_engine, "after_cursor_execute", _fin_sentencia)
+    event.listen(_engine, "handle_error", _error_sentencia)
+
+# claves de pg_advisory_xact_lock de `transaccion_exclusiva`
+BLOQUEO_MIGRACIONES = 7301
+BLOQUEO_SCHEDULER = 7302
+
+@contextmanager
+def transaccion_exclusiva(clave):
+    """engine.begin() serializado con las demás transacciones de la misma `clave`, también entre procesos.
+
+    SQLite: BEGIN IMMEDIATE (bloqueo de escritura de toda la BD, espera busy_timeout).
+    PostgreSQL: pg_advisory_xact_lock(clave), que se libera al terminar la transacción.
+    """
+    with engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        elif conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": clave})
+        yield conn
+
+def ip_a_entero(ip):
+    """Entero de una IPv4 (para filtros por rango); None si no es IPv4."""
+    # inet_pton es estricto como ipaddress (solo a.b.c.d) y bastante más rápido por host
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except (OSError, TypeError, ValueError):
+        return None
+
+_JSON_CANONICO = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+def hash_contenido(puertos_abiertos, alertas):
+    """Huella del estado de un host (puertos + alertas), independiente del orden."""
+    canon = {
+        "p": sorted((p["puerto"], p.get("servicio") or "") for p in puertos_abiertos),
+        "a": sorted(a if isinstance(a, str) else a.get("mensaje", "") for a in alertas),
+    }
+    return hashlib.sha256(_JSON_CANONICO.encode(canon).encode()).hexdigest()
+
+def marcar_datos_modificados(conn):
+    """Incrementa data_version dentro de la transacción de escritura `conn`."""
+    ahora = int(time.time())
+    conn.execute(
+        update(DataVersion).where(DataVersion.id == 1).values(
+            version=DataVersion.version + 1,
+            # Last-Modified tiene resolución de segundos: dos versiones nunca comparten segundo
+            modificado=case((DataVersion.modificado >= ahora, DataVersion.modificado + 1), else_=ahora),
+        )
+    )
+
+def severidad_maxima(alertas):
+    """(severidad, rango) de la alerta más grave; (None, -1) si no hay alertas."""
+    peor = max((a["severidad"] for a in alertas), key=lambda sev: RANGO_SEVERIDAD.get(sev, -1), default=None)
+    return peor, RANGO_SEVERIDAD.get(peor, -1)
+
+# --- migraciones ---
+
+def _añadir_columna(conn, tabla, columna):
+    """ALTER TABLE ... ADD COLUMN si la columna aún no existe (create_all no altera tablas)."""
+    existentes = {c["name"] for c in inspect(conn).get_columns(tabla.name)}
+    if columna.name in existentes:
+        return
+    tipo = columna.type.compile(dialect=conn.dialect)
+    conn.execute(text(f'ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}'))
+
+_RE_PUERTO = re.compile(r"Puerto (\d+)")
+
+def _alerta_legado(texto):
+    """Deduce severidad y puerto de una alerta antigua guardada como texto."""
+    t = texto.lower()
+    if "crítico" in t or "critico" in t:
+        severidad = "critico"
+    elif "alto" in t:
+        severidad = "alto"
+    elif "medio" in t:
+        severidad = "medio"
+    else:
+        severidad = "bajo"
+    m = _RE_PUERTO.search(texto)
+    return {"regla": "legado", "puerto": int(m.group(1)) if m else None, "severidad": severidad, "mensaje": texto}
+
+def _migrar_normalizar_puertos_alertas(conn, lote=1000):
+    """Rellena scan_ports / scan_alerts a partir de los blobs JSON de scan_results."""
+    ultimo_id = 0
+    while True:
+        filas = conn.execute(
+            select(ScanResult.id, ScanResult.ip, ScanResult.fecha, ScanResult.puertos_abiertos, ScanResult.alertas)
+            .where(ScanResult.id > ultimo_id)
+            .order_by(ScanResult.id)
+            .limit(lote)
+        ).all()
+        if not filas:
+            break
+        puertos, alertas = [], []
+        for f in filas:
+            fecha = f.fecha or datetime.utcnow()
+            for p in json.loads(f.puertos_abiertos or "[]"):
+                puertos.append({"scan_id": f.id, "ip": f.ip, "puerto": p["puerto"], "servicio": p.get("servicio"), "fecha": fecha})
+            for a in json.loads(f.alertas or "[]"):
+                alerta = a if isinstance(a, dict) else _alerta_legado(a)
+                alertas.append({"scan_id": f.id, "ip": f.ip, "fecha": fecha, **{k: alerta.get(k) for k in ("regla", "puerto", "severidad", "mensaje")}})
+        if puertos:
+            conn.execute(insert(ScanPort), puertos)
+        if alertas:
+            conn.execute(insert(ScanAlert), alertas)
+        ultimo_id = filas[-1].id
+
+def _migrar_indices_scan_results(conn):
+    # create_all no añade índices nuevos a tablas que ya existen; los índices sobre
+    # columnas que añade una migración posterior se crean en esa migración
+    existentes = {c["name"] for c in inspect(conn).get_columns(ScanResult.__tablename__)}
+    for indice in ScanResult.__table__.indexes:
+        if {c.name for c in indice.columns} <= existentes:
+            indice.create(conn, checkfirst=True)
+
+def _migrar_deduplicacion(conn, lote=1000):
+    tabla = ScanResult.__table__
+    _añadir_columna(conn, tabla, tabla.c.hash_contenido)
+    _añadir_columna(conn, tabla, tabla.c.ultima_vez)
+
+    actualizar = update(tabla).where(tabla.c.id == bindparam("_id")).values(
+        hash_contenido=bindparam("_hash"), ultima_vez=bindparam("_ultima_vez")
+    )
+    ultimo_id = 0
+    while True:
+        filas = conn.execute(
+            select(tabla.c.id, tabla.c.fecha, tabla.c.puertos_abiertos, tabla.c.alertas)
+            .where(tabla.c.id > ultimo_id).order_by(tabla.c.id).limit(lote)
+        ).all()
+        if not filas:
+            break
+        conn.execute(actualizar, [
+            {
+                "_id": f.id,
+                "_hash": hash_contenido(json.loads(f.puertos_abiertos or "[]"), json.loads(f.alertas or "[]")),
+                "_ultima_vez": f.fecha,
+            } for f in filas
+        ])
+        ultimo_id = filas[-1].id
+
+def _con_alertas_legado(alertas):
+    return any(a.get("regla") == "legado" for a in alertas)
+
+def _alertas_actuales(ip, puertos):
+    """Alertas de las reglas actuales para unos puertos guardados.
+
+    Sustituyen en el estado base de host_state a las alertas "legado" (texto sin
+    id de regla): si no, el primer escaneo tras migrar daría cada alerta por
+    resuelta (legado) y por nueva (con su id) a la vez.
+    """
+    return get_motor().evaluar_host({"ip": ip, "puertos_abiertos": puertos})
+
+def _migrar_host_state(conn, lote=1000):
+    """Inicializa host_state con el último registro de cada IP, para que el primer diff no lo marque todo como nuevo."""
+    ultimos = select(func.max(ScanResult.id).label("id")).group_by(ScanResult.ip).subquery()
+    ultimo_id = 0
+    while True:
+        filas = conn.execute(
+            select(ScanResult.id, ScanResult.ip, ScanResult.fecha, ScanResult.puertos_abiertos, ScanResult.hash_contenido)
+            .where(ScanResult.id.in_(select(ultimos.c.id)), ScanResult.id > ultimo_id)
+            .order_by(ScanResult.id).limit(lote)
+        ).all()
+        if not filas:
+            break
+        alertas = {}
+        for scan_id, regla, puerto, severidad in conn.execute(
+            select(ScanAlert.scan_id, ScanAlert.regla, ScanAlert.puerto, ScanAlert.severidad)
+            .where(ScanAlert.scan_id.in_([f.id for f in filas]))
+        ):
+            alertas.setdefault(scan_id, []).append({"regla": regla, "puerto": puerto, "severidad": severidad})
+        estados = []
+        for f in filas:
+            puertos = json.loads(f.puertos_abiertos or "[]")
+            alertas_host = alertas.get(f.id, [])
+            if _con_alertas_legado(alertas_host):
+                alertas_host = _alertas_actuales(f.ip, puertos)
+            estados.append(estado_a_json(estado_host(puertos, alertas_host)))
+        conn.execute(insert(HostState), [
+            {
+                "ip": f.ip,
+                "scan_id": f.id,
+                "estado": json.dumps(estado),
+                "hash_contenido": f.hash_contenido,
+                "fecha": f.fecha or datetime.utcnow(),
+            } for f, estado in zip(filas, estados)
+        ])
+        ultimo_id = filas[-1].id
+
+def _migrar_ip_num(conn, lote=1000):
+    tabla = ScanResult.__table__
+    _añadir_columna(conn, tabla, tabla.c.ip_num)
+
+    actualizar = update(tabla).where(tabla.c.id == bindparam("_id")).values(ip_num=bindparam("_ip_num"))
+    ultimo_id = 0
+    while True:
+        filas = conn.execute(
+            select(tabla.c.id, tabla.c.ip).where(tabla.c.id > ultimo_id).order_by(tabla.c.id).limit(lote)
+        ).all()
+        if not filas:
+            break
+        conn.execute(actualizar, [{"_id": f.id, "_ip_num": ip_a_entero(f.ip)} for f in filas])
+        ultimo_id = filas[-1].id
+    # el índice se crea tras el relleno para no mantenerlo fila a fila
+    _migrar_indices_scan_results(conn)
+
+def _migrar_inventario_hosts(conn, lote=1000):
+    """Añade a host_state las columnas del inventario y rellena host_ports desde el estado guardado."""
+    tabla = HostState.__table__
+    for columna in ("ip_num", "n_puertos", "severidad_max", "severidad_rango", "primera_vez", "ultima_vez"):
+        _añadir_columna(conn, tabla, tabla.c[columna])
+
+    actualizar = update(tabla).where(tabla.c.ip == bindparam("_ip")).values(
+        ip_num=bindparam("_ip_num"), n_puertos=bindparam("_n_puertos"),
+        severidad_max=bindparam("_severidad_max"), severidad_rango=bindparam("_severidad_rango"),
+        primera_vez=bindparam("_primera_vez"), ultima_vez=bindparam("_ultima_vez"),
+    )
+    ultima_ip = ""
+    while True:
+        filas = conn.execute(
+            select(tabla.c.ip, tabla.c.scan_id, tabla.c.estado, tabla.c.fecha)
+            .where(tabla.c.ip > ultima_ip).order_by(tabla.c.ip).limit(lote)
+        ).all()
+        if not filas:
+            break
+        ips = [f.ip for f in filas]
+        primera = dict(conn.execute(
+            select(ScanResult.ip, func.min(ScanResult.fecha)).where(ScanResult.ip.in_(ips)).group_by(ScanResult.ip)
+        ).all())
+        ultima = dict(conn.execute(
+            select(ScanResult.id, ScanResult.ultima_vez).where(ScanResult.id.in_([f.scan_id for f in filas if f.scan_id]))
+        ).all())
+        cambios, puertos = [], []
+        for f in filas:
+            estado = json.loads(f.estado)
+            severidad, rango = severidad_maxima(estado.get("alertas", []))
+            cambios.append({
+                "_ip": f.ip,
+                "_ip_num": ip_a_entero(f.ip),
+                "_n_puertos": len(estado.get("puertos", [])),
+                "_severidad_max": severidad,
+                "_severidad_rango": rango,
+                "_primera_vez": primera.get(f.ip) or f.fecha,
+                "_ultima_vez": ultima.get(f.scan_id) or f.fecha,
+            })
+            puertos.extend({"ip": f.ip, "puerto": p["puerto"], "servicio": p.get("servicio")} for p in estado.get("puertos", []))
+        conn.execute(actualizar, cambios)
+        if puertos:
+            conn.execute(insert(HostPort), puertos)
+        ultima_ip = filas[-1].ip
+    for indice in tabla.indexes:
+        indice.create(conn, checkfirst=True)
+
+def _migrar_alertas_legado_host_state(conn, lote=1000):
+    """Traduce a las reglas actuales las alertas "legado" que una 0004 anterior copió a host_state."""
+    tabla = HostState.__table__
+    actualizar = update(tabla).where(tabla.c.ip == bindparam("_ip")).values(
+        estado=bindparam("_estado"), severidad_max=bindparam("_severidad_max"),
+        severidad_rango=bindparam("_severidad_rango"),
+    )
+    ultima_ip = ""
+    while True:
+        filas = conn.execute(
+            select(tabla.c.ip, tabla.c.estado).where(tabla.c.ip > ultima_ip).order_by(tabla.c.ip).limit(lote)
+        ).all()
+        if not filas:
+            break
+        cambios = []
+        for f in filas:
+            estado = json.loads(f.estado)
+            if not _con_alertas_legado(estado.get("alertas", [])):
+                continue
+            puertos = estado.get("puertos", [])
+            alertas = _alertas_actuales(f.ip, puertos)
+            severidad, rango = severidad_maxima(alertas)
+            cambios.append({
+                "_ip": f.ip,
+                "_estado": json.dumps(estado_a_json(estado_host(puertos, alertas))),
+                "_severidad_max": severidad,
+                "_severidad_rango": rango,
+            })
+        if cambios:
+            conn.execute(actualizar, cambios)
+        ultima_ip = filas[-1].ip
+
+def _migrar_data_version(conn):
+    conn.execute(insert(DataVersion).values(id=1, version=1, modificado=int(time.time())))
+
+def _migrar_propietario_runs(conn):
+    tabla = ScanScheduleRun.__table__
+    for columna in ("propietario", "latido"):
+        _añadir_columna(conn, tabla, tabla.c[columna])
+    for indice in tabla.indexes:
+        indice.create(conn, checkfirst=True)
+
+# (nombre, función) en orden; cada una se ejecuta una sola vez por BD
+MIGRACIONES = [
+    ("0001_normalizar_puertos_alertas", _migrar_normalizar_puertos_alertas),
+    ("0002_indices_keyset_scan_results", _migrar_indices_scan_results),
+    ("0003_deduplicacion_scan_results", _migrar_deduplicacion),
+    ("0004_host_state", _migrar_host_state),
+    ("0005_ip_num_scan_results", _migrar_ip_num),
+    ("0006_inventario_hosts", _migrar_inventario_hosts),
+    ("0007_data_version", _migrar_data_version),
+    ("0008_propietario_scan_schedule_runs", _migrar_propietario_runs),
+    ("0009_alertas_legado_host_state", _migrar_alertas_legado_host_state),
+]
+
+def migrar_db(conn):
+    # las aplicadas se leen con el bloqueo ya tomado: otro proceso puede haberlas hecho mientras esperábamos
+    hechas = set(conn.execute(select(SchemaMigration.nombre)).scalars())
+    for nombre, fn in MIGRACIONES:
+        if nombre in hechas:
+            continue
+        fn(conn)
+        conn.execute(insert(SchemaMigration).values(nombre=nombre, fecha=datetime.utcnow()))
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    """Crea las tablas que falten y aplica las migraciones pendientes.
+
+    Todo va en una transacción exclusiva: si varios procesos arrancan a la vez
+    (workers de uvicorn, la CLI), el primero crea y migra y los demás esperan y
+    ya no encuentran nada pendiente.
+    """
+    with transaccion_exclusiva(BLOQUEO_MIGRACIONES) as conn:
+        Base.metadata.create_all(bind=conn)
+        migrar_db(conn)
@@ -0,0 +1,197 @@
+"""Escáner TCP connect en asyncio, alternativa a nmap para barridos de puertos rápidos.
+
+Devuelve la misma forma que `escanear_red`: lista de {"ip", "puertos_abiertos"}
+ordenada por IP, o {"error": ...}. Un host aparece si algún puerto respondió
+(abierto o rechazado), igual que nmap lista los hosts activos.
+
+Límites:
+  - `concurrencia`: conexiones abiertas a la vez (nº de workers);
+  - `tasa`: conexiones por segundo en total (0 = sin límite);
+  - `tasa_host`: conexiones por segundo contra un mismo host (0 = sin límite);
+  - `timeout`: segundos de espera por conexión (sin respuesta = filtrado);
+  - SCAN_MAX_HOSTS: hosts máximos del objetivo (se rechaza antes de sondear).
+
+Los nombres de servicio salen de la tabla del sistema (getservbyport); con
+`servicios_nmap=True` se lanza después nmap -sV solo sobre los puertos abiertos de cada host.
+"""
+import asyncio
+import os
+import socket
+import time
+from itertools import islice
+
+from services import metrics
+from services.scan_engine import MAX_HOSTS, _clave_ip, hosts_objetivo
+from services.scan_service import escanear_red
+
+# mismos puertos que nmap -F (top 100 TCP)
+TOP_100 = (
+    7, 9, 13, 21, 22, 23, 25, 26, 37, 53, 79, 80, 81, 88, 106, 110, 111, 113, 119, 135,
+    139, 143, 144, 179, 199, 389, 427, 443, 444, 445, 465, 513, 514, 515, 543, 544, 548, 554, 587, 631,
+    646, 873, 990, 993, 995, 1025, 1026, 1027, 1028, 1029, 1110, 1433, 1720, 1723, 1755, 1900, 2000, 2001, 2049, 2121,
+    2717, 3000, 3128, 3306, 3389, 3986, 4899, 5000, 5009, 5051, 5060, 5101, 5190, 5357, 5432, 5631, 5666, 5800, 5900, 6000,
+    6001, 6646, 7070, 8000, 8008, 8009, 8080, 8081, 8443, 8888, 9100, 9999, 10000, 32768, 49152, 49153, 49154, 49155, 49156, 49157,
+)
+
+CONCURRENCIA = int(os.getenv("TCP_SCAN_CONCURRENCIA", "500"))
+TASA = float(os.getenv("TCP_SCAN_TASA", "2000"))
+TASA_HOST = float(os.getenv("TCP_SCAN_TASA_HOST", "200"))
+TIMEOUT = float(os.getenv("TCP_SCAN_TIMEOUT", "1.0"))
+
+ABIERTO = "abierto"
+CERRADO = "cerrado"
+FILTRADO = "filtrado"
+
+
+class _Tasa:
+    """Espaciado uniforme de eventos a `por_segundo` (un solo event loop: sin locks)."""
+
+    def __init__(self, por_segundo):
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0.0
+        self._siguiente = 0.0
+
+    async def esperar(self):
+        if not self.intervalo:
+            return
+        ahora = time.monotonic()
+        turno = max(ahora, self._siguiente)
+        self._siguiente = turno + self.intervalo
+        if turno > ahora:
+            await asyncio.sleep(turno - ahora)
+
+
+def expandir_hosts(objetivo, max_hosts=MAX_HOSTS):
+    """Hosts de un objetivo: IPs, CIDRs, rangos ("10.0.0.1-20") u hostnames separados por espacios.
+
+    Comprueba el tamaño al llamarla (ValueError si supera `max_hosts`) y devuelve
+    un generador: los hosts, sin repetir, se producen según se van sondeando
+    (los hostnames los resuelve open_connection).
+    """
+    return hosts_objetivo(objetivo, max_hosts)[1]
+
+
+def parse_puertos(spec):
+    """"22,80,8000-8100" → tupla de puertos."""
+    puertos = []
+    for parte in str(spec).split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        if "-" in parte:
+            inicio, fin = parte.split("-", 1)
+            puertos.extend(range(int(inicio), int(fin) + 1))
+        else:
+            puertos.append(int(parte))
+    if not puertos or not all(0 < p < 65536 for p in puertos):
+        raise ValueError(f"Puertos inválidos: {spec}")
+    return tuple(dict.fromkeys(puertos))
+
+
+async def _sondear(ip, puerto, timeout):
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, puerto), timeout)
+    except ConnectionRefusedError:
+        return CERRADO
+    except (asyncio.TimeoutError, OSError):
+        return FILTRADO
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return ABIERTO
+
+
+def _servicio(puerto):
+    try:
+        return socket.getservbyport(puerto, "tcp")
+    except OSError:
+        return "desconocido"
+
+
+async def sondear_hosts(hosts, puertos=TOP_100, concurrencia=CONCURRENCIA, tasa=TASA, tasa_host=TASA_HOST, timeout=TIMEOUT):
+    """{ip: [puertos abiertos]} de los hosts que respondieron en algún puerto.
+
+    `hosts` puede ser un generador: se consume por ventanas de `concurrencia`
+    hosts, y solo los de la ventana en curso tienen su límite de tasa en memoria.
+    """
+    global_ = _Tasa(tasa)
+    activos = {}
+    hosts = iter(hosts)
+
+    async def _worker(pares, por_host):
+        for ip, puerto in pares:
+            await global_.esperar()
+            await por_host[ip].esperar()
+            estado = await _sondear(ip, puerto, timeout)
+            metrics.tcp_sondas.inc(resultado=estado)
+            if estado == ABIERTO:
+                activos.setdefault(ip, []).append(puerto)
+            elif estado == CERRADO:
+                activos.setdefault(ip, [])
+
+    while True:
+        ventana = list(islice(hosts, max(1, concurrencia)))
+        if not ventana:
+            break
+        por_host = {ip: _Tasa(tasa_host) for ip in ventana}
+        # puerto por puerto recorriendo los hosts de la ventana: reparte la carga y no agota tasa_host
+        pares = ((ip, puerto) for puerto in puertos for ip in ventana)
+        n_workers = max(1, min(concurrencia, len(ventana) * len(puertos)))
+        await asyncio.gather(*(_worker(pares, por_host) for _ in range(n_workers)))
+    return activos
+
+
+def _nombres_nmap(ips, puertos):
+    """Nombres de servicio de nmap -sV para `puertos` en `ips`; {} si nmap falla."""
+    resultado = escanear_red(" ".join(ips), f"-Pn -sV -p {','.join(map(str, puertos))}")
+    if isinstance(resultado, dict):
+        return {}
+    return {(h["ip"], p["puerto"]): p["servicio"] for h in resultado for p in h["puertos_abiertos"]}
+
+
+async def _servicios_nmap(activos):
+    """Nombres de nmap -sV de los puertos abiertos de cada host.
+
+    Los hosts se agrupan por su conjunto de puertos abiertos y cada grupo va en su
+    propio nmap: con un único -p con la unión, nmap probaría en cada host los
+    puertos abiertos de todos los demás. Los nmap se limitan con SCAN_MAX_NMAP.
+    """
+    grupos = {}
+    for ip, abiertos in activos.items():
+        if abiertos:
+            grupos.setdefault(tuple(sorted(abiertos)), []).append(ip)
+    nombres = {}
+    for parte in await asyncio.gather(
+        *(asyncio.to_thread(_nombres_nmap, ips, puertos) for puertos, ips in grupos.items())
+    ):
+        nombres.update(parte)
+    return nombres
+
+
+async def escanear_red_async(ip_objetivo, puertos=TOP_100, concurrencia=CONCURRENCIA, tasa=TASA,
+                             tasa_host=TASA_HOST, timeout=TIMEOUT, servicios_nmap=False):
+    try:
+        if not ip_objetivo.split():
+            return {"error": f"Objetivo vacío: {ip_objetivo!r}"}
+        hosts = expandir_hosts(ip_objetivo)
+        activos = await sondear_hosts(hosts, puertos, concurrencia, tasa, tasa_host, timeout)
+    except Exception as e:
+        print(f"❌ ERROR en escanear_red_async: {e}")
+        return {"error": str(e)}
+
+    nombres = await _servicios_nmap(activos) if servicios_nmap else {}
+    resultado = [
+        {
+            "ip": ip,
+            "puertos_abiertos": [
+                {"puerto": p, "servicio": nombres.get((ip, p)) or _servicio(p)} for p in sorted(abiertos)
+            ],
+        } for ip, abiertos in activos.items()
+    ]
+    return sorted(resultado, key=_clave_ip)
+
+
+def escanear_red_tcp(ip_objetivo, **kwargs):
+    """Versión síncrona de `escanear_red_async` (mismo uso que `escanear_red`)."""
+    return asyncio.run(escanear_red_async(ip_objetivo, **kwargs))
@@ -0,0 +1,156 @@
+"""Exportación columnar (Parquet / Arrow) del histórico con esquema plano.
+
+Una fila por host-puerto (los hosts sin puertos abiertos aparecen con puerto nulo),
+con columnas tipadas en lugar de JSON embebido. Se escribe por lotes, así que
+cada lote de scans se convierte en un row group / record batch.
+
+pyarrow es opcional: si no está instalado, `disponible()` devuelve False.
+"""
+import os
+import tempfile
+
+from sqlalchemy import select
+
+from models import ScanPort, ScanAlert
+from services.rule_engine import RANGO_SEVERIDAD
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as ds
+except ImportError:  # pragma: no cover - dependencia opcional
+    pa = None
+
+SCANS_POR_LOTE = 5000
+
+COLUMNAS = ["scan_id", "ip", "fecha", "dia", "puerto", "servicio", "severidad"]
+
+
+def disponible():
+    return pa is not None
+
+
+def esquema():
+    return pa.schema([
+        ("scan_id", pa.int64()),
+        ("ip", pa.string()),
+        ("fecha", pa.timestamp("us")),
+        ("dia", pa.date32()),
+        ("puerto", pa.int32()),
+        ("servicio", pa.string()),
+        ("severidad", pa.string()),
+    ])
+
+
+def _aplanar(db, scans):
+    """scans: lista de (id, ip, fecha). Devuelve un RecordBatch con una fila por host-puerto."""
+    ids = [s[0] for s in scans]
+    puertos = {}
+    for scan_id, puerto, servicio in db.execute(
+        select(ScanPort.scan_id, ScanPort.puerto, ScanPort.servicio).where(ScanPort.scan_id.in_(ids))
+    ):
+        puertos.setdefault(scan_id, []).append((puerto, servicio))
+
+    # severidad más alta por (scan, puerto)
+    severidades = {}
+    for scan_id, puerto, sev in db.execute(
+        select(ScanAlert.scan_id, ScanAlert.puerto, ScanAlert.severidad).where(ScanAlert.scan_id.in_(ids))
+    ):
+        clave = (scan_id, puerto)
+        if RANGO_SEVERIDAD.get(sev, -1) > RANGO_SEVERIDAD.get(severidades.get(clave), -1):
+            severidades[clave] = sev
+
+    cols = {c: [] for c in COLUMNAS}
+    for scan_id, ip, fecha in scans:
+        for puerto, servicio in puertos.get(scan_id) or [(None, None)]:
+            cols["scan_id"].append(scan_id)
+            cols["ip"].append(ip)
+            cols["fecha"].append(fecha)
+            cols["dia"].append(fecha.date() if fecha else None)
+            cols["puerto"].append(puerto)
+            cols["servicio"].append(servicio)
+            cols["severidad"].append(severidades.get((scan_id, puerto)))
+    return pa.RecordBatch.from_pydict(cols, schema=esquema())
+
+
+def lotes(db, filas_scan, scans_por_lote=SCANS_POR_LOTE):
+    """filas_scan: iterable de (id, ip, fecha) en el orden deseado. Genera RecordBatches."""
+    pendientes = []
+    for fila in filas_scan:
+        pendientes.append(tuple(fila))
+        if len(pendientes) >= scans_por_lote:
+            yield _aplanar(db, pendientes)
+            pendientes = []
+    if pendientes:
+        yield _aplanar(db, pendientes)
+
+
+def escribir_parquet(destino, batches, compresion="zstd"):
+    """Escribe cada batch como un row group en `destino` (ruta o fichero binario)."""
+    with pq.ParquetWriter(destino, esquema(), compression=compresion) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+def parquet_stream(batches, tam_trozo=1 << 20, compresion="zstd"):
+    """Parquet necesita escribir el footer al final: se genera en un temporal en disco y se emite por trozos."""
+    with tempfile.TemporaryFile() as tmp:
+        escribir_parquet(tmp, batches, compresion)
+        tmp.seek(0)
+        while True:
+            trozo = tmp.read(tam_trozo)
+            if not trozo:
+                break
+            yield trozo
+
+
+class _Acumulador:
+    """Sink mínimo tipo fichero: acumula lo escrito hasta que se vacía."""
+
+    def __init__(self):
+        self._partes = []
+        self.closed = False
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def vaciar(self):
+        datos = b"".join(self._partes)
+        self._partes = []
+        return datos
+
+
+def arrow_stream(batches):
+    """Formato Arrow IPC (stream): emite bytes batch a batch, apto para StreamingResponse."""
+    sink = _Acumulador()
+    writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), esquema())
+    for batch in batches:
+        writer.write_batch(batch)
+        yield sink.vaciar()
+    writer.close()
+    yield sink.vaciar()
+
+
+def escribir_snapshot(directorio, batches, prefijo="snapshot", compresion="zstd"):
+    """Snapshot particionado por día (estilo Hive: dia=YYYY-MM-DD/<prefijo>-N.parquet)."""
+    os.makedirs(directorio, exist_ok=True)
+    ficheros = []
+    ds.write_dataset(
+        batches,
+        directorio,
+        schema=esquema(),
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("dia", pa.date32())]), flavor="hive"),
+        existing_data_behavior="overwrite_or_ignore",
+        basename_template=prefijo + "-{i}.parquet",
+        file_options=ds.ParquetFileFormat().make_write_options(compression=compresion),
+        file_visitor=lambda f: ficheros.append(f.path),
+    )
+    return ficheros
@@ -0,0 +1,58 @@
+"""Cambios entre dos estados consecutivos de un host.
+
+Un estado es {"puertos": {puerto: servicio}, "alertas": {(regla, puerto): severidad}};
+`None` significa que el host no se había visto antes.
+"""
+
+PUERTO_ABIERTO = "puerto_abierto"
+PUERTO_CERRADO = "puerto_cerrado"
+ALERTA_NUEVA = "alerta_nueva"
+ALERTA_RESUELTA = "alerta_resuelta"
+
+TIPOS = (PUERTO_ABIERTO, PUERTO_CERRADO, ALERTA_NUEVA, ALERTA_RESUELTA)
+
+
+def estado_host(puertos_abiertos, alertas):
+    """Construye un estado a partir de la lista de puertos del escaneo y de alertas estructuradas."""
+    return {
+        "puertos": {p["puerto"]: p.get("servicio") for p in puertos_abiertos},
+        "alertas": {(a["regla"], a.get("puerto")): a["severidad"] for a in alertas},
+    }
+
+
+def estado_a_json(estado):
+    return {
+        "puertos": [{"puerto": p, "servicio": s} for p, s in sorted(estado["puertos"].items())],
+        "alertas": [
+            {"regla": r, "puerto": p, "severidad": sev}
+            for (r, p), sev in sorted(estado["alertas"].items(), key=lambda kv: (kv[0][0], kv[0][1] or -1))
+        ],
+    }
+
+
+def estado_desde_json(data):
+    return {
+        "puertos": {p["puerto"]: p.get("servicio") for p in data.get("puertos", [])},
+        "alertas": {(a["regla"], a.get("puerto")): a["severidad"] for a in data.get("alertas", [])},
+    }
+
+
+def calcular_cambios(previo, actual):
+    """Lista de cambios {"tipo", "puerto", "servicio", "regla", "severidad"} de `previo` a `actual`."""
+    previo = previo or {"puertos": {}, "alertas": {}}
+    cambios = []
+
+    antes, ahora = previo["puertos"], actual["puertos"]
+    for puerto in sorted(ahora.keys() - antes.keys()):
+        cambios.append({"tipo": PUERTO_ABIERTO, "puerto": puerto, "servicio": ahora[puerto], "regla": None, "severidad": None})
+    for puerto in sorted(antes.keys() - ahora.keys()):
+        cambios.append({"tipo": PUERTO_CERRADO, "puerto": puerto, "servicio": antes[puerto], "regla": None, "severidad": None})
+
+    antes, ahora = previo["alertas"], actual["alertas"]
+    orden = lambda k: (k[0], k[1] if k[1] is not None else -1)  # noqa: E731
+    for clave in sorted(ahora.keys() - antes.keys(), key=orden):
+        cambios.append({"tipo": ALERTA_NUEVA, "puerto": clave[1], "servicio": None, "regla": clave[0], "severidad": ahora[clave]})
+    for clave in sorted(antes.keys() - ahora.keys(), key=orden):
+        cambios.append({"tipo": ALERTA_RESUELTA, "puerto": clave[1], "servicio": None, "regla": clave[0], "severidad": antes[clave]})
+
+    return cambios
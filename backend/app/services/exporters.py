@@ -0,0 +1,67 @@
+"""Escritores de exportación por trozos: la memoria no crece con el número de filas."""
+import csv
+import io
+import json
+import zlib
+
+TAM_TROZO = 500  # filas por trozo emitido
+
+
+def _trozos(filas, tam=TAM_TROZO):
+    trozo = []
+    for fila in filas:
+        trozo.append(fila)
+        if len(trozo) >= tam:
+            yield trozo
+            trozo = []
+    if trozo:
+        yield trozo
+
+
+def exportar_csv(filas, campos):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=campos)
+    writer.writeheader()
+    for trozo in _trozos(filas):
+        writer.writerows(trozo)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def exportar_json(filas):
+    """Array JSON emitido elemento a elemento."""
+    yield "["
+    primero = True
+    for trozo in _trozos(filas):
+        partes = [json.dumps(f, ensure_ascii=False) for f in trozo]
+        yield ("" if primero else ",") + ",".join(partes)
+        primero = False
+    yield "]"
+
+
+def exportar_ndjson(filas):
+    for trozo in _trozos(filas):
+        yield "".join(json.dumps(f, ensure_ascii=False) + "\n" for f in trozo)
+
+
+def comprimir_gzip(trozos, nivel=6):
+    """Comprime al vuelo un iterable de str/bytes en formato gzip."""
+    comp = zlib.compressobj(nivel, zlib.DEFLATED, 31)  # wbits=31 → cabecera gzip
+    for t in trozos:
+        datos = comp.compress(t.encode("utf-8") if isinstance(t, str) else t)
+        if datos:
+            yield datos
+    yield comp.flush()
+
+
+FORMATOS = {
+    "csv": ("text/csv", "csv"),
+    "json": ("application/json", "json"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    # columnares: ver services/columnar_export.py
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
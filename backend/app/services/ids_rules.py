@@ -1,17 +1,12 @@
-def evaluar_riesgos(resultados):
-    alertas = []
-
-    for host in resultados:
-        ip = host.get("ip")
-        puertos = [p["puerto"] for p in host.get("puertos_abiertos", [])]
+from services.rule_engine import get_motor
 
-        if 23 in puertos:
-            alertas.append(f"⚠️ {ip}: Puerto 23 (Telnet) abierto – Riesgo ALTO")
-        if 21 in puertos:
-            alertas.append(f"⚠️ {ip}: Puerto 21 (FTP) abierto – Riesgo MEDIO (sin cifrado)")
-        if 3389 in puertos:
-            alertas.append(f"⚠️ {ip}: Puerto 3389 (RDP) abierto – Riesgo ALTO")
-        if 445 in puertos:
-            alertas.append(f"🚨 {ip}: Puerto 445 (SMB) abierto – RIESGO CRÍTICO")
+def evaluar_riesgos_detallado(resultados):
+    """Alertas estructuradas: {"regla", "ip", "puerto", "servicio", "severidad", "mensaje"}."""
+    alertas = []
+    for alertas_host in get_motor().evaluar_lote(resultados):
+        alertas.extend(alertas_host)
+    return alertas
 
-    return alertas
\ No newline at end of file
+def evaluar_riesgos(resultados):
+    # formato histórico (lista de textos) para el histórico y el frontend
+    return [a["mensaje"] for a in evaluar_riesgos_detallado(resultados)]
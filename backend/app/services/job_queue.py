@@ -0,0 +1,217 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from services.scan_engine import MAX_HOSTS, hosts_objetivo
+from services.scan_service import escanear_red
+from services import metrics
+
+# Estados posibles de un job
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+CANCELADO = "cancelado"
+ERROR = "error"
+
+FINALES = (COMPLETADO, CANCELADO, ERROR)
+
+
+def expandir_objetivo(objetivo, tam_lote=16, max_hosts=MAX_HOSTS):
+    """Divide el objetivo en lotes de hosts para poder informar progreso y cancelar.
+
+    Devuelve (hosts_total, lotes). Acepta lo mismo que nmap en /scan: IPs, CIDRs,
+    rangos ("10.0.0.1-20") y hostnames, separados por espacios; cada lote son
+    hosts sueltos, así que el límite por host aplica aunque dos jobs se solapen.
+    Los lotes se generan según se escanean (un CIDR grande no se materializa al
+    crear el job). Más de `max_hosts` hosts lanza ValueError.
+    """
+    total, hosts = hosts_objetivo(objetivo.strip(), max_hosts)
+    return total, iter(lambda: list(islice(hosts, tam_lote)), [])
+
+
+class ScanJob:
+    """Estado de un escaneo encolado.
+
+    No guarda los resultados (un job retenido puede ser un /16): solo contadores
+    y los ids de scan_results que devolvió `al_completar_lote`.
+    """
+
+    def __init__(self, objetivo):
+        self.id = uuid.uuid4().hex
+        self.objetivo = objetivo
+        self.estado = PENDIENTE
+        self.hosts_total, self.lotes = expandir_objetivo(objetivo)
+        self.hosts_completados = 0
+        self.hosts_activos = 0
+        self.n_alertas = 0
+        self.scan_ids = []
+        self.error = None
+        self.creado = datetime.utcnow()
+        self.iniciado = None
+        self.finalizado = None
+        self._cancelar = threading.Event()
+
+    @property
+    def progreso(self):
+        return {
+            "hosts_completados": self.hosts_completados,
+            "hosts_total": self.hosts_total,
+            "porcentaje": round(100 * self.hosts_completados / self.hosts_total, 1) if self.hosts_total else 100.0,
+        }
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "objetivo": self.objetivo,
+            "estado": self.estado,
+            "progreso": self.progreso,
+            "hosts_activos": self.hosts_activos,
+            "n_alertas": self.n_alertas,
+            "error": self.error,
+            "creado": self.creado.isoformat(),
+            "iniciado": self.iniciado.isoformat() if self.iniciado else None,
+            "finalizado": self.finalizado.isoformat() if self.finalizado else None,
+        }
+
+
+class JobManager:
+    """Cola de escaneos con un pool de workers acotado.
+
+    - `max_workers`: escaneos nmap simultáneos en todo el proceso.
+    - `max_por_host`: escaneos simultáneos sobre una misma IP, aunque vengan de jobs distintos.
+    - `al_completar_lote(resultados)`: callback (p. ej. persistencia) tras cada lote de hosts.
+      Debe devolver (alertas del lote, ids de scan_results donde quedaron guardados).
+    """
+
+    def __init__(self, max_workers=4, max_por_host=1, max_jobs_retenidos=500,
+                 escanear=escanear_red, al_completar_lote=None):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scan")
+        self._max_por_host = max_por_host
+        self._max_jobs = max_jobs_retenidos
+        self._escanear = escanear
+        self._al_completar_lote = al_completar_lote
+        self._jobs = OrderedDict()
+        self._semaforos = {}  # ip -> [semáforo, usuarios]; se borra cuando nadie lo usa ni lo espera
+        self._lock = threading.Lock()
+
+    # --- API pública ---
+
+    def submit(self, objetivo):
+        job = ScanJob(objetivo)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._purgar()
+        self._pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def listar(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job.estado not in FINALES:
+            job._cancelar.set()
+            if job.estado == PENDIENTE:
+                self._finalizar(job, CANCELADO)
+        return job
+
+    def shutdown(self, wait=False):
+        for job in self.listar():
+            job._cancelar.set()
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    # --- internos ---
+
+    def _purgar(self):
+        # descarta los jobs terminados más antiguos si superamos el máximo
+        exceso = len(self._jobs) - self._max_jobs
+        if exceso <= 0:
+            return
+        for job_id in [j.id for j in self._jobs.values() if j.estado in FINALES][:exceso]:
+            del self._jobs[job_id]
+
+    def _tomar_semaforos(self, hosts):
+        with self._lock:
+            semaforos = []
+            for host in hosts:
+                entrada = self._semaforos.get(host)
+                if entrada is None:
+                    entrada = self._semaforos[host] = [threading.BoundedSemaphore(self._max_por_host), 0]
+                entrada[1] += 1
+                semaforos.append(entrada[0])
+            return semaforos
+
+    def _soltar_semaforos(self, hosts):
+        with self._lock:
+            for host in hosts:
+                entrada = self._semaforos[host]
+                entrada[1] -= 1
+                if not entrada[1]:
+                    del self._semaforos[host]
+
+    def _finalizar(self, job, estado, error=None):
+        job.estado = estado
+        job.error = error
+        job.finalizado = datetime.utcnow()
+
+    def _run(self, job):
+        if job._cancelar.is_set():
+            return
+        job.estado = EN_CURSO
+        job.iniciado = datetime.utcnow()
+        with metrics.escaneos_en_curso.en_curso(origen="job"):
+            self._ejecutar(job)
+
+    def _ejecutar(self, job):
+        try:
+            for lote in job.lotes:
+                if job._cancelar.is_set():
+                    self._finalizar(job, CANCELADO)
+                    return
+                resultados = self._escanear_lote(lote)
+                if isinstance(resultados, dict) and "error" in resultados:
+                    self._finalizar(job, ERROR, resultados["error"])
+                    return
+                if self._al_completar_lote and resultados:
+                    alertas, scan_ids = self._al_completar_lote(resultados)
+                    job.n_alertas += len(alertas)
+                    job.scan_ids.extend(scan_ids)
+                job.hosts_activos += len(resultados)
+                job.hosts_completados += len(lote)
+            # el total se calcula antes de quitar hosts repetidos entre partes solapadas
+            job.hosts_total = job.hosts_completados
+            self._finalizar(job, COMPLETADO)
+        except Exception as e:
+            self._finalizar(job, ERROR, str(e))
+
+    def _escanear_lote(self, lote):
+        # orden fijo para adquirir semáforos sin riesgo de interbloqueo
+        hosts = sorted(set(lote))
+        semaforos = self._tomar_semaforos(hosts)
+        try:
+            for sem in semaforos:
+                sem.acquire()
+            try:
+                return self._escanear(" ".join(lote))
+            finally:
+                for sem in reversed(semaforos):
+                    sem.release()
+        finally:
+            self._soltar_semaforos(hosts)
+
+
+def crear_job_manager(**kwargs):
+    kwargs.setdefault("max_workers", int(os.getenv("SCAN_WORKERS", "4")))
+    kwargs.setdefault("max_por_host", int(os.getenv("SCAN_MAX_POR_HOST", "1")))
+    return JobManager(**kwargs)
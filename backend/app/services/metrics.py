@@ -0,0 +1,199 @@
+"""Métricas del proceso en formato de texto de Prometheus (sin dependencias externas).
+
+Contadores, medidores e histogramas con etiquetas, seguros entre hilos. Las
+métricas del backend se definen al final del módulo y se exponen en /metrics.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS_HTTP = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_DB = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+BUCKETS_NMAP = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formato_etiquetas(nombres, valores, extra=None):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _num(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def _clave(self, etiquetas):
+        if set(etiquetas) != set(self.etiquetas):
+            raise ValueError(f"{self.nombre}: etiquetas esperadas {self.etiquetas}, recibidas {tuple(etiquetas)}")
+        return tuple(str(etiquetas[n]) for n in self.etiquetas)
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for clave, valor in valores:
+            lineas.extend(self._lineas(clave, valor))
+        return lineas
+
+    def _lineas(self, clave, valor):
+        return [f"{self.nombre}{_formato_etiquetas(self.etiquetas, clave)} {_num(valor)}"]
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, cantidad=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+
+class Medidor(_Metrica):
+    tipo = "gauge"
+
+    def inc(self, cantidad=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def dec(self, cantidad=1, **etiquetas):
+        self.inc(-cantidad, **etiquetas)
+
+    @contextmanager
+    def en_curso(self, **etiquetas):
+        self.inc(**etiquetas)
+        try:
+            yield
+        finally:
+            self.dec(**etiquetas)
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_HTTP):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            estado = self._valores.get(clave)
+            if estado is None:
+                # [cuentas por bucket (no acumuladas), suma, total]
+                estado = self._valores[clave] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    estado[0][i] += 1
+                    break
+            estado[1] += valor
+            estado[2] += 1
+
+    @contextmanager
+    def cronometrar(self, **etiquetas):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - t0, **etiquetas)
+
+    def _lineas(self, clave, valor):
+        cuentas, suma, total = valor
+        lineas, acumulado = [], 0
+        for limite, cuenta in zip(self.buckets, cuentas):
+            acumulado += cuenta
+            le = 'le="' + _num(limite) + '"'
+            lineas.append(f"{self.nombre}_bucket{_formato_etiquetas(self.etiquetas, clave, le)} {acumulado}")
+        etiquetas = _formato_etiquetas(self.etiquetas, clave)
+        lineas.append(f"{self.nombre}_sum{etiquetas} {_num(suma)}")
+        lineas.append(f"{self.nombre}_count{etiquetas} {total}")
+        return lineas
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = []
+
+    def _registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Contador(nombre, ayuda, etiquetas))
+
+    def medidor(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Medidor(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_HTTP):
+        return self._registrar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def exponer(self):
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.exponer())
+        return "\n".join(lineas) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registro = Registro()
+
+# --- métricas del backend ---
+
+http_peticiones = registro.contador(
+    "http_peticiones_total", "Peticiones HTTP atendidas", ("metodo", "ruta", "estado"))
+http_duracion = registro.histograma(
+    "http_peticion_duracion_segundos", "Latencia de las peticiones HTTP (hasta enviar las cabeceras)", ("metodo", "ruta"))
+http_en_curso = registro.medidor(
+    "http_peticiones_en_curso", "Peticiones HTTP en curso")
+
+escaneos_en_curso = registro.medidor(
+    "escaneos_en_curso", "Escaneos nmap en curso", ("origen",))
+nmap_duracion = registro.histograma(
+    "nmap_duracion_segundos", "Duración de cada invocación de nmap", (), BUCKETS_NMAP)
+nmap_por_host = registro.histograma(
+    "nmap_segundos_por_host", "Duración de nmap dividida entre los hosts que devuelve", (), BUCKETS_NMAP)
+nmap_hosts = registro.contador(
+    "nmap_hosts_total", "Hosts devueltos por nmap")
+nmap_errores = registro.contador(
+    "nmap_errores_total", "Invocaciones de nmap fallidas")
+
+tcp_sondas = registro.contador(
+    "tcp_sondas_total", "Conexiones del escáner TCP en asyncio por resultado", ("resultado",))
+
+db_consultas = registro.histograma(
+    "db_consulta_duracion_segundos", "Duración de las sentencias SQL", ("operacion",), BUCKETS_DB)
+
+seccion_duracion = registro.histograma(
+    "seccion_duracion_segundos", "Tiempo en secciones internas (reglas, serialización JSON...)", ("seccion",), BUCKETS_DB)
+
+filas_devueltas = registro.contador(
+    "filas_devueltas_total", "Filas devueltas por los endpoints de consulta", ("ruta",))
+filas_exportadas = registro.contador(
+    "filas_exportadas_total", "Filas escritas por /history/export", ("formato",))
+
+query_cache_consultas = registro.contador(
+    "query_cache_consultas_total", "Consultas a /history y /stats según cómo se resolvieron", ("ruta", "resultado"))
+
+
+def observar_nmap(segundos, hosts):
+    nmap_duracion.observar(segundos)
+    nmap_por_host.observar(segundos / max(1, hosts))
+    nmap_hosts.inc(hosts)
@@ -0,0 +1,201 @@
+"""Persistencia de resultados de escaneo con inserciones masivas (executemany del driver).
+
+Por cada lote de hosts:
+  - las reglas IDS se evalúan una sola vez (RuleEngine.evaluar_lote);
+  - los hosts sin cambios respecto a host_state solo actualizan `ultima_vez`;
+  - el resto se inserta en scan_results, scan_ports, scan_alerts y scan_changes
+    con una sentencia executemany por tabla, en una única transacción;
+  - el inventario (host_state + host_ports) y data_version (la versión que usa la
+    caché de consultas) se actualizan en esa misma transacción.
+
+Varios guardados pueden coincidir (jobs, scheduler, /scan, /scan/stream, la CLI):
+host_state y host_ports se escriben con INSERT ... ON CONFLICT DO UPDATE y, en
+SQLite, cada lote toma el bloqueo de escritura al empezar (BEGIN IMMEDIATE), de
+modo que el diff se calcula sobre un host_state que nadie más está cambiando.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import delete, select
+
+from models import engine, ScanResult, ScanPort, ScanAlert, HostState, HostPort, ScanChange, hash_contenido, ip_a_entero, severidad_maxima, marcar_datos_modificados
+from services.diff_engine import estado_host, estado_desde_json, estado_a_json, calcular_cambios
+from services.rule_engine import get_motor
+
+TAM_LOTE = int(os.getenv("DB_BATCH_SIZE", "1000"))
+_TROZO_IN = 500  # tamaño máximo de las listas IN (...)
+
+_T_RESULTS = ScanResult.__table__
+_T_STATE = HostState.__table__
+_T_HOST_PORTS = HostPort.__table__
+
+# en SQLite los escritores del mismo proceso esperan aquí en vez de reintentar con busy_timeout
+_LOCK_ESCRITURA = threading.Lock()
+
+
+@contextmanager
+def transaccion_escritura():
+    """engine.begin() que en SQLite toma el bloqueo de escritura antes de la primera lectura.
+
+    Con BEGIN (diferido) dos transacciones pueden leer el mismo host_state y luego
+    chocar al escribir; con BEGIN IMMEDIATE la segunda espera (busy_timeout) a que
+    la primera termine, también si está en otro proceso.
+    """
+    if engine.dialect.name != "sqlite":
+        with engine.begin() as conn:
+            yield conn
+        return
+    with _LOCK_ESCRITURA, engine.begin() as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        yield conn
+
+
+def _insert(tabla, columnas, conflicto=None, actualizar=()):
+    sql = f"INSERT INTO {tabla.name} ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))})"
+    if conflicto:
+        sql += f" ON CONFLICT ({', '.join(conflicto)}) DO UPDATE SET " + ", ".join(f"{c} = excluded.{c}" for c in actualizar)
+    return sql
+
+
+# SQL ya escrito y filas como tuplas: executemany del driver sin compilar sentencias
+# ni procesar parámetros de SQLAlchemy por fila (el coste principal con miles de hosts)
+_SQL_RESULTS = _insert(_T_RESULTS, ["id", "ip", "ip_num", "puertos_abiertos", "alertas", "fecha", "hash_contenido", "ultima_vez"])
+_SQL_PUERTOS = _insert(ScanPort.__table__, ["scan_id", "ip", "puerto", "servicio", "fecha"])
+_SQL_ALERTAS = _insert(ScanAlert.__table__, ["scan_id", "ip", "regla", "puerto", "severidad", "mensaje", "fecha"])
+_SQL_CAMBIOS = _insert(ScanChange.__table__, ["scan_id", "ip", "tipo", "puerto", "servicio", "regla", "severidad", "fecha"])
+# un único upsert para hosts nuevos y cambiados; ip, ip_num y primera_vez no se tocan si ya existe,
+# y si otro guardado ha insertado la IP entre tanto se actualiza en vez de fallar
+_SQL_ESTADOS = _insert(
+    _T_STATE,
+    ["ip", "ip_num", "scan_id", "estado", "hash_contenido", "fecha", "n_puertos", "severidad_max", "severidad_rango",
+     "primera_vez", "ultima_vez"],
+    conflicto=["ip"],
+    actualizar=["scan_id", "estado", "hash_contenido", "fecha", "n_puertos", "severidad_max", "severidad_rango", "ultima_vez"],
+)
+_SQL_HOST_PORTS = _insert(_T_HOST_PORTS, ["ip", "puerto", "servicio"], conflicto=["ip", "puerto"], actualizar=["servicio"])
+_SQL_RESULTS_VISTO = f"UPDATE {_T_RESULTS.name} SET ultima_vez = ? WHERE id = ?"
+_SQL_ESTADOS_VISTO = f"UPDATE {_T_STATE.name} SET ultima_vez = ? WHERE ip = ?"
+
+
+def _executemany(conn, sql, filas):
+    if not filas:
+        return
+    if conn.dialect.paramstyle != "qmark":
+        sql = sql.replace("?", "%s")  # psycopg2 / psycopg
+    conn.exec_driver_sql(sql, filas)
+
+
+def _reservar_ids(conn, n):
+    """n ids consecutivos (o no) para scan_results, sin depender de RETURNING.
+
+    En SQLite la transacción ya tiene el bloqueo de escritura (transaccion_escritura),
+    así que max(id) no puede cambiar hasta el commit; en PostgreSQL se piden a la secuencia.
+    """
+    if conn.dialect.name == "postgresql":
+        return conn.exec_driver_sql(
+            "SELECT nextval(pg_get_serial_sequence('scan_results', 'id')) FROM generate_series(1, %(n)s)", {"n": n}
+        ).scalars().all()
+    ultimo = conn.exec_driver_sql(f"SELECT max(id) FROM {_T_RESULTS.name}").scalar() or 0
+    return range(ultimo + 1, ultimo + 1 + n)
+
+
+def guardar_resultados(resultados, alertas_por_host=None, tam_lote=TAM_LOTE, scan_ids=None):
+    """Persiste los hosts de un escaneo y devuelve sus alertas estructuradas (todas, en orden).
+
+    `alertas_por_host` permite reutilizar alertas ya evaluadas (una lista por host);
+    si no se pasa, se evalúan aquí una vez por host. Si se pasa la lista `scan_ids`,
+    se le añade el id de scan_results de cada host guardado (el de su último
+    registro si no cambió).
+    """
+    if isinstance(resultados, dict):
+        # {"error": ...} de escanear_red: nada que guardar
+        return []
+    motor = get_motor()
+    alertas = []
+    for i in range(0, len(resultados), tam_lote):
+        lote = resultados[i:i + tam_lote]
+        alertas_lote = alertas_por_host[i:i + tam_lote] if alertas_por_host is not None else motor.evaluar_lote(lote)
+        with transaccion_escritura() as conn:
+            ids_lote = _guardar_lote(conn, lote, alertas_lote, datetime.utcnow())
+            # al final de la transacción: la fila de data_version queda bloqueada lo mínimo
+            marcar_datos_modificados(conn)
+        if scan_ids is not None:
+            scan_ids.extend(ids_lote)
+        for alertas_host in alertas_lote:
+            alertas.extend(alertas_host)
+    return alertas
+
+
+def _en_trozos(valores, tam=_TROZO_IN):
+    valores = list(valores)
+    for i in range(0, len(valores), tam):
+        yield valores[i:i + tam]
+
+
+def _guardar_lote(conn, lote, alertas_lote, fecha):
+    """Guarda un lote en la transacción `conn`; devuelve el id de scan_results de cada IP distinta."""
+    # si una IP aparece repetida en el lote, cuenta la última aparición
+    por_ip = {}
+    for host, alertas_host in zip(lote, alertas_lote):
+        por_ip[host["ip"]] = (host, alertas_host)
+
+    previos = {}
+    for trozo in _en_trozos(por_ip):
+        for fila in conn.execute(
+            select(HostState.ip, HostState.scan_id, HostState.estado, HostState.hash_contenido)
+            .where(HostState.ip.in_(trozo))
+        ):
+            previos[fila.ip] = fila
+
+    # la fecha se convierte una vez por lote al formato del dialecto (texto ISO en SQLite)
+    procesar = _T_RESULTS.c.fecha.type.dialect_impl(conn.dialect).bind_processor(conn.dialect)
+    fecha = procesar(fecha) if procesar else fecha
+
+    vistos, nuevos = [], []
+    for ip, (host, alertas_host) in por_ip.items():
+        mensajes = [a["mensaje"] for a in alertas_host]
+        huella = hash_contenido(host["puertos_abiertos"], mensajes)
+        previo = previos.get(ip)
+        if previo is not None and previo.hash_contenido == huella and previo.scan_id is not None:
+            vistos.append((previo.scan_id, ip))
+        else:
+            nuevos.append((ip, host, alertas_host, mensajes, huella, previo))
+
+    if vistos:
+        _executemany(conn, _SQL_RESULTS_VISTO, [(fecha, scan_id) for scan_id, _ in vistos])
+        _executemany(conn, _SQL_ESTADOS_VISTO, [(fecha, ip) for _, ip in vistos])
+    if not nuevos:
+        return [scan_id for scan_id, _ in vistos]
+
+    resultados, puertos, alertas, cambios, estados, puertos_host = [], [], [], [], [], []
+    for scan_id, (ip, host, alertas_host, mensajes, huella, previo) in zip(_reservar_ids(conn, len(nuevos)), nuevos):
+        ip_num = ip_a_entero(ip)
+        abiertos = host["puertos_abiertos"]
+        resultados.append((scan_id, ip, ip_num, json.dumps(abiertos), json.dumps(mensajes), fecha, huella, fecha))
+        for p in abiertos:
+            puertos.append((scan_id, ip, p["puerto"], p.get("servicio"), fecha))
+        for a in alertas_host:
+            alertas.append((scan_id, ip, a["regla"], a["puerto"], a["severidad"], a["mensaje"], fecha))
+
+        estado = estado_host(abiertos, alertas_host)
+        for c in calcular_cambios(estado_desde_json(json.loads(previo.estado)) if previo else None, estado):
+            cambios.append((scan_id, ip, c["tipo"], c["puerto"], c["servicio"], c["regla"], c["severidad"], fecha))
+
+        severidad, rango = severidad_maxima(alertas_host)
+        estados.append((ip, ip_num, scan_id, json.dumps(estado_a_json(estado)), huella, fecha,
+                        len(estado["puertos"]), severidad, rango, fecha, fecha))
+        puertos_host.extend((ip, p, sv) for p, sv in estado["puertos"].items())
+
+    _executemany(conn, _SQL_RESULTS, resultados)
+    _executemany(conn, _SQL_PUERTOS, puertos)
+    _executemany(conn, _SQL_ALERTAS, alertas)
+    _executemany(conn, _SQL_CAMBIOS, cambios)
+    _executemany(conn, _SQL_ESTADOS, estados)
+    # los puertos del inventario de los hosts que cambiaron se reescriben enteros
+    for trozo in _en_trozos(n[0] for n in nuevos):
+        conn.execute(delete(_T_HOST_PORTS).where(_T_HOST_PORTS.c.ip.in_(trozo)))
+    _executemany(conn, _SQL_HOST_PORTS, puertos_host)
+    return [scan_id for scan_id, _ in vistos] + [r[0] for r in resultados]
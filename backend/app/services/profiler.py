@@ -0,0 +1,114 @@
+"""Perfilador por muestreo para peticiones lentas (opcional, desactivado por defecto).
+
+Mientras dura una petición, un hilo toma cada `intervalo` segundos la pila de
+todos los hilos del proceso (sys._current_frames). Si la petición supera el
+umbral, las pilas más repetidas se guardan en un buffer circular que se
+consulta en /metrics/profiles. Con peticiones concurrentes las muestras se
+mezclan: es una vista aproximada de en qué se va el tiempo, no una traza.
+
+Se activa con PROFILE_SLOW_MS (umbral en ms; 0 lo desactiva) o en caliente
+con POST /metrics/profiler.
+"""
+import os
+import sys
+import threading
+import traceback
+from collections import Counter, deque
+from datetime import datetime
+
+PROFUNDIDAD = 25  # marcos por pila
+TOP_PILAS = 20    # pilas guardadas por petición lenta
+
+
+class _Muestreo:
+    def __init__(self, intervalo):
+        self.intervalo = intervalo
+        self.pilas = Counter()
+        self.muestras = 0
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, name="profiler", daemon=True)
+
+    def __enter__(self):
+        self.iniciar()
+        return self
+
+    def __exit__(self, *exc):
+        self.detener()
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def detener(self):
+        """Para el hilo y espera a que acabe la muestra en curso (bloquea: fuera del event loop)."""
+        self._parar.set()
+        self._hilo.join()
+
+    def _bucle(self):
+        propio = threading.get_ident()
+        while not self._parar.wait(self.intervalo):
+            for ident, frame in sys._current_frames().items():
+                if ident == propio:
+                    continue
+                pila = traceback.extract_stack(frame, limit=PROFUNDIDAD)
+                self.pilas[tuple(f"{f.filename}:{f.lineno} {f.name}" for f in pila)] += 1
+            self.muestras += 1
+
+
+class Perfilador:
+    def __init__(self, umbral_ms=0, intervalo=0.005, max_perfiles=50):
+        self.umbral_ms = umbral_ms
+        self.intervalo = intervalo
+        self._perfiles = deque(maxlen=max_perfiles)
+        self._lock = threading.Lock()
+
+    @property
+    def activo(self):
+        return self.umbral_ms > 0
+
+    def configurar(self, umbral_ms=None, intervalo=None):
+        if umbral_ms is not None:
+            self.umbral_ms = umbral_ms
+        if intervalo is not None:
+            self.intervalo = intervalo
+        return self.estado()
+
+    def muestrear(self):
+        """Contexto (o iniciar/detener) que muestrea mientras dura; usar solo si `activo`."""
+        return _Muestreo(self.intervalo)
+
+    def registrar(self, muestreo, metodo, ruta, segundos):
+        """Guarda el perfil si la petición superó el umbral; devuelve True si lo guardó."""
+        if not self.activo or segundos * 1000 < self.umbral_ms:
+            return False
+        perfil = {
+            "fecha": datetime.utcnow().isoformat(),
+            "metodo": metodo,
+            "ruta": ruta,
+            "duracion_ms": round(segundos * 1000, 3),
+            "muestras": muestreo.muestras,
+            "pilas": [
+                {"muestras": n, "pila": list(pila)} for pila, n in muestreo.pilas.most_common(TOP_PILAS)
+            ],
+        }
+        with self._lock:
+            self._perfiles.append(perfil)
+        return True
+
+    def perfiles(self):
+        with self._lock:
+            return list(reversed(self._perfiles))
+
+    def vaciar(self):
+        with self._lock:
+            self._perfiles.clear()
+
+    def estado(self):
+        with self._lock:
+            guardados = len(self._perfiles)
+        return {"activo": self.activo, "umbral_ms": self.umbral_ms, "intervalo": self.intervalo, "perfiles": guardados}
+
+
+perfilador = Perfilador(
+    umbral_ms=float(os.getenv("PROFILE_SLOW_MS", "0")),
+    intervalo=float(os.getenv("PROFILE_INTERVAL", "0.005")),
+)
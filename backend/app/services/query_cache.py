@@ -0,0 +1,120 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+
+class QueryCache:
+    """Caché LRU de respuestas de consultas (/history, /stats, /hosts) ligada a una versión de los datos.
+
+    La versión es la fila de data_version, que incrementa cada transacción que
+    escribe en la BD: guardados de cualquier proceso o worker, la CLI con
+    --guardar y la retención. Cada consulta la lee antes de responder
+    (`sincronizar`), así que un cambio hecho fuera de este proceso también deja
+    obsoletas las entradas y los ETags. El ETag depende solo de la versión y de
+    los parámetros normalizados: un If-None-Match vigente se responde con 304 sin
+    consultar los datos.
+
+    Una versión es el par (número, modificado), con `modificado` en segundos epoch.
+    """
+
+    def __init__(self, ttl=60, max_entradas=512):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = (0, 0)
+        self.aciertos = 0
+        self.fallos = 0
+
+    def sincronizar(self, version):
+        """Adopta la versión leída de la BD; si cambió, descarta todas las entradas."""
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._datos.clear()
+
+    @staticmethod
+    def _modificado(version):
+        return datetime.fromtimestamp(version[1], timezone.utc)
+
+    @staticmethod
+    def clave(ruta, params):
+        # mismo filtro con otro orden de parámetros o con parámetros vacíos → misma clave
+        return ruta, tuple(sorted((k, v) for k, v in params if v != ""))
+
+    def etag(self, clave, version):
+        huella = hashlib.sha1(repr(clave).encode()).hexdigest()[:16]
+        return f'W/"{version[0]}-{huella}"'
+
+    def vigente(self, clave, version, if_none_match=None, if_modified_since=None):
+        """True si la copia del cliente (según sus cabeceras condicionales) sigue siendo válida en `version`."""
+        if if_none_match:
+            etag = self.etag(clave, version)
+            return any(e.strip() in (etag, "*") for e in if_none_match.split(","))
+        if if_modified_since:
+            try:
+                return parsedate_to_datetime(if_modified_since) >= self._modificado(version)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def cabeceras(self, clave, version):
+        """ETag / Last-Modified de `version`, la leída antes de consultar (si cambió, el cliente revalidará)."""
+        return {
+            "ETag": self.etag(clave, version),
+            "Last-Modified": format_datetime(self._modificado(version), usegmt=True),
+            # el cliente puede guardar la respuesta, pero debe revalidarla siempre
+            "Cache-Control": "no-cache",
+        }
+
+    def get(self, clave, version):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None or entrada[0] != version or time.monotonic() - entrada[1] > self.ttl:
+                if entrada is not None:
+                    del self._datos[clave]
+                self.fallos += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[2]
+
+    def put(self, clave, valor, version):
+        """Guarda `valor` si los datos no han cambiado desde `version` (la leída antes de consultar)."""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._datos[clave] = (version, time.monotonic(), valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def invalidar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def resumen(self):
+        with self._lock:
+            return {
+                "version": self.version[0],
+                "modificado": self._modificado(self.version).isoformat(),
+                "entradas": len(self._datos),
+                "max_entradas": self.max_entradas,
+                "ttl": self.ttl,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+            }
+
+
+cache = QueryCache(
+    ttl=int(os.getenv("QUERY_CACHE_TTL", "60")),
+    max_entradas=int(os.getenv("QUERY_CACHE_MAX", "512")),
+)
@@ -0,0 +1,318 @@
+"""Retención, compactación y archivado de scan_results.
+
+Política (variables de entorno, ver `politica_desde_entorno`):
+  - `dias_detalle`: los registros más recientes se conservan tal cual;
+  - los más antiguos se compactan a una fila por host y día (`compactar="dia"`)
+    o por cambio de estado (`"cambio"`: se funden los registros consecutivos
+    con el mismo hash_contenido). La fila que queda es la última del grupo, con
+    `fecha` = la primera y `ultima_vez` = la última del grupo;
+  - `dias_total`: los registros que no se ven desde entonces se borran (salvo el
+    último estado de cada host, que sigue en host_state), igual que los cambios
+    de scan_changes de esa antigüedad.
+
+Todo lo que se borra se escribe antes en `archivo_dir` como NDJSON comprimido
+(una línea por registro, con sus puertos y alertas). El trabajo se hace en
+lotes de `lote` filas, cada uno en su propia transacción corta, y al final se
+ejecuta ANALYZE y el VACUUM que permita la BD sin bloquearla mucho tiempo.
+"""
+import gzip
+import json
+import os
+import threading
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, delete, select, text, update
+
+from models import engine, ScanResult, ScanPort, ScanAlert, ScanChange, HostState, marcar_datos_modificados
+
+COMPACTACIONES = ("dia", "cambio", "no")
+VACUUMS = ("incremental", "completo", "no")
+
+_T_RESULTS = ScanResult.__table__
+_T_PORTS = ScanPort.__table__
+_T_ALERTS = ScanAlert.__table__
+_T_CHANGES = ScanChange.__table__
+
+_LECTURA = 5000  # filas por página al recorrer el histórico antiguo
+
+
+@dataclass
+class Politica:
+    dias_detalle: int = 30
+    compactar: str = "dia"
+    dias_total: int = 0  # 0 = no se borra nada por antigüedad
+    archivo_dir: str = "./archive"
+    lote: int = 500
+    vacuum: str = "incremental"
+
+
+def politica_desde_entorno():
+    return Politica(
+        dias_detalle=int(os.getenv("RETENCION_DIAS_DETALLE", "30")),
+        compactar=os.getenv("RETENCION_COMPACTAR", "dia"),
+        dias_total=int(os.getenv("RETENCION_DIAS_TOTAL", "0")),
+        archivo_dir=os.getenv("RETENCION_ARCHIVO_DIR", "./archive"),
+        lote=int(os.getenv("RETENCION_LOTE", "500")),
+        vacuum=os.getenv("RETENCION_VACUUM", "incremental"),
+    )
+
+
+class _Archivo:
+    """NDJSON gzip abierto bajo demanda: si no se borra nada, no se crea fichero."""
+
+    def __init__(self, directorio, prefijo):
+        self.ruta = os.path.join(directorio, f"{prefijo}.ndjson.gz")
+        self._f = None
+        self.lineas = 0
+
+    def escribir(self, registros):
+        if not registros:
+            return
+        if self._f is None:
+            os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+            # en modo append: dos mantenimientos en el mismo segundo no se pisan el fichero
+            self._f = gzip.open(self.ruta, "at", encoding="utf-8")
+        for r in registros:
+            self._f.write(json.dumps(r, ensure_ascii=False, default=str) + "\n")
+        # cada lote queda en disco antes de borrarlo de la BD
+        self._f.flush()
+        self.lineas += len(registros)
+
+    def cerrar(self):
+        if self._f is not None:
+            self._f.close()
+
+
+def _registros_archivo(conn, ids):
+    """Filas completas de scan_results (con puertos y alertas) para el archivo."""
+    filas = conn.execute(select(_T_RESULTS).where(_T_RESULTS.c.id.in_(ids)).order_by(_T_RESULTS.c.id)).mappings().all()
+    puertos, alertas = {}, {}
+    for p in conn.execute(select(_T_PORTS.c.scan_id, _T_PORTS.c.puerto, _T_PORTS.c.servicio).where(_T_PORTS.c.scan_id.in_(ids))):
+        puertos.setdefault(p.scan_id, []).append({"puerto": p.puerto, "servicio": p.servicio})
+    for a in conn.execute(
+        select(_T_ALERTS.c.scan_id, _T_ALERTS.c.regla, _T_ALERTS.c.puerto, _T_ALERTS.c.severidad, _T_ALERTS.c.mensaje)
+        .where(_T_ALERTS.c.scan_id.in_(ids))
+    ):
+        alertas.setdefault(a.scan_id, []).append(
+            {"regla": a.regla, "puerto": a.puerto, "severidad": a.severidad, "mensaje": a.mensaje}
+        )
+    return [
+        {"tabla": "scan_results", **dict(f), "puertos": puertos.get(f["id"], []), "alertas_detalle": alertas.get(f["id"], [])}
+        for f in filas
+    ]
+
+
+def _borrar_scans(conn, ids):
+    conn.execute(delete(_T_PORTS).where(_T_PORTS.c.scan_id.in_(ids)))
+    conn.execute(delete(_T_ALERTS).where(_T_ALERTS.c.scan_id.in_(ids)))
+    conn.execute(delete(_T_RESULTS).where(_T_RESULTS.c.id.in_(ids)))
+
+
+class _Grupo:
+    __slots__ = ("clave", "ids", "fecha", "ultima_vez")
+
+    def __init__(self, clave, fila):
+        self.clave = clave
+        self.ids = [fila.id]
+        self.fecha = fila.fecha
+        self.ultima_vez = fila.ultima_vez or fila.fecha
+
+    def añadir(self, fila):
+        self.ids.append(fila.id)
+        self.fecha = min(self.fecha, fila.fecha)
+        self.ultima_vez = max(self.ultima_vez, fila.ultima_vez or fila.fecha)
+
+
+def _grupos(conn, corte, modo):
+    """Recorre por (ip, id) los registros anteriores a `corte` y genera grupos a fundir (2+ filas)."""
+    ultima_ip, ultimo_id = "", 0
+    grupo = None
+    while True:
+        filas = conn.execute(
+            select(_T_RESULTS.c.id, _T_RESULTS.c.ip, _T_RESULTS.c.fecha, _T_RESULTS.c.ultima_vez, _T_RESULTS.c.hash_contenido)
+            .where(_T_RESULTS.c.fecha < corte)
+            .where((_T_RESULTS.c.ip > ultima_ip) | ((_T_RESULTS.c.ip == ultima_ip) & (_T_RESULTS.c.id > ultimo_id)))
+            .order_by(_T_RESULTS.c.ip, _T_RESULTS.c.id)
+            .limit(_LECTURA)
+        ).all()
+        if not filas:
+            break
+        for f in filas:
+            if modo == "dia":
+                clave = (f.ip, f.fecha.date())
+            else:
+                clave = (f.ip, f.hash_contenido)
+            if grupo is not None and grupo.clave == clave:
+                grupo.añadir(f)
+                continue
+            if grupo is not None and len(grupo.ids) > 1:
+                yield grupo
+            grupo = _Grupo(clave, f)
+        ultima_ip, ultimo_id = filas[-1].ip, filas[-1].id
+    if grupo is not None and len(grupo.ids) > 1:
+        yield grupo
+
+
+def _aplicar_compactacion(grupos, archivo):
+    """Funde cada grupo en su última fila; devuelve las filas borradas."""
+    borrar = [i for g in grupos for i in g.ids[:-1]]
+    if not borrar:
+        return 0
+    with engine.begin() as conn:
+        archivo.escribir(_registros_archivo(conn, borrar))
+        conn.execute(
+            update(_T_RESULTS).where(_T_RESULTS.c.id == bindparam("_id"))
+            .values(fecha=bindparam("_fecha"), ultima_vez=bindparam("_ultima_vez")),
+            [{"_id": g.ids[-1], "_fecha": g.fecha, "_ultima_vez": g.ultima_vez} for g in grupos],
+        )
+        # los cambios apuntan ahora a la fila que representa el grupo
+        conn.execute(
+            update(_T_CHANGES).where(_T_CHANGES.c.scan_id == bindparam("_viejo")).values(scan_id=bindparam("_nuevo")),
+            [{"_viejo": i, "_nuevo": g.ids[-1]} for g in grupos for i in g.ids[:-1]],
+        )
+        _borrar_scans(conn, borrar)
+        marcar_datos_modificados(conn)
+    return len(borrar)
+
+
+def compactar(politica, archivo):
+    if politica.compactar == "no" or politica.dias_detalle <= 0:
+        return 0
+    corte = datetime.utcnow() - timedelta(days=politica.dias_detalle)
+    borradas, pendientes, n_pendientes = 0, [], 0
+    with engine.connect() as lectura:
+        for grupo in _grupos(lectura, corte, politica.compactar):
+            pendientes.append(grupo)
+            n_pendientes += len(grupo.ids) - 1
+            if n_pendientes >= politica.lote:
+                borradas += _aplicar_compactacion(pendientes, archivo)
+                pendientes, n_pendientes = [], 0
+                # la lectura no retiene una instantánea abierta entre lotes
+                lectura.commit()
+    return borradas + _aplicar_compactacion(pendientes, archivo)
+
+
+def purgar(politica, archivo):
+    """Borra los registros y cambios no vistos en `dias_total` días; devuelve (registros, cambios)."""
+    if politica.dias_total <= 0:
+        return 0, 0
+    corte = datetime.utcnow() - timedelta(days=politica.dias_total)
+    vigentes = select(HostState.scan_id).where(HostState.scan_id.isnot(None))
+    registros = cambios = 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(
+                select(_T_RESULTS.c.id)
+                .where(_T_RESULTS.c.ultima_vez < corte, _T_RESULTS.c.id.notin_(vigentes))
+                .order_by(_T_RESULTS.c.id).limit(politica.lote)
+            ).scalars().all()
+            if not ids:
+                break
+            archivo.escribir(_registros_archivo(conn, ids))
+            conn.execute(update(_T_CHANGES).where(_T_CHANGES.c.scan_id.in_(ids)).values(scan_id=None))
+            _borrar_scans(conn, ids)
+            marcar_datos_modificados(conn)
+            registros += len(ids)
+    while True:
+        with engine.begin() as conn:
+            filas = conn.execute(
+                select(_T_CHANGES).where(_T_CHANGES.c.fecha < corte).order_by(_T_CHANGES.c.id).limit(politica.lote)
+            ).mappings().all()
+            if not filas:
+                break
+            archivo.escribir([{"tabla": "scan_changes", **dict(f)} for f in filas])
+            conn.execute(delete(_T_CHANGES).where(_T_CHANGES.c.id.in_([f["id"] for f in filas])))
+            marcar_datos_modificados(conn)
+            cambios += len(filas)
+    return registros, cambios
+
+
+def optimizar(modo):
+    """ANALYZE y, según `modo`, VACUUM (incremental en SQLite si auto_vacuum=INCREMENTAL)."""
+    hecho = []
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        hecho.append("analyze")
+        if modo == "incremental":
+            with engine.connect() as conn:
+                if conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+                    # libera páginas de 1000 en 1000 para no bloquear escrituras mucho tiempo
+                    while conn.execute(text("PRAGMA freelist_count")).scalar():
+                        conn.execute(text("PRAGMA incremental_vacuum(1000)"))
+                        conn.commit()
+                    hecho.append("incremental_vacuum")
+        elif modo == "completo":
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("VACUUM"))
+            hecho.append("vacuum")
+    elif modo != "no":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for tabla in (_T_RESULTS, _T_PORTS, _T_ALERTS, _T_CHANGES):
+                conn.execute(text(f"VACUUM (ANALYZE) {tabla.name}"))
+        hecho.append("vacuum_analyze")
+    return hecho
+
+
+_lock = threading.Lock()
+
+
+def ejecutar_mantenimiento(politica=None):
+    """Compacta, purga y optimiza según `politica`; un solo mantenimiento a la vez."""
+    politica = politica or politica_desde_entorno()
+    if politica.compactar not in COMPACTACIONES:
+        raise ValueError(f"compactar inválido: {politica.compactar}. Usa: {', '.join(COMPACTACIONES)}")
+    if politica.vacuum not in VACUUMS:
+        raise ValueError(f"vacuum inválido: {politica.vacuum}. Usa: {', '.join(VACUUMS)}")
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError("Ya hay un mantenimiento en curso")
+    try:
+        inicio = datetime.utcnow()
+        archivo = _Archivo(politica.archivo_dir, "scan_results-" + inicio.strftime("%Y%m%dT%H%M%S"))
+        try:
+            compactadas = compactar(politica, archivo)
+            purgadas, cambios = purgar(politica, archivo)
+        finally:
+            archivo.cerrar()
+        optimizado = optimizar(politica.vacuum)
+        return {
+            "politica": asdict(politica),
+            "compactadas": compactadas,
+            "purgadas": purgadas,
+            "cambios_purgados": cambios,
+            "archivo": os.path.abspath(archivo.ruta) if archivo.lineas else None,
+            "optimizado": optimizado,
+            "segundos": round((datetime.utcnow() - inicio).total_seconds(), 3),
+        }
+    finally:
+        _lock.release()
+
+
+class MantenimientoPeriodico:
+    """Hilo que ejecuta `ejecutar_mantenimiento` cada `intervalo` segundos."""
+
+    def __init__(self, intervalo):
+        self.intervalo = intervalo
+        self.ultimo = None
+        self._parar = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        if self.intervalo <= 0 or self._hilo is not None:
+            return
+        self._hilo = threading.Thread(target=self._bucle, name="retencion", daemon=True)
+        self._hilo.start()
+
+    def parar(self):
+        self._parar.set()
+
+    def _bucle(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.ultimo = ejecutar_mantenimiento()
+            except Exception as e:
+                print(f"❌ ERROR en el mantenimiento de retención: {e}")
+
+
+periodico = MantenimientoPeriodico(int(os.getenv("RETENCION_INTERVALO", "0")))
@@ -0,0 +1,231 @@
+"""Motor de reglas IDS cargado desde fichero (JSON o YAML).
+
+Formato de cada regla:
+
+    {
+      "id": "smb-abierto",              # obligatorio y único
+      "puertos": [445],                 # dispara por cada puerto abierto de la lista
+      "servicios": ["microsoft-ds"],    # dispara por cada puerto con ese servicio nmap
+      "combinacion": [135, 139, 445],   # dispara una vez si están TODOS abiertos
+      "severidad": "critico",           # bajo | medio | alto | critico
+      "mensaje": "🚨 {ip}: Puerto {puerto} (SMB) abierto – RIESGO CRÍTICO",
+      "activa": true                    # opcional
+    }
+
+Las reglas se compilan una sola vez en tablas puerto→reglas y servicio→reglas,
+así que evaluar un host cuesta en proporción a sus puertos abiertos, no al
+número de reglas.
+"""
+import json
+import os
+import threading
+import time
+
+from services import metrics
+
+SEVERIDADES = ("bajo", "medio", "alto", "critico")
+RANGO_SEVERIDAD = {s: i for i, s in enumerate(SEVERIDADES)}
+
+RUTA_REGLAS = os.getenv("IDS_RULES_PATH", os.path.join(os.path.dirname(__file__), "ids_rules.json"))
+
+
+class ReglaInvalida(ValueError):
+    pass
+
+
+class _Regla:
+    __slots__ = ("id", "orden", "puertos", "servicios", "combinacion", "severidad", "mensaje")
+
+    def __init__(self, orden, data):
+        self.id = data.get("id")
+        if not self.id or not isinstance(self.id, str):
+            raise ReglaInvalida(f"Regla #{orden} sin 'id' (texto)")
+        self.orden = orden
+        try:
+            self.puertos = frozenset(int(p) for p in data.get("puertos", []))
+            self.servicios = frozenset(s.lower() for s in data.get("servicios", []))
+            self.combinacion = frozenset(int(p) for p in data.get("combinacion", []))
+            self.severidad = data.get("severidad", "medio").lower()
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ReglaInvalida(f"Regla '{self.id}': campo inválido ({e})")
+        if not (self.puertos or self.servicios or self.combinacion):
+            raise ReglaInvalida(f"Regla '{self.id}' sin puertos, servicios ni combinacion")
+        if self.severidad not in RANGO_SEVERIDAD:
+            raise ReglaInvalida(f"Regla '{self.id}': severidad inválida '{self.severidad}'")
+        self.mensaje = data.get("mensaje", "{ip}: regla {regla} ({severidad})")
+        if not isinstance(self.mensaje, str):
+            raise ReglaInvalida(f"Regla '{self.id}': el mensaje debe ser texto")
+        # la plantilla se prueba con las dos formas en que se usa: por puerto y por combinación
+        try:
+            self.alerta("0.0.0.0", 0, "")
+            self.alerta("0.0.0.0")
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError) as e:
+            raise ReglaInvalida(f"Regla '{self.id}': mensaje inválido ({type(e).__name__}: {e})")
+
+    def alerta(self, ip, puerto=None, servicio=None):
+        campos = {
+            "regla": self.id,
+            "ip": ip,
+            "puerto": puerto,
+            "servicio": servicio,
+            "severidad": self.severidad,
+        }
+        mensaje = self.mensaje.format(
+            puertos=",".join(str(p) for p in sorted(self.combinacion)), **campos
+        )
+        return {**campos, "mensaje": mensaje}
+
+
+def _leer_fichero(ruta):
+    with open(ruta, encoding="utf-8") as f:
+        if ruta.endswith((".yml", ".yaml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ReglaInvalida("Se necesita PyYAML para cargar reglas en YAML")
+            try:
+                data = yaml.safe_load(f)
+            except (yaml.YAMLError, UnicodeDecodeError) as e:
+                raise ReglaInvalida(f"YAML inválido: {e}")
+        else:
+            try:
+                data = json.load(f)
+            except ValueError as e:  # JSONDecodeError, UnicodeDecodeError
+                raise ReglaInvalida(f"JSON inválido: {e}")
+    if isinstance(data, dict):
+        data = data.get("reglas", [])
+    if not isinstance(data, list):
+        raise ReglaInvalida("El fichero de reglas debe contener una lista 'reglas'")
+    return data
+
+
+class RuleEngine:
+    """Reglas compiladas con recarga en caliente por mtime del fichero."""
+
+    def __init__(self, ruta=RUTA_REGLAS, intervalo_recarga=2.0):
+        self.ruta = ruta
+        self.intervalo_recarga = intervalo_recarga
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._mtime_fallido = None
+        self._ultima_comprobacion = 0.0
+        self.reglas = []
+        self._tablas = ({}, {}, {})
+        try:
+            self.cargar()
+        except (OSError, ValueError) as e:
+            # sin reglas hasta que el fichero se corrija (se recarga al cambiar su mtime)
+            print(f"❌ ERROR cargando reglas IDS: {e}")
+            try:
+                self._mtime_fallido = os.path.getmtime(self.ruta)
+            except OSError:
+                pass
+
+    # --- carga / compilación ---
+
+    def cargar(self):
+        mtime = os.path.getmtime(self.ruta)
+        # toda la validación ocurre antes de tocar las tablas: si falla (ReglaInvalida),
+        # el motor sigue con el último conjunto de reglas bueno
+        reglas = []
+        for i, r in enumerate(_leer_fichero(self.ruta)):
+            if not isinstance(r, dict):
+                raise ReglaInvalida(f"Regla #{i}: se esperaba un objeto, no {type(r).__name__}")
+            if r.get("activa", True):
+                reglas.append(_Regla(i, r))
+        ids = [r.id for r in reglas]
+        if len(ids) != len(set(ids)):
+            raise ReglaInvalida("Hay ids de regla duplicados")
+
+        por_puerto, por_servicio, por_combinacion = {}, {}, {}
+        for r in reglas:
+            for p in r.puertos:
+                por_puerto.setdefault(p, []).append(r)
+            for s in r.servicios:
+                por_servicio.setdefault(s, []).append(r)
+            if r.combinacion:
+                # se indexa por el menor puerto: solo se comprueba si ese está abierto
+                por_combinacion.setdefault(min(r.combinacion), []).append(r)
+
+        with self._lock:
+            self.reglas = reglas
+            # una sola asignación: los evaluadores en curso nunca ven tablas mezcladas
+            self._tablas = (por_puerto, por_servicio, por_combinacion)
+            self._mtime = mtime
+            self._ultima_comprobacion = time.monotonic()
+        return len(reglas)
+
+    def recargar_si_cambia(self):
+        ahora = time.monotonic()
+        if ahora - self._ultima_comprobacion < self.intervalo_recarga:
+            return False
+        self._ultima_comprobacion = ahora
+        mtime = None
+        try:
+            mtime = os.path.getmtime(self.ruta)
+            if mtime in (self._mtime, self._mtime_fallido):
+                return False
+            self.cargar()
+            return True
+        except (OSError, ValueError) as e:
+            # un fichero a medio escribir o inválido no tumba el motor: seguimos con las reglas
+            # previas y no se reintenta hasta que el fichero vuelva a cambiar
+            self._mtime_fallido = mtime
+            print(f"❌ ERROR recargando reglas IDS: {e}")
+            return False
+
+    # --- evaluación ---
+
+    def evaluar_host(self, host):
+        por_puerto, por_servicio, por_combinacion = self._tablas
+        ip = host.get("ip")
+        puertos = {}
+        for p in host.get("puertos_abiertos", []):
+            puertos[p["puerto"]] = (p.get("servicio") or "").lower()
+
+        disparadas = {}
+        for puerto, servicio in puertos.items():
+            for r in por_puerto.get(puerto, ()):
+                disparadas.setdefault((r.orden, puerto), (r, puerto, servicio))
+            for r in por_servicio.get(servicio, ()):
+                disparadas.setdefault((r.orden, puerto), (r, puerto, servicio))
+            for r in por_combinacion.get(puerto, ()):
+                if r.combinacion.issubset(puertos):
+                    disparadas.setdefault((r.orden, -1), (r, None, None))
+
+        # mismo orden que el fichero de reglas, y dentro de cada regla por puerto
+        return [r.alerta(ip, puerto, servicio) for _, (r, puerto, servicio) in sorted(disparadas.items())]
+
+    def evaluar_lote(self, hosts):
+        """Evalúa muchos hosts en una pasada; devuelve una lista de alertas por host."""
+        self.recargar_si_cambia()
+        with metrics.seccion_duracion.cronometrar(seccion="reglas"):
+            return [self.evaluar_host(h) for h in hosts]
+
+    def resumen(self):
+        return {
+            "ruta": self.ruta,
+            "total": len(self.reglas),
+            "reglas": [
+                {
+                    "id": r.id,
+                    "severidad": r.severidad,
+                    "puertos": sorted(r.puertos),
+                    "servicios": sorted(r.servicios),
+                    "combinacion": sorted(r.combinacion),
+                } for r in self.reglas
+            ],
+        }
+
+
+_motor = None
+_motor_lock = threading.Lock()
+
+
+def get_motor():
+    global _motor
+    if _motor is None:
+        with _motor_lock:
+            if _motor is None:
+                _motor = RuleEngine()
+    return _motor
@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from services.scan_service import ARGUMENTOS_NMAP
+
+
+class ScanCache:
+    """Caché LRU con TTL de resultados de escaneo, por (objetivo, argumentos nmap)."""
+
+    def __init__(self, ttl=300, max_entradas=256):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    @staticmethod
+    def clave(objetivo, argumentos=ARGUMENTOS_NMAP):
+        # "10.0.0.1  10.0.0.2" y "10.0.0.2 10.0.0.1" son el mismo objetivo
+        return " ".join(sorted(objetivo.split())), " ".join(argumentos.split())
+
+    def get(self, objetivo, argumentos=ARGUMENTOS_NMAP):
+        if self.ttl <= 0:
+            return None
+        k = self.clave(objetivo, argumentos)
+        with self._lock:
+            entrada = self._datos.get(k)
+            if entrada is None or time.monotonic() - entrada[0] > self.ttl:
+                if entrada is not None:
+                    del self._datos[k]
+                self.fallos += 1
+                return None
+            self._datos.move_to_end(k)
+            self.aciertos += 1
+            return entrada[1]
+
+    def put(self, objetivo, resultados, argumentos=ARGUMENTOS_NMAP):
+        # los errores no se cachean
+        if self.ttl <= 0 or (isinstance(resultados, dict) and "error" in resultados):
+            return
+        k = self.clave(objetivo, argumentos)
+        with self._lock:
+            self._datos[k] = (time.monotonic(), resultados)
+            self._datos.move_to_end(k)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def invalidar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def resumen(self):
+        with self._lock:
+            return {
+                "entradas": len(self._datos),
+                "max_entradas": self.max_entradas,
+                "ttl": self.ttl,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+            }
+
+
+cache = ScanCache(
+    ttl=int(os.getenv("SCAN_CACHE_TTL", "300")),
+    max_entradas=int(os.getenv("SCAN_CACHE_MAX", "256")),
+)
+
@@ -0,0 +1,222 @@
+import ipaddress
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from services.scan_service import escanear_red, escanear_red_iter, ARGUMENTOS_NMAP
+
+PREFIJO_SHARD = int(os.getenv("SCAN_SHARD_PREFIX", "24"))
+PARALELISMO = int(os.getenv("SCAN_PARALELISMO", str(os.cpu_count() or 1)))
+# hosts máximos de un objetivo que se expande host a host (jobs, escáner TCP); 0 = sin límite
+MAX_HOSTS = int(os.getenv("SCAN_MAX_HOSTS", "65536"))
+
+
+def n_hosts(red):
+    """Número de direcciones que devuelve `red.hosts()`, sin recorrerla."""
+    if red.num_addresses <= 2:
+        return red.num_addresses
+    # IPv4 excluye red y broadcast; IPv6 solo la anycast de subred
+    return red.num_addresses - (2 if red.version == 4 else 1)
+
+
+def comprobar_tamaño(objetivo, total, max_hosts=MAX_HOSTS):
+    if max_hosts and total > max_hosts:
+        raise ValueError(f"{objetivo}: {total} hosts; el máximo es {max_hosts} (SCAN_MAX_HOSTS)")
+
+
+def _parse_rango(objetivo):
+    """Convierte "10.0.0.1-10.0.3.254" o "10.0.0.1-200" en lista de redes; None si no es un rango."""
+    if "-" not in objetivo:
+        return None
+    inicio, fin = objetivo.split("-", 1)
+    try:
+        ip_inicio = ipaddress.ip_address(inicio.strip())
+        fin = fin.strip()
+        if fin.isdigit() and ip_inicio.version == 4:
+            # estilo nmap: último octeto
+            base = str(ip_inicio).rsplit(".", 1)[0]
+            ip_fin = ipaddress.ip_address(f"{base}.{fin}")
+        else:
+            ip_fin = ipaddress.ip_address(fin)
+        return list(ipaddress.summarize_address_range(ip_inicio, ip_fin))
+    except ValueError:
+        return None
+
+
+def hosts_objetivo(objetivo, max_hosts=MAX_HOSTS):
+    """(total, hosts) de un objetivo: IPs, CIDRs, rangos ("10.0.0.1-20") u hostnames separados por espacios.
+
+    Comprueba el tamaño al llamarla (ValueError si supera `max_hosts`); `hosts` es
+    un generador que produce cada host una sola vez, según se consume, así que
+    `total` puede contar de más si las partes se solapan. Los hostnames cuentan
+    como un host y se devuelven tal cual.
+    """
+    partes, total = [], 0
+    for parte in objetivo.split():
+        redes = _parse_rango(parte)
+        if redes is not None:
+            # un rango incluye todas sus direcciones, también las que serían red o broadcast de sus bloques
+            partes.extend((red, True) for red in redes)
+            total += sum(red.num_addresses for red in redes)
+            continue
+        try:
+            red = ipaddress.ip_network(parte, strict=False)
+        except ValueError:
+            partes.append((parte, True))
+            total += 1
+            continue
+        partes.append((red, False))
+        total += n_hosts(red)
+    comprobar_tamaño(objetivo, total, max_hosts)
+    return total, _generar_hosts(partes)
+
+
+def _generar_hosts(partes):
+    vistos = set()
+    for parte, completa in partes:
+        if isinstance(parte, str):
+            hosts = (parte,)
+        elif completa or parte.num_addresses <= 2:
+            hosts = map(str, parte)
+        else:
+            hosts = map(str, parte.hosts())
+        for host in hosts:
+            if host not in vistos:
+                vistos.add(host)
+                yield host
+
+
+def dividir_objetivo(objetivo, prefijo_shard=PREFIJO_SHARD):
+    """Divide un CIDR o rango en sub-bloques de tamaño /prefijo_shard.
+
+    Lo que no se pueda interpretar (hostnames, listas, sintaxis nmap avanzada)
+    se devuelve tal cual como único shard.
+    """
+    objetivo = objetivo.strip()
+    redes = _parse_rango(objetivo)
+    if redes is None:
+        try:
+            redes = [ipaddress.ip_network(objetivo, strict=False)]
+        except ValueError:
+            return [objetivo]
+
+    shards = []
+    # las redes pequeñas (típicas de un rango) se agrupan hasta llenar un shard
+    grupo, tam_grupo = [], 0
+    for red in redes:
+        if red.prefixlen < prefijo_shard:
+            shards.extend(str(s) for s in red.subnets(new_prefix=prefijo_shard))
+            continue
+        capacidad = 2 ** (red.max_prefixlen - prefijo_shard)
+        if tam_grupo + red.num_addresses > capacidad and grupo:
+            shards.append(" ".join(grupo))
+            grupo, tam_grupo = [], 0
+        # una IP suelta (o los extremos /32 de un rango) va a nmap como "10.0.0.5", no como "10.0.0.5/32"
+        grupo.append(str(red.network_address) if red.num_addresses == 1 else str(red))
+        tam_grupo += red.num_addresses
+    if grupo:
+        shards.append(" ".join(grupo))
+    return shards
+
+
+def escanear_red_paralelo(ip_objetivo, argumentos=ARGUMENTOS_NMAP, prefijo_shard=PREFIJO_SHARD, paralelismo=PARALELISMO):
+    """Igual que `escanear_red`, pero reparte el objetivo en shards entre varios procesos nmap.
+
+    Devuelve la misma forma: lista de {"ip", "puertos_abiertos"} ordenada por IP,
+    o {"error": ...} si todos los shards fallan. Cada shard se lanza desde un hilo
+    que solo espera a su nmap: no hace falta hacer fork del proceso del servidor.
+    """
+    shards = dividir_objetivo(ip_objetivo, prefijo_shard)
+    if len(shards) == 1 or paralelismo <= 1:
+        return _combinar(escanear_red(s, argumentos) for s in shards)
+
+    with ThreadPoolExecutor(max_workers=min(paralelismo, len(shards)), thread_name_prefix="nmap-shard") as pool:
+        futuros = [pool.submit(escanear_red, s, argumentos) for s in shards]
+        return _combinar(f.result() for f in as_completed(futuros))
+
+
+_FIN_SHARD = object()
+
+
+def escanear_red_paralelo_iter(ip_objetivo, argumentos=ARGUMENTOS_NMAP, prefijo_shard=PREFIJO_SHARD, paralelismo=PARALELISMO):
+    """Como `escanear_red_paralelo`, pero va devolviendo cada host en cuanto su nmap lo termina.
+
+    Cada shard es un proceso nmap leído de forma incremental (`escanear_red_iter`)
+    desde un hilo; hasta `paralelismo` a la vez. Un shard que falla no corta los
+    demás: al final se lanza RuntimeError con los errores de todos los fallidos.
+    """
+    shards = dividir_objetivo(ip_objetivo, prefijo_shard)
+    if len(shards) == 1 or paralelismo <= 1:
+        errores = []
+        for shard in shards:
+            try:
+                yield from escanear_red_iter(shard, argumentos)
+            except Exception as e:
+                errores.append(f"{shard}: {e}")
+        if errores:
+            raise RuntimeError("; ".join(errores))
+        return
+
+    cola = queue.Queue()
+    procesos, errores = [], []
+    parar = threading.Event()
+
+    def _shard(shard):
+        try:
+            if parar.is_set():
+                return
+            for host in escanear_red_iter(shard, argumentos, procesos, parar):
+                if parar.is_set():
+                    return
+                cola.put(host)
+        except Exception as e:
+            errores.append(f"{shard}: {e}")
+        finally:
+            cola.put(_FIN_SHARD)
+
+    pool = ThreadPoolExecutor(max_workers=min(paralelismo, len(shards)), thread_name_prefix="nmap-shard")
+    for shard in shards:
+        pool.submit(_shard, shard)
+    pendientes = len(shards)
+    try:
+        while pendientes:
+            host = cola.get()
+            if host is _FIN_SHARD:
+                pendientes -= 1
+                continue
+            yield host
+    finally:
+        # si el consumidor se va antes del final, se paran los nmap en curso y los shards en cola
+        parar.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        for proceso in list(procesos):
+            if proceso.poll() is None:
+                proceso.kill()
+    if errores:
+        raise RuntimeError("; ".join(errores))
+
+
+def _clave_ip(host):
+    try:
+        ip = ipaddress.ip_address(host["ip"])
+        return (ip.version, int(ip), "")
+    except ValueError:
+        return (99, 0, host["ip"])
+
+
+def _combinar(parciales):
+    hosts = {}
+    errores = []
+    for parcial in parciales:
+        if isinstance(parcial, dict) and "error" in parcial:
+            errores.append(parcial["error"])
+            continue
+        for host in parcial:
+            hosts[host["ip"]] = host
+
+    if errores and not hosts:
+        return {"error": "; ".join(errores)}
+    if errores:
+        print(f"❌ ERROR en {len(errores)} shard(s): {errores[0]}")
+    return sorted(hosts.values(), key=_clave_ip)
@@ -1,27 +1,147 @@
+import os
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+from xml.etree import ElementTree
+
 import nmap
 
-def escanear_red(ip_objetivo):
+from services import metrics
+
+ARGUMENTOS_NMAP = '-T4 -F'
+
+# procesos nmap simultáneos en este proceso, vengan de /scan, /scan/stream, los
+# jobs, el scheduler, la CLI o el -sV del escáner TCP: todos pasan por aquí
+MAX_NMAP = int(os.getenv("SCAN_MAX_NMAP", str(os.cpu_count() or 1)))
+_PROCESOS_NMAP = threading.BoundedSemaphore(max(1, MAX_NMAP))
+
+def _puertos_abiertos(datos_host):
+    puertos_abiertos = []
+    if 'tcp' in datos_host:
+        for port, port_data in datos_host['tcp'].items():
+            if port_data['state'] == 'open':
+                puertos_abiertos.append({
+                    "puerto": port,
+                    "servicio": port_data.get("name", "desconocido")
+                })
+    return puertos_abiertos
+
+def escanear_red(ip_objetivo, argumentos=ARGUMENTOS_NMAP):
+    with _PROCESOS_NMAP:
+        return _escanear_red(ip_objetivo, argumentos)
+
+def _escanear_red(ip_objetivo, argumentos):
+    t0 = time.perf_counter()
     try:
         nm = nmap.PortScanner()
-        resultado = nm.scan(hosts=ip_objetivo, arguments='-T4 -F')
+        resultado = nm.scan(hosts=ip_objetivo, arguments=argumentos)
         hosts_resultado = []
 
         for host in nm.all_hosts():
-            puertos_abiertos = []
-            if 'tcp' in nm[host]:
-                for port, port_data in nm[host]['tcp'].items():
-                    if port_data['state'] == 'open':
-                        puertos_abiertos.append({
-                            "puerto": port,
-                            "servicio": port_data.get("name", "desconocido")
-                        })
             hosts_resultado.append({
                 "ip": host,
-                "puertos_abiertos": puertos_abiertos
+                "puertos_abiertos": _puertos_abiertos(nm[host])
             })
 
-        return hosts_resultado
-
     except Exception as e:
         print(f"❌ ERROR en escanear_red: {e}")
+        metrics.nmap_errores.inc()
         return {"error": str(e)}
+
+    metrics.observar_nmap(time.perf_counter() - t0, len(hosts_resultado))
+    return hosts_resultado
+
+def _host_xml(elemento):
+    """Convierte un <host> de la salida XML de nmap en {"ip", "puertos_abiertos"}; None si no está activo."""
+    estado = elemento.find("status")
+    if estado is not None and estado.get("state") != "up":
+        return None
+    ip = next((a.get("addr") for a in elemento.iter("address") if a.get("addrtype") in ("ipv4", "ipv6")), None)
+    if ip is None:
+        return None
+    puertos_abiertos = []
+    for puerto in elemento.iterfind("ports/port"):
+        estado_puerto = puerto.find("state")
+        if puerto.get("protocol") != "tcp" or estado_puerto is None or estado_puerto.get("state") != "open":
+            continue
+        servicio = puerto.find("service")
+        puertos_abiertos.append({
+            "puerto": int(puerto.get("portid")),
+            # mismo valor que python-nmap cuando falta <service>
+            "servicio": servicio.get("name", "") if servicio is not None else ""
+        })
+    return {"ip": ip, "puertos_abiertos": puertos_abiertos}
+
+def _errores_nmap(stderr):
+    # como python-nmap: las líneas "Warning: ..." no son errores; el resto (p. ej. "Failed to resolve") sí
+    lineas = stderr.decode(errors="replace").splitlines()
+    return [l for l in lineas if l.strip() and not l.lower().startswith("warning:")]
+
+def escanear_red_iter(ip_objetivo, argumentos=ARGUMENTOS_NMAP, procesos=None, parar=None):
+    """Como `escanear_red`, pero va devolviendo cada host en cuanto nmap lo termina.
+
+    Un único proceso nmap con salida XML en stdout (`-oX -`), leída de forma
+    incremental: nmap escribe cada <host> al terminar su grupo. Lanza
+    RuntimeError si nmap falla o avisa de errores (p. ej. un hostname que no
+    resuelve), después de haber emitido los hosts que sí terminaron, para que
+    el consumidor pueda informar del fallo.
+
+    Si se pasa la lista `procesos`, se le añade el Popen de nmap para poder
+    matarlo desde otro hilo; si además `parar` (threading.Event) está activo
+    cuando nmap termina, se trata como cancelado y no como error.
+
+    Ocupa un hueco de SCAN_MAX_NMAP desde que arranca nmap hasta que el
+    generador termina o se cierra.
+    """
+    with _PROCESOS_NMAP:
+        yield from _escanear_red_iter(ip_objetivo, argumentos, procesos, parar)
+
+def _escanear_red_iter(ip_objetivo, argumentos, procesos, parar):
+    ruta = shutil.which("nmap")
+    if ruta is None:
+        metrics.nmap_errores.inc()
+        raise RuntimeError("nmap no está instalado o no está en el PATH")
+    comando = [ruta, "-oX", "-", *shlex.split(argumentos), *ip_objetivo.split()]
+    t0 = time.perf_counter()
+    proceso = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if procesos is not None:
+        procesos.append(proceso)
+        if parar is not None and parar.is_set():
+            # se pidió parar justo antes de registrarlo: quien para ya no lo verá
+            proceso.kill()
+    # stderr se vacía en otro hilo: si se llena la tubería, nmap se bloquea
+    stderr = []
+    lector = threading.Thread(target=lambda: stderr.append(proceso.stderr.read()), daemon=True)
+    lector.start()
+    hosts = 0
+    try:
+        parser = ElementTree.XMLPullParser(events=("end",))
+        for linea in proceso.stdout:
+            parser.feed(linea)
+            for _, elemento in parser.read_events():
+                if elemento.tag != "host":
+                    continue
+                host = _host_xml(elemento)
+                elemento.clear()
+                if host is not None:
+                    hosts += 1
+                    yield host
+        proceso.wait()
+        lector.join()
+        if parar is not None and parar.is_set():
+            return
+        errores = _errores_nmap(b"".join(stderr))
+        if proceso.returncode != 0 or errores:
+            raise RuntimeError("; ".join(errores) or f"nmap terminó con código {proceso.returncode}")
+    except Exception:
+        metrics.nmap_errores.inc()
+        raise
+    else:
+        metrics.observar_nmap(time.perf_counter() - t0, hosts)
+    finally:
+        # consumidor desconectado (GeneratorExit) o error: no dejar nmap huérfano
+        if proceso.poll() is None:
+            proceso.kill()
+            proceso.wait()
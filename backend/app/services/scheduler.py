@@ -0,0 +1,224 @@
+"""Barridos periódicos de objetivos con nombre (tablas scan_schedules / scan_schedule_runs).
+
+Un hilo revisa cada `tick` segundos los schedules vencidos y los lanza en orden
+de prioridad, sin pasar de `max_concurrentes` barridos a la vez. Cada barrido
+programado usa un único proceso nmap (los shards van en serie); el tope de
+procesos nmap del proceso, compartido con /scan, /scan/stream y los jobs, es
+SCAN_MAX_NMAP (scan_service).
+
+  - la primera ejecución se retrasa un tiempo aleatorio (hasta `arranque_max`
+    segundos) y cada intervalo varía ±`jitter`, para que los schedules creados
+    a la vez no coincidan siempre en el mismo minuto;
+  - si un schedule vence mientras su ejecución anterior sigue en curso, se
+    registra como `omitido` y se reprograma;
+  - los vencidos que no caben esperan al siguiente hueco, por prioridad.
+
+Varios procesos (p. ej. workers de uvicorn) pueden tener el scheduler activo:
+  - cada ejecución se reclama con un UPDATE condicionado a `proxima_ejecucion`
+    dentro de una transacción exclusiva (`transaccion_exclusiva`), así que
+    nunca se lanza dos veces;
+  - "en curso" y el límite de `max_concurrentes` se cuentan sobre las filas
+    `en_curso` de scan_schedule_runs, comunes a todos los procesos;
+  - cada ejecución guarda su `propietario` (host:pid) y renueva `latido`. Al
+    arrancar, un proceso solo da por interrumpidas las suyas (de una vida
+    anterior con el mismo host:pid); las de otros procesos se interrumpen
+    cuando pasan `caducidad` segundos sin latido.
+"""
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, or_, select, update
+
+from models import engine, transaccion_exclusiva, BLOQUEO_SCHEDULER, ScanSchedule, ScanScheduleRun
+from services import metrics
+from services.async_scanner import escanear_red_tcp
+from services.scan_engine import escanear_red_paralelo
+
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+ERROR = "error"
+OMITIDO = "omitido"
+INTERRUMPIDO = "interrumpido"
+
+MOTORES = ("nmap", "tcp")
+
+_T_SCHEDULES = ScanSchedule.__table__
+_T_RUNS = ScanScheduleRun.__table__
+
+
+def escanear_objetivo(objetivo, motor="nmap"):
+    if motor == "tcp":
+        return escanear_red_tcp(objetivo)
+    # paralelismo=1: un solo proceso nmap por escaneo programado
+    return escanear_red_paralelo(objetivo, paralelismo=1)
+
+
+class Scheduler:
+    def __init__(self, al_completar=None, escanear=escanear_objetivo, max_concurrentes=2,
+                 jitter=0.1, arranque_max=300, tick=1.0, caducidad=120):
+        self.max_concurrentes = max_concurrentes
+        self.jitter = jitter
+        self.arranque_max = arranque_max
+        self.tick = tick
+        self.caducidad = caducidad
+        self.propietario = f"{socket.gethostname()}:{os.getpid()}"
+        self._escanear = escanear
+        self._al_completar = al_completar
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrentes, thread_name_prefix="sched")
+        self._ultimo_latido = 0.0
+        self._parar = threading.Event()
+        self._despertar = threading.Event()
+        self._hilo = None
+
+    # --- ciclo de vida ---
+
+    def iniciar(self):
+        if self._hilo is not None:
+            return
+        with transaccion_exclusiva(BLOQUEO_SCHEDULER) as conn:
+            # las de este host:pid son de un arranque anterior (p. ej. el contenedor reiniciado);
+            # las de otros procesos pueden seguir vivas y se dejan a la caducidad
+            self._interrumpir(conn, _T_RUNS.c.propietario == self.propietario)
+        self._hilo = threading.Thread(target=self._bucle, name="scheduler", daemon=True)
+        self._hilo.start()
+
+    def parar(self, wait=False):
+        self._parar.set()
+        self._despertar.set()
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def despertar(self):
+        """Revisa los schedules ya, sin esperar al siguiente tick."""
+        self._despertar.set()
+
+    # --- planificación ---
+
+    def primera_ejecucion(self, intervalo, ahora=None):
+        ahora = ahora or datetime.utcnow()
+        return ahora + timedelta(seconds=random.uniform(0, min(intervalo, self.arranque_max)))
+
+    def siguiente_ejecucion(self, intervalo, desde):
+        return desde + timedelta(seconds=intervalo * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def en_curso(self, schedule_id):
+        """True si alguna ejecución del schedule sigue en curso, en este proceso o en otro."""
+        vivas = _T_RUNS.c.latido >= datetime.utcnow() - timedelta(seconds=self.caducidad)
+        with engine.connect() as conn:
+            return conn.execute(
+                select(_T_RUNS.c.id)
+                .where(_T_RUNS.c.schedule_id == schedule_id, _T_RUNS.c.estado == EN_CURSO, vivas)
+                .limit(1)
+            ).first() is not None
+
+    def _interrumpir(self, conn, condicion):
+        conn.execute(
+            update(_T_RUNS).where(_T_RUNS.c.estado == EN_CURSO, condicion)
+            .values(estado=INTERRUMPIDO, fin=datetime.utcnow(), error="Proceso del scheduler terminado o sin latido")
+        )
+
+    def _mantener(self):
+        """Renueva el latido de las ejecuciones propias e interrumpe las caducadas de otros procesos."""
+        if time.monotonic() - self._ultimo_latido < self.caducidad / 3:
+            return
+        ahora = datetime.utcnow()
+        with transaccion_exclusiva(BLOQUEO_SCHEDULER) as conn:
+            conn.execute(
+                update(_T_RUNS).where(_T_RUNS.c.estado == EN_CURSO, _T_RUNS.c.propietario == self.propietario)
+                .values(latido=ahora)
+            )
+            self._interrumpir(conn, or_(
+                _T_RUNS.c.latido.is_(None), _T_RUNS.c.latido < ahora - timedelta(seconds=self.caducidad)
+            ))
+        self._ultimo_latido = time.monotonic()
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                self._mantener()
+                self._despachar()
+            except Exception as e:
+                print(f"❌ ERROR en el scheduler: {e}")
+            self._despertar.wait(self.tick)
+            self._despertar.clear()
+
+    def _despachar(self):
+        ahora = datetime.utcnow()
+        vencido = (_T_SCHEDULES.c.activo.is_(True), _T_SCHEDULES.c.proxima_ejecucion <= ahora)
+        # lectura barata en cada tick; el bloqueo exclusivo solo cuando hay algo que lanzar
+        with engine.connect() as conn:
+            if conn.execute(select(_T_SCHEDULES.c.id).where(*vencido).limit(1)).first() is None:
+                return
+        lanzar = []
+        with transaccion_exclusiva(BLOQUEO_SCHEDULER) as conn:
+            corriendo = set(conn.execute(
+                select(_T_RUNS.c.schedule_id).where(_T_RUNS.c.estado == EN_CURSO)
+            ).scalars())
+            n_en_curso = conn.execute(
+                select(func.count()).select_from(_T_RUNS).where(_T_RUNS.c.estado == EN_CURSO)
+            ).scalar()
+            vencidos = conn.execute(
+                select(_T_SCHEDULES.c.id, _T_SCHEDULES.c.objetivo, _T_SCHEDULES.c.motor,
+                       _T_SCHEDULES.c.intervalo, _T_SCHEDULES.c.proxima_ejecucion)
+                .where(*vencido)
+                .order_by(_T_SCHEDULES.c.prioridad.desc(), _T_SCHEDULES.c.proxima_ejecucion)
+            ).all()
+            for s in vencidos:
+                en_marcha = s.id in corriendo
+                lleno = n_en_curso + len(lanzar) >= self.max_concurrentes
+                if lleno and not en_marcha:
+                    continue  # espera hueco; los de más prioridad ya se han tomado
+                if not self._reclamar(conn, s, ahora):
+                    continue
+                if en_marcha:
+                    conn.execute(insert(_T_RUNS).values(
+                        schedule_id=s.id, estado=OMITIDO, programada=s.proxima_ejecucion, inicio=ahora, fin=ahora,
+                        error="La ejecución anterior sigue en curso",
+                    ))
+                    continue
+                run_id = conn.execute(insert(_T_RUNS).values(
+                    schedule_id=s.id, estado=EN_CURSO, programada=s.proxima_ejecucion, inicio=ahora,
+                    propietario=self.propietario, latido=ahora,
+                )).inserted_primary_key[0]
+                lanzar.append((s.id, s.objetivo, s.motor, run_id))
+        for schedule_id, objetivo, motor, run_id in lanzar:
+            self._pool.submit(self._ejecutar, schedule_id, objetivo, motor, run_id)
+
+    def _reclamar(self, conn, s, ahora):
+        resultado = conn.execute(
+            update(_T_SCHEDULES)
+            .where(_T_SCHEDULES.c.id == s.id, _T_SCHEDULES.c.proxima_ejecucion == s.proxima_ejecucion)
+            .values(proxima_ejecucion=self.siguiente_ejecucion(s.intervalo, ahora), ultima_ejecucion=ahora)
+        )
+        return resultado.rowcount == 1
+
+    def _ejecutar(self, schedule_id, objetivo, motor, run_id):
+        fin = {"estado": COMPLETADO}
+        try:
+            with metrics.escaneos_en_curso.en_curso(origen="programado"):
+                resultados = self._escanear(objetivo, motor)
+            if isinstance(resultados, dict) and "error" in resultados:
+                fin = {"estado": ERROR, "error": resultados["error"]}
+            else:
+                alertas = self._al_completar(resultados) if self._al_completar and resultados else []
+                fin.update(hosts=len(resultados), alertas=len(alertas or []))
+        except Exception as e:
+            fin = {"estado": ERROR, "error": str(e)}
+        finally:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(update(_T_RUNS).where(_T_RUNS.c.id == run_id).values(fin=datetime.utcnow(), **fin))
+            finally:
+                self._despertar.set()
+
+
+def crear_scheduler(**kwargs):
+    kwargs.setdefault("max_concurrentes", int(os.getenv("SCHEDULER_MAX_CONCURRENTES", "2")))
+    kwargs.setdefault("jitter", float(os.getenv("SCHEDULER_JITTER", "0.1")))
+    kwargs.setdefault("arranque_max", int(os.getenv("SCHEDULER_ARRANQUE_MAX", "300")))
+    kwargs.setdefault("caducidad", int(os.getenv("SCHEDULER_CADUCIDAD", "120")))
+    return Scheduler(**kwargs)
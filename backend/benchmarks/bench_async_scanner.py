@@ -0,0 +1,115 @@
+"""Puertos sondeados por segundo: escáner TCP en asyncio frente a nmap, contra listeners locales.
+
+Abre `--listeners` sockets en escucha repartidos entre 127.0.0.1..127.0.0.N, sondea
+todos los puertos de --puertos en esos N hosts con ambos motores y comprueba que
+encuentran exactamente los puertos en escucha.
+
+Uso (desde backend/):
+    python benchmarks/bench_async_scanner.py --hosts 8 --puertos 20000-20999 --listeners 40
+    python benchmarks/bench_async_scanner.py --concurrencia 1000 --tasa 0 --tasa-host 0 --sin-nmap
+
+Sin nmap instalado (o con --sin-nmap) solo se mide el motor asyncio.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from services.async_scanner import escanear_red_tcp, parse_puertos  # noqa: E402
+from services.scan_service import escanear_red  # noqa: E402
+
+
+def abrir_listeners(hosts, puertos, n, semilla=0):
+    """Abre n sockets en escucha en pares (host, puerto) aleatorios; devuelve (sockets, {ip: {puertos}})."""
+    rnd = random.Random(semilla)
+    sockets, esperado = [], {}
+    while len(sockets) < n:
+        ip, puerto = rnd.choice(hosts), rnd.choice(puertos)
+        if puerto in esperado.get(ip, ()):
+            continue
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind((ip, puerto))
+        except OSError:
+            s.close()  # puerto ocupado por otro proceso
+            continue
+        s.listen(128)
+        sockets.append(s)
+        esperado.setdefault(ip, set()).add(puerto)
+    return sockets, esperado
+
+
+def encontrados(resultado):
+    if isinstance(resultado, dict):
+        raise RuntimeError(resultado["error"])
+    return {h["ip"]: {p["puerto"] for p in h["puertos_abiertos"]} for h in resultado if h["puertos_abiertos"]}
+
+
+def medir(caso, fn, sondas, esperado):
+    t0 = time.perf_counter()
+    resultado = fn()
+    segundos = time.perf_counter() - t0
+    hallado = encontrados(resultado)
+    r = {
+        "caso": caso,
+        "segundos": round(segundos, 3),
+        "sondas": sondas,
+        "sondas_s": round(sondas / segundos, 1) if segundos else None,
+        "correcto": hallado == esperado,
+    }
+    print(f"{caso:>8}: {segundos:8.3f}s  {r['sondas_s']:>10} puertos/s  correcto={r['correcto']}")
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hosts", type=int, default=4, help="hosts 127.0.0.1..127.0.0.N")
+    parser.add_argument("--puertos", default="20000-20999")
+    parser.add_argument("--listeners", type=int, default=20)
+    parser.add_argument("--concurrencia", type=int, default=500)
+    parser.add_argument("--tasa", type=float, default=0, help="conexiones/s en total (0 = sin límite)")
+    parser.add_argument("--tasa-host", type=float, default=0, help="conexiones/s por host (0 = sin límite)")
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--sin-nmap", action="store_true")
+    parser.add_argument("--salida", help="fichero JSON con los resultados")
+    args = parser.parse_args()
+
+    hosts = [f"127.0.0.{i}" for i in range(1, args.hosts + 1)]
+    puertos = parse_puertos(args.puertos)
+    sockets, esperado = abrir_listeners(hosts, puertos, args.listeners)
+    objetivo = f"127.0.0.1-{args.hosts}"
+    sondas = len(hosts) * len(puertos)
+    print(f"{len(hosts)} hosts × {len(puertos)} puertos = {sondas} sondas, {len(sockets)} en escucha")
+
+    resultados = []
+    try:
+        resultados.append(medir("asyncio", lambda: escanear_red_tcp(
+            objetivo, puertos=puertos, concurrencia=args.concurrencia, tasa=args.tasa,
+            tasa_host=args.tasa_host, timeout=args.timeout,
+        ), sondas, esperado))
+        if args.sin_nmap or not shutil.which("nmap"):
+            print("   nmap: omitido" + ("" if args.sin_nmap else " (no está instalado)"))
+        else:
+            resultados.append(medir("nmap", lambda: escanear_red(
+                objetivo, f"-T4 -Pn -sT -p {args.puertos}",
+            ), sondas, esperado))
+    finally:
+        for s in sockets:
+            s.close()
+
+    if len(resultados) == 2 and resultados[1]["segundos"]:
+        print(f"speedup asyncio/nmap: x{resultados[1]['segundos'] / resultados[0]['segundos']:.2f}")
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump({"parametros": vars(args), "resultados": resultados}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""Latencia (p50/p95/p99) y throughput de las rutas calientes del backend, con salida JSON.
+
+Mide, sobre un histórico sintético de cada tamaño:
+  - /history con distintos filtros y órdenes;
+  - /history/export (csv y ndjson, cuerpo completo);
+  - evaluar_riesgos sobre listas sintéticas de hosts;
+  - /scan con un nmap falso (sin red), incluyendo reglas y persistencia.
+
+Uso (desde backend/):
+    python benchmarks/bench_backend.py --tamanos 10000 1000000 --salida bench.json
+    python benchmarks/bench_backend.py --tamanos 10000 --comparar bench_base.json
+
+Los tamaños se siembran de forma acumulativa en una misma BD (10k, luego hasta 1M, ...).
+Con --directorio la BD se conserva y se reutiliza entre ejecuciones (útil para 10M).
+Si DATABASE_URL está definida se usa esa BD en lugar de un SQLite en --directorio.
+Requiere httpx (TestClient de FastAPI).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from bench_persistence import PUERTOS, hosts_sinteticos  # noqa: E402
+
+TAM_SIEMBRA = 10_000
+DIAS = 90  # las fechas sintéticas cubren los últimos DIAS días
+IPS_DISTINTAS = 1 << 16
+
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return None
+    k = min(len(ordenados) - 1, max(0, round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[k]
+
+
+def resumen(caso, tiempos, unidades=None, **extra):
+    """Percentiles en ms y throughput (peticiones/s y, si se indica, unidades/s)."""
+    ordenados = sorted(tiempos)
+    total = sum(ordenados)
+    r = {
+        "caso": caso,
+        "n": len(ordenados),
+        "p50_ms": round(_percentil(ordenados, 50) * 1000, 3),
+        "p95_ms": round(_percentil(ordenados, 95) * 1000, 3),
+        "p99_ms": round(_percentil(ordenados, 99) * 1000, 3),
+        "media_ms": round(total / len(ordenados) * 1000, 3),
+        "ops_s": round(len(ordenados) / total, 2) if total else None,
+    }
+    if unidades is not None:
+        r["unidades_s"] = round(unidades * len(ordenados) / total, 1) if total else None
+    r.update(extra)
+    return r
+
+
+def medir(fn, repeticiones, calentamiento=2):
+    for _ in range(calentamiento):
+        fn()
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - t0)
+    return tiempos
+
+
+# --- siembra ---
+
+def _ip(i):
+    i %= IPS_DISTINTAS
+    return f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}" if i & 1 else f"192.168.{(i >> 8) & 255}.{i & 255}"
+
+
+def sembrar(models, hasta, semilla=7):
+    """Inserta filas sintéticas en scan_results/scan_ports/scan_alerts hasta tener `hasta` registros."""
+    from sqlalchemy import func, insert, select
+    from services.rule_engine import get_motor
+
+    t_res, t_puertos, t_alertas = models.ScanResult.__table__, models.ScanPort.__table__, models.ScanAlert.__table__
+    with models.engine.connect() as conn:
+        actuales, max_id = conn.execute(select(func.count(), func.coalesce(func.max(t_res.c.id), 0))).one()
+    if actuales >= hasta:
+        return 0
+
+    motor = get_motor()
+    rnd = random.Random(semilla + actuales)
+    inicio = datetime.utcnow() - timedelta(days=DIAS)
+    paso = timedelta(days=DIAS) / max(hasta, 1)
+    siguiente_id = max_id + 1
+    pendientes = hasta - actuales
+    while pendientes > 0:
+        n = min(TAM_SIEMBRA, pendientes)
+        hosts, filas = [], []
+        for k in range(n):
+            i = siguiente_id + k
+            ip = _ip(rnd.randrange(IPS_DISTINTAS))
+            puertos = [{"puerto": p, "servicio": s} for p, s in rnd.sample(PUERTOS, rnd.randint(0, 4))]
+            hosts.append({"ip": ip, "puertos_abiertos": puertos})
+            fecha = inicio + paso * (actuales + (i - max_id - 1))
+            filas.append({"id": i, "ip": ip, "ip_num": models.ip_a_entero(ip), "fecha": fecha, "ultima_vez": fecha})
+        alertas_lote = motor.evaluar_lote(hosts)
+
+        puertos, alertas = [], []
+        for fila, host, alertas_host in zip(filas, hosts, alertas_lote):
+            mensajes = [a["mensaje"] for a in alertas_host]
+            fila["puertos_abiertos"] = json.dumps(host["puertos_abiertos"])
+            fila["alertas"] = json.dumps(mensajes)
+            fila["hash_contenido"] = models.hash_contenido(host["puertos_abiertos"], mensajes)
+            for p in host["puertos_abiertos"]:
+                puertos.append({"scan_id": fila["id"], "ip": fila["ip"], "puerto": p["puerto"],
+                                "servicio": p["servicio"], "fecha": fila["fecha"]})
+            for a in alertas_host:
+                alertas.append({"scan_id": fila["id"], "ip": fila["ip"], "regla": a["regla"], "puerto": a["puerto"],
+                                "severidad": a["severidad"], "mensaje": a["mensaje"], "fecha": fila["fecha"]})
+        with models.engine.begin() as conn:
+            conn.execute(insert(t_res), filas)
+            if puertos:
+                conn.execute(insert(t_puertos), puertos)
+            if alertas:
+                conn.execute(insert(t_alertas), alertas)
+        siguiente_id += n
+        pendientes -= n
+    return hasta - actuales
+
+
+# --- casos ---
+
+def casos_history(n):
+    medio = (datetime.utcnow() - timedelta(days=DIAS // 2)).replace(microsecond=0)
+    return [
+        ("history_fecha_desc", {}),
+        ("history_ip_asc", {"order_by": "ip", "order_dir": "asc"}),
+        ("history_id_asc", {"order_by": "id", "order_dir": "asc"}),
+        ("history_ip_exacta", {"ip": _ip(12345)}),
+        ("history_cidr_16", {"ip": "192.168.0.0/16"}),
+        ("history_rango_ip", {"ip_from": "10.0.0.0", "ip_to": "10.0.63.255"}),
+        ("history_puerto", {"puerto": 3389}),
+        ("history_severidad", {"severidad": "critico"}),
+        ("history_un_dia", {"start": medio.isoformat(), "end": (medio + timedelta(days=1)).isoformat()}),
+        ("history_offset_profundo", {"offset": max(0, n // 2)}),
+    ]
+
+
+def bench_history(cliente, n, repeticiones, limit):
+    resultados = []
+    for caso, params in casos_history(n):
+        params = {"limit": limit, **params}
+        filas = []
+
+        def _peticion():
+            r = cliente.get("/history", params=params)
+            r.raise_for_status()
+            filas.append(len(r.json()))
+        tiempos = medir(_peticion, repeticiones)
+        resultados.append(resumen(caso, tiempos, params=params, filas=filas[-1]))
+
+    # página siguiente por cursor a mitad del histórico (comparable con offset_profundo)
+    r = cliente.get("/history", params={"limit": limit, "offset": max(0, n // 2)})
+    cursor = r.headers.get("X-Next-Cursor")
+    if cursor:
+        tiempos = medir(lambda: cliente.get("/history", params={"limit": limit, "cursor": cursor}).raise_for_status(), repeticiones)
+        resultados.append(resumen("history_cursor_profundo", tiempos, params={"limit": limit}))
+    return resultados
+
+
+def bench_export(cliente, repeticiones, filas):
+    resultados = []
+    for formato in ("csv", "ndjson"):
+        params = {"format": formato, "limit": filas}
+        tam = []
+
+        def _peticion():
+            r = cliente.get("/history/export", params=params)
+            r.raise_for_status()
+            tam.append(len(r.content))
+        tiempos = medir(_peticion, repeticiones, calentamiento=1)
+        resultados.append(resumen(f"export_{formato}", tiempos, unidades=filas, params=params, bytes=tam[-1]))
+    return resultados
+
+
+def bench_reglas(repeticiones, hosts_por_lista):
+    from services.ids_rules import evaluar_riesgos
+    hosts = list(hosts_sinteticos(hosts_por_lista))
+    tiempos = medir(lambda: evaluar_riesgos(hosts), repeticiones)
+    return [resumen("evaluar_riesgos", tiempos, unidades=hosts_por_lista, hosts=hosts_por_lista)]
+
+
+def bench_scan(cliente, main, repeticiones, hosts_por_scan):
+    # nmap falso: cada llamada devuelve hosts distintos, así que no la absorben la caché ni la deduplicación
+    semillas = iter(range(1, 1 << 30))
+    original = main.escanear_red_paralelo
+    main.escanear_red_paralelo = lambda ip, *a, **kw: list(hosts_sinteticos(hosts_por_scan, semilla=next(semillas)))
+    try:
+        def _peticion():
+            r = cliente.get("/scan", params={"ip": "10.0.0.0/24", "usar_cache": False})
+            r.raise_for_status()
+        tiempos = medir(_peticion, repeticiones)
+    finally:
+        main.escanear_red_paralelo = original
+    return [resumen("scan_nmap_falso", tiempos, unidades=hosts_por_scan, hosts=hosts_por_scan)]
+
+
+# --- JSON / comparación ---
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(base, actual, umbral):
+    """Imprime la variación de p50/p95 respecto a `base`; devuelve el número de regresiones."""
+    previos = {(r["tamano"], r["caso"]): r for r in base["resultados"]}
+    regresiones = 0
+    for r in actual["resultados"]:
+        previo = previos.get((r["tamano"], r["caso"]))
+        if not previo:
+            continue
+        for clave in ("p50_ms", "p95_ms"):
+            if not previo[clave]:
+                continue
+            variacion = r[clave] / previo[clave] - 1
+            marca = ""
+            if variacion > umbral:
+                marca = "  <-- regresión"
+                regresiones += 1
+            print(f"{r['tamano']:>9} {r['caso']:<26} {clave} {previo[clave]:>10.2f} -> {r[clave]:>10.2f} ({variacion:+.0%}){marca}",
+                  file=sys.stderr)
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--repeticiones", type=int, default=30)
+    parser.add_argument("--limit", type=int, default=100, help="filas por página en /history")
+    parser.add_argument("--filas-export", type=int, default=10_000)
+    parser.add_argument("--hosts-reglas", type=int, default=1000, help="hosts por lista en evaluar_riesgos")
+    parser.add_argument("--hosts-scan", type=int, default=256, help="hosts que devuelve el nmap falso por /scan")
+    parser.add_argument("--directorio", help="directorio de la BD SQLite (por defecto, un temporal nuevo)")
+    parser.add_argument("--salida", help="fichero JSON de resultados (por defecto, stdout)")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior para detectar regresiones")
+    parser.add_argument("--umbral", type=float, default=0.2, help="empeoramiento relativo que cuenta como regresión")
+    args = parser.parse_args()
+
+    directorio = args.directorio or tempfile.mkdtemp(prefix="bench_backend_")
+    os.makedirs(directorio, exist_ok=True)
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.abspath(os.path.join(directorio, 'bench.db'))}")
+    # ni la caché de escaneos ni la de consultas deben intervenir en las mediciones
+    os.environ.setdefault("SCAN_CACHE_TTL", "0")
+    os.environ.setdefault("QUERY_CACHE_TTL", "0")
+    os.chdir(directorio)
+
+    from fastapi.testclient import TestClient
+    import main as app_main
+    import models
+
+    salida = {
+        "commit": _commit(),
+        "fecha": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "database_url": models.DATABASE_URL.split("@")[-1],
+        "parametros": vars(args),
+        "resultados": [],
+    }
+
+    with TestClient(app_main.app) as cliente:
+        for n in sorted(args.tamanos):
+            t0 = time.perf_counter()
+            sembradas = sembrar(models, n)
+            print(f"{n:>9} filas: sembradas {sembradas} en {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+            filas = bench_history(cliente, n, args.repeticiones, args.limit)
+            filas += bench_export(cliente, max(3, args.repeticiones // 10), min(args.filas_export, n))
+            filas += bench_reglas(args.repeticiones, args.hosts_reglas)
+            filas += bench_scan(cliente, app_main, max(5, args.repeticiones // 3), args.hosts_scan)
+            for r in filas:
+                r["tamano"] = n
+                print(f"{n:>9} {r['caso']:<26} p50 {r['p50_ms']:>9.2f} ms  p95 {r['p95_ms']:>9.2f} ms  {r['ops_s'] or 0:>9.1f} op/s",
+                      file=sys.stderr)
+            salida["resultados"].extend(filas)
+
+    texto = json.dumps(salida, indent=2, ensure_ascii=False, default=str)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            sys.exit(1 if comparar(json.load(f), salida, args.umbral) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Filas por segundo al persistir resultados de escaneo: ruta ORM original frente a `guardar_resultados`.
+
+Uso (desde backend/):
+    python benchmarks/bench_persistence.py --tamanos 10000 100000 1000000 --lote 1000
+    python benchmarks/bench_persistence.py --tamanos 2000 --hilos 6
+
+Con --hilos N comprueba además N guardados simultáneos de las mismas IPs (como
+jobs, scheduler y /scan a la vez): ninguno debe fallar y el inventario debe quedar
+con una fila por IP. Sale con código 1 si no es así.
+
+Cada medición usa una BD SQLite nueva en un directorio temporal.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+PUERTOS = [(21, "ftp"), (22, "ssh"), (23, "telnet"), (80, "http"), (135, "msrpc"), (139, "netbios-ssn"),
+           (443, "https"), (445, "microsoft-ds"), (3306, "mysql"), (3389, "ms-wbt-server"), (8080, "http-proxy")]
+
+
+def hosts_sinteticos(n, semilla=42):
+    rnd = random.Random(semilla)
+    for i in range(n):
+        ip = f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+        puertos = rnd.sample(PUERTOS, rnd.randint(0, 4))
+        yield {"ip": ip, "puertos_abiertos": [{"puerto": p, "servicio": s} for p, s in puertos]}
+
+
+def ruta_orm_original(resultados, SessionLocal, ScanResult, evaluar_riesgos):
+    # réplica del /scan original: un db.add por host y evaluar_riesgos dos veces
+    db = SessionLocal()
+    try:
+        for host in resultados:
+            alertas_host = evaluar_riesgos([host])
+            db.add(ScanResult(
+                ip=host["ip"],
+                puertos_abiertos=json.dumps(host["puertos_abiertos"]),
+                alertas=json.dumps(alertas_host)
+            ))
+        db.commit()
+    finally:
+        db.close()
+    alertas_agregadas = []
+    for h in resultados:
+        alertas_agregadas.extend(evaluar_riesgos([h]))
+    return alertas_agregadas
+
+
+def guardados_concurrentes(n, hilos, models, guardar_resultados, lote):
+    """Lanza `hilos` guardados a la vez sobre las mismas n IPs (con puertos distintos); devuelve los errores."""
+    from sqlalchemy import func, select
+
+    tandas = [list(hosts_sinteticos(n, semilla=i)) for i in range(hilos)]
+    errores = []
+    salida = threading.Barrier(hilos)
+
+    def guardar(hosts):
+        salida.wait()
+        try:
+            guardar_resultados(hosts, tam_lote=lote)
+        except Exception as e:
+            errores.append(f"{type(e).__name__}: {e}"[:200])
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=guardar, args=(t,)) for t in tandas]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    dt = time.perf_counter() - t0
+    with models.engine.connect() as conn:
+        estados = conn.scalar(select(func.count()).select_from(models.HostState))
+        huerfanos = conn.scalar(
+            select(func.count()).select_from(models.HostPort)
+            .where(models.HostPort.ip.not_in(select(models.HostState.ip)))
+        )
+    if estados != n:
+        errores.append(f"host_state tiene {estados} filas, se esperaban {n}")
+    if huerfanos:
+        errores.append(f"{huerfanos} filas de host_ports sin host_state")
+    print(f"{n:>9} hosts | {hilos} hilos | {dt:8.2f}s | {len(errores)} error(es)")
+    for e in errores:
+        print(f"    {e}")
+    return errores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--lote", type=int, default=1000, help="hosts por transacción en guardar_resultados")
+    parser.add_argument("--sin-original", action="store_true", help="omitir la ruta ORM original (lenta en 1M)")
+    parser.add_argument("--hilos", type=int, default=0, help="comprobar también N guardados concurrentes de las mismas IPs")
+    args = parser.parse_args()
+
+    # la URL de la BD es relativa al directorio de trabajo: cada ejecución va a su propio temporal
+    os.chdir(tempfile.mkdtemp(prefix="bench_persistence_"))
+    import models
+    from services.ids_rules import evaluar_riesgos
+    from services.persistence import guardar_resultados
+
+    for n in args.tamanos:
+        hosts = list(hosts_sinteticos(n))
+        rutas = [("bulk", lambda: guardar_resultados(hosts, tam_lote=args.lote))]
+        if not args.sin_original:
+            rutas.insert(0, ("orm", lambda: ruta_orm_original(hosts, models.SessionLocal, models.ScanResult, evaluar_riesgos)))
+        for nombre, fn in rutas:
+            models.Base.metadata.drop_all(models.engine)
+            models.init_db()
+            t0 = time.perf_counter()
+            fn()
+            dt = time.perf_counter() - t0
+            print(f"{n:>9} hosts | {nombre:<4} | {dt:8.2f}s | {n / dt:>10.0f} filas/s")
+
+    if args.hilos:
+        fallos = 0
+        for n in args.tamanos:
+            models.Base.metadata.drop_all(models.engine)
+            models.init_db()
+            fallos += len(guardados_concurrentes(n, args.hilos, models, guardar_resultados, args.lote))
+        if fallos:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Compara el tiempo de pared de `escanear_red` (un solo nmap) frente a `escanear_red_paralelo`.
+
+Uso (desde backend/):
+    python benchmarks/bench_scan_engine.py 192.168.1.0/24 --prefijo 26 --paralelismo 4
+
+Requiere nmap instalado y permisos para escanear el objetivo.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from services.scan_service import escanear_red  # noqa: E402
+from services.scan_engine import dividir_objetivo, escanear_red_paralelo  # noqa: E402
+
+
+def _medir(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    res = fn(*args, **kwargs)
+    return time.perf_counter() - t0, res
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("objetivo", help="CIDR o rango, p. ej. 10.0.0.0/22")
+    parser.add_argument("--prefijo", type=int, default=24, help="tamaño de shard (/N)")
+    parser.add_argument("--paralelismo", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeticiones", type=int, default=1)
+    args = parser.parse_args()
+
+    shards = dividir_objetivo(args.objetivo, args.prefijo)
+    print(f"Objetivo {args.objetivo}: {len(shards)} shard(s) de /{args.prefijo}, paralelismo {args.paralelismo}")
+
+    for i in range(args.repeticiones):
+        t_simple, r_simple = _medir(escanear_red, args.objetivo)
+        t_par, r_par = _medir(escanear_red_paralelo, args.objetivo, prefijo_shard=args.prefijo, paralelismo=args.paralelismo)
+        n_simple = len(r_simple) if isinstance(r_simple, list) else 0
+        n_par = len(r_par) if isinstance(r_par, list) else 0
+        print(f"[{i + 1}] simple: {t_simple:8.2f}s ({n_simple} hosts) | "
+              f"paralelo: {t_par:8.2f}s ({n_par} hosts) | speedup x{t_simple / t_par if t_par else 0:.2f}")
+
+
+if __name__ == "__main__":
+    main()
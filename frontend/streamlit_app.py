@@ -1,6 +1,7 @@
 # frontend/streamlit_app.py
 import os
 import json
+import time as _time
 from datetime import datetime, time
 from typing import Optional, Dict, Any
 
@@ -128,19 +129,43 @@ def safe_get(url: str, params: Dict[str, Any] | None = None, timeout: int = 25):
     except requests.RequestException as e:
         return None, str(e)
 
-@st.cache_data(ttl=15, show_spinner=False)
-def fetch_history_cached(base: str, params: Dict[str, Any]):
-    r, err = safe_get(f"{base}/history", params)
-    if err:
-        return None, err
+@st.cache_resource(show_spinner=False)
+def _etag_store() -> Dict[Any, Any]:
+    # compartido entre sesiones: (url, params) -> (ETag, datos)
+    return {}
+
+def fetch_json_conditional(url: str, params: Dict[str, Any]):
+    """GET con If-None-Match: si el backend responde 304 se reutilizan los datos ya descargados."""
+    store = _etag_store()
+    key = (url, tuple(sorted((k, str(v)) for k, v in params.items() if v is not None)))
+    previo = store.get(key)
+    try:
+        headers = {"If-None-Match": previo[0]} if previo else {}
+        r = requests.get(url, params=params, headers=headers, timeout=25)
+    except requests.RequestException as e:
+        return None, str(e)
+    if r.status_code == 304 and previo:
+        return previo[1], None
     if r.status_code != 200:
         return None, f"{r.status_code} - {r.text}"
     try:
         data = r.json()
     except Exception:
         return None, "Respuesta no es JSON"
+    if r.headers.get("ETag"):
+        if len(store) >= 256:
+            store.clear()
+        store[key] = (r.headers["ETag"], data)
     return data, None
 
+@st.cache_data(ttl=15, show_spinner=False)
+def fetch_history_cached(base: str, params: Dict[str, Any]):
+    return fetch_json_conditional(f"{base}/history", params)
+
+@st.cache_data(ttl=15, show_spinner=False)
+def fetch_stats_cached(base: str, params: Dict[str, Any]):
+    return fetch_json_conditional(f"{base}/stats", params)
+
 def fetch_history(base: str, params: Dict[str, Any]):
     return fetch_history_cached(base, params)
 
@@ -150,50 +175,117 @@ def export_history(base: str, params: Dict[str, Any], fmt: str):
     r, err = safe_get(f"{base}/history/export", p, timeout=60)
     return r, err
 
-def run_scan(base: str, ip: str):
-    r, err = safe_get(f"{base}/scan", params={"ip": ip}, timeout=90)
-    return r, err
+def submit_scan_job(base: str, ip: str):
+    try:
+        r = requests.post(f"{base}/scan/jobs", params={"ip": ip}, timeout=10)
+        return r, None
+    except requests.RequestException as e:
+        return None, str(e)
+
+def wait_scan_job(base: str, job_id: str, on_progress=None, poll_every: float = 1.5):
+    """Consulta el progreso del job hasta que termina y devuelve su estado final."""
+    while True:
+        r, err = safe_get(f"{base}/scan/jobs/{job_id}/progress", timeout=10)
+        if err:
+            return None, err
+        if r.status_code != 200:
+            return None, f"{r.status_code} - {r.text}"
+        prog = r.json()
+        if on_progress:
+            on_progress(prog)
+        if prog.get("estado") in ("completado", "cancelado", "error"):
+            break
+        _time.sleep(poll_every)
+    return safe_get(f"{base}/scan/jobs/{job_id}", timeout=25)
+
+_BADGE_CLASS = {"crit": "badge badge-crit", "high": "badge badge-high", "med": "badge badge-med"}
+
+def alert_severity(a: str) -> str:
+    txt = a.lower()
+    if "crítico" in txt or "riesgo crítico" in txt or "🚨" in a:
+        return "crit"
+    if "alto" in txt or "⚠️" in a:
+        return "high"
+    return "med"
 
 def render_alert_badges(alertas: list[str]) -> str:
     if not alertas:
         return '<span class="badge badge-ok">Sin alertas</span>'
-    chips = []
-    for a in alertas:
-        sev = "med"
-        txt = a.lower()
-        if "crítico" in txt or "riesgo crítico" in txt or "🚨" in a:
-            sev = "crit"
-        elif "alto" in txt or "⚠️" in a:
-            sev = "high"
-        elif "medio" in txt:
-            sev = "med"
-        klass = {
-            "crit": "badge badge-crit",
-            "high": "badge badge-high",
-            "med":  "badge badge-med",
-        }[sev]
-        chips.append(f'<span class="{klass}">{a}</span>')
-    return "".join(chips)
+    return "".join(f'<span class="{_BADGE_CLASS[alert_severity(a)]}">{a}</span>' for a in alertas)
+
+def render_alert_rows(rows: list[dict]) -> str:
+    """Badges de todas las filas en un único bloque HTML (un solo st.markdown)."""
+    return "".join(
+        f"<div style='margin-bottom:6px;'><b>{r.get('ip')}</b> — {render_alert_badges(r.get('alertas', []))}</div>"
+        for r in rows
+    )
+
+HISTORY_COLUMNS = ["id", "ip", "fecha", "puertos", "alertas"]
 
 def flatten_history_rows(rows: list[dict]) -> pd.DataFrame:
-    records = []
-    for r in rows:
-        ports = r.get("puertos_abiertos", [])
-        ports_str = ", ".join(f'{p.get("puerto")}:{p.get("servicio")}' for p in ports) if isinstance(ports, list) else str(ports)
-        alerts = r.get("alertas", [])
-        alerts_str = " | ".join(alerts) if isinstance(alerts, list) else str(alerts)
-        records.append({
-            "id": r.get("id"),
-            "ip": r.get("ip"),
-            "fecha": r.get("fecha"),
-            "puertos": ports_str,
-            "alertas": alerts_str,
-        })
-    df = pd.DataFrame(records)
-    if not df.empty:
-        df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
-        df = df.sort_values(by="fecha", ascending=False)
-    return df
+    if not rows:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    raw = pd.DataFrame.from_records(rows, columns=["id", "ip", "fecha", "puertos_abiertos", "alertas"])
+    # puertos: una fila por puerto, formateo en bloque y vuelta a una celda por registro
+    ports = raw["puertos_abiertos"].explode().dropna()
+    ports_str = (ports.str.get("puerto").astype(str) + ":" + ports.str.get("servicio").astype(str)).groupby(level=0).agg(", ".join) \
+        if not ports.empty else pd.Series(dtype=object)
+    df = raw[["id", "ip"]].copy()
+    df["fecha"] = pd.to_datetime(raw["fecha"], errors="coerce")
+    df["puertos"] = ports_str.reindex(raw.index, fill_value="")
+    df["alertas"] = raw["alertas"].str.join(" | ").fillna("")
+    return df.sort_values(by="fecha", ascending=False)
+
+LIVE_INITIAL_ROWS = 500   # registros al abrir el dashboard
+LIVE_MAX_ROWS = 5000      # registros que se conservan en pantalla
+LIVE_REFRESH_S = 5
+
+def fetch_history_since(base: str, last_id: Optional[int]):
+    """Registros con id > last_id (los más recientes si aún no hay ninguno), sin caché."""
+    if last_id is None:
+        r, err = safe_get(f"{base}/history", {"order_by": "id", "order_dir": "desc", "limit": LIVE_INITIAL_ROWS})
+        if err:
+            return None, err
+        return (r.json(), None) if r.status_code == 200 else (None, f"{r.status_code} - {r.text}")
+    rows = []
+    while True:
+        params = {"order_by": "id", "order_dir": "asc", "limit": 1000, "desde_id": last_id}
+        r, err = safe_get(f"{base}/history", params)
+        if err:
+            return None, err
+        if r.status_code != 200:
+            return None, f"{r.status_code} - {r.text}"
+        page = r.json()
+        rows.extend(page)
+        if len(page) < 1000 or len(rows) >= LIVE_MAX_ROWS:
+            return rows, None
+        last_id = page[-1]["id"]
+
+def live_history(base: str):
+    """DataFrame del histórico en session_state; en cada llamada solo se piden y añaden los registros nuevos."""
+    state = st.session_state
+    if state.get("live_base") != base:
+        state.live_base = base
+        state.live_df = flatten_history_rows([])
+        state.live_last_id = None
+    rows, err = fetch_history_since(base, state.live_last_id)
+    if err:
+        return state.live_df, err
+    if rows:
+        nuevos = flatten_history_rows(rows)
+        df = pd.concat([nuevos, state.live_df], ignore_index=True) if not state.live_df.empty else nuevos
+        state.live_df = df.sort_values(by="id", ascending=False).head(LIVE_MAX_ROWS)
+        state.live_last_id = int(state.live_df["id"].max())
+    return state.live_df, None
+
+def render_live_history():
+    df, err = live_history(get_api_base())
+    if err:
+        st.error("No se pudo obtener el histórico.")
+        with st.expander("Detalles técnicos"):
+            st.code(err)
+    st.caption(f"{len(df)} registros · último id {st.session_state.get('live_last_id') or '-'}")
+    st.dataframe(df, use_container_width=True, hide_index=True, height=420)
 
 # ----------------------------
 # Header (limpio)
@@ -226,33 +318,36 @@ tabs = st.tabs(["📊 Dashboard", "🛰 Escanear", "📚 Histórico", "⚙️ Aj
 # ----------------------------
 with tabs[0]:
     st.subheader("Resumen del sistema")
-    params = {"order_by": "fecha", "order_dir": "desc", "limit": 100, "offset": 0}
-    data, err = fetch_history(get_api_base(), params)
+    stats, err = fetch_stats_cached(get_api_base(), {"top": 5})
     if err:
-        st.error("No se pudo obtener el histórico.")
+        st.error("No se pudieron obtener las métricas.")
         with st.expander("Detalles técnicos"):
             st.code(err)
     else:
-        df = flatten_history_rows(data)
         c1, c2, c3 = st.columns(3)
-        c1.metric("Registros", len(df))
-        if not df.empty:
-            last_dt = df["fecha"].max()
+        c1.metric("Registros", stats.get("registros", 0))
+        c1.metric("Hosts únicos", stats.get("hosts_unicos", 0))
+        if stats.get("ultimo_escaneo"):
+            last_dt = pd.to_datetime(stats["ultimo_escaneo"])
             c2.metric("Último escaneo", last_dt.strftime("%Y-%m-%d %H:%M:%S"))
-            all_ports = []
-            for row in data:
-                for p in row.get("puertos_abiertos", []):
-                    all_ports.append(str(p.get("puerto")))
-            top = pd.Series(all_ports).value_counts().head(5) if all_ports else pd.Series(dtype=int)
-            with c3:
-                st.write("**Top puertos**")
-                if not top.empty:
-                    st.dataframe(top.rename_axis("Puerto").reset_index(name="Frecuencia"), use_container_width=True, hide_index=True)
-                else:
-                    st.info("Aún no hay datos de puertos.")
-        st.markdown("<hr class='hr-term' />", unsafe_allow_html=True)
-        st.write("**Últimos registros**")
-        st.dataframe(df.head(20), use_container_width=True, hide_index=True)
+        sev = stats.get("alertas_por_severidad", {})
+        c2.metric("Alertas críticas / altas", f'{sev.get("critico", 0)} / {sev.get("alto", 0)}')
+        top = pd.DataFrame(stats.get("top_puertos", []))
+        with c3:
+            st.write("**Top puertos**")
+            if not top.empty:
+                st.dataframe(top.rename(columns={"puerto": "Puerto", "frecuencia": "Frecuencia"}), use_container_width=True, hide_index=True)
+            else:
+                st.info("Aún no hay datos de puertos.")
+
+    st.markdown("<hr class='hr-term' />", unsafe_allow_html=True)
+    st.write("**Últimos registros**")
+    auto = st.toggle(f"Auto-refrescar cada {LIVE_REFRESH_S} s", value=False, key="live_auto")
+    if auto and hasattr(st, "fragment"):
+        # solo se vuelve a ejecutar este bloque, pidiendo los registros nuevos
+        st.fragment(render_live_history, run_every=LIVE_REFRESH_S)()
+    else:
+        render_live_history()
 
 # ----------------------------
 # TAB: Escanear
@@ -262,16 +357,27 @@ with tabs[1]:
     ip_to_scan = st.text_input("IP o rango (CIDR)", "192.168.1.1", help="Ej.: 192.168.1.1 o 192.168.1.0/24")
     colx = st.columns([1, 1])
     if colx[0].button("🛰 Escanear ahora", type="primary"):
-        with st.spinner("Ejecutando escaneo..."):
-            r, err = run_scan(get_api_base(), ip_to_scan)
+        r, err = submit_scan_job(get_api_base(), ip_to_scan)
+        if not err and r is not None and r.status_code == 202:
+            job_id = r.json().get("job_id")
+            bar = st.progress(0.0, text="Ejecutando escaneo...")
+            def _on_progress(p):
+                bar.progress(min(p.get("porcentaje", 0) / 100, 1.0),
+                             text=f"Hosts {p.get('hosts_completados')}/{p.get('hosts_total')} · {p.get('estado')}")
+            r, err = wait_scan_job(get_api_base(), job_id, on_progress=_on_progress)
         if err or not r:
             st.error("No se pudo contactar con la API.")
             with st.expander("Detalles técnicos"):
                 st.code(str(err))
-        elif r.status_code != 200:
+        elif r.status_code not in (200, 202):
             st.error("La API devolvió un error.")
             with st.expander("Detalles técnicos"):
                 st.code(f"{r.status_code} - {r.text}")
+        elif r.json().get("estado") in ("error", "cancelado"):
+            payload = r.json()
+            st.error(f"Escaneo {payload.get('estado')}.")
+            with st.expander("Detalles técnicos"):
+                st.code(str(payload.get("error")))
         else:
             payload = r.json()
             st.success("Escaneo completado.")
@@ -294,7 +400,7 @@ with tabs[2]:
     with st.expander("Filtros", expanded=True):
         f1, f2, f3 = st.columns([1.2, 0.8, 0.8])
         with f1:
-            ip_q = st.text_input("IP contiene", "", placeholder="ej. 192.168.1.")
+            ip_q = st.text_input("IP / CIDR", "", placeholder="ej. 192.168.1.0/24")
         with f2:
             start_d = st.date_input("Desde (fecha)", value=None, format="YYYY-MM-DD")
             start_t = st.time_input("Desde (hora)", value=time(0, 0))
@@ -345,11 +451,7 @@ with tabs[2]:
             df = flatten_history_rows(data)
             st.dataframe(df, use_container_width=True, hide_index=True)
             st.write("**Alertas por fila**")
-            for r in data:
-                st.markdown(
-                    f"<div style='margin-bottom:6px;'><b>{r.get('ip')}</b> — {render_alert_badges(r.get('alertas', []))}</div>",
-                    unsafe_allow_html=True
-                )
+            st.markdown(render_alert_rows(data), unsafe_allow_html=True)
 
     if export_csv or export_json:
         fmt = "csv" if export_csv else "json"